@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+准入控制
+限制每个 worker 中同时等待上游的请求数, 超出时立即返回 503 + Retry-After,
+保证 /health 和缓存命中的请求总有线程可用。
+
+请求开始时登记路由(begin), 第一次需要访问上游或等待其他请求的上游调用时(SingleFlight、释义查询)
+才占用名额(enter_upstream), 请求结束时释放(end)。缓存命中的请求不占用名额, 也不会被拒绝;
+后台刷新线程不在请求上下文中, 不受限制; 批量接口的每一项在任务线程中各自登记, 与普通请求一样受限。
+
+名额分两层:
+- 全局: 所有路由合计, 默认为 worker 的处理线程数减去 ADMISSION_RESERVE
+- 路由: ADMISSION_ROUTE_LIMITS 中单独设置的路由上限, 如 "/api/video-url/<video_id>=1"
+"""
+
+import contextvars
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import metrics
+
+ENABLED = os.getenv('ADMISSION_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+# 为缓存命中和健康检查保留的线程数
+RESERVE = int(os.getenv('ADMISSION_RESERVE', 1))
+
+# 还没有耗时数据时返回的 Retry-After(秒)
+DEFAULT_RETRY_AFTER = float(os.getenv('ADMISSION_RETRY_AFTER', 5))
+
+# 平均耗时的平滑系数
+EWMA_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    """等待上游的请求已满"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_route_limits(text: str) -> Dict[str, int]:
+    """解析 "/api/video-url/<video_id>=1,/api/define=2" 形式的路由上限"""
+    limits = {}
+    for item in (text or '').split(','):
+        route, _, value = item.strip().rpartition('=')
+        if route:
+            limits[route.strip()] = int(value)
+    return limits
+
+
+class _Ticket:
+    """一个请求的准入状态"""
+
+    __slots__ = ('route', 'admitted_at', 'finished', 'released', 'lock')
+
+    def __init__(self, route: str):
+        self.route = route
+        # 同一个请求可能在多个线程中访问上游(上下文被复制到线程池)
+        self.lock = threading.Lock()
+        self.admitted_at: Optional[float] = None
+        self.finished = False
+        # 已提前释放名额(如开始转发媒体数据), 之后不再占用
+        self.released = False
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('admission_ticket', default=None)
+
+
+class AdmissionController:
+    """
+    进程内的准入控制
+
+    参数:
+        max_inflight: 全局上限, 0 表示不限制
+        route_limits: 路由 -> 上限
+    """
+
+    def __init__(self, max_inflight: int = 0, route_limits: Optional[Dict[str, int]] = None):
+        self._lock = threading.Lock()
+        self.max_inflight = max_inflight
+        self.route_limits = dict(route_limits or {})
+        self.inflight = 0
+        self._route_inflight: Dict[str, int] = {}
+        # 路由 -> 已准入请求的平均占用时间(秒), 用于估算 Retry-After
+        self._durations: Dict[str, float] = {}
+        self.admitted = 0
+        self.rejected = 0
+
+    def configure(self, max_inflight: int, route_limits: Optional[Dict[str, int]] = None):
+        with self._lock:
+            self.max_inflight = max_inflight
+            if route_limits is not None:
+                self.route_limits = dict(route_limits)
+
+    def retry_after(self, route: str) -> float:
+        with self._lock:
+            return self._retry_after(route)
+
+    def _retry_after(self, route: str) -> float:
+        duration = self._durations.get(route)
+        if duration is None:
+            return DEFAULT_RETRY_AFTER
+        return min(60.0, max(1.0, duration))
+
+    def acquire(self, route: str):
+        """占用一个名额, 已满时抛出 Overloaded"""
+        with self._lock:
+            route_inflight = self._route_inflight.get(route, 0)
+            route_limit = self.route_limits.get(route, 0)
+            if (self.max_inflight and self.inflight >= self.max_inflight) or \
+                    (route_limit and route_inflight >= route_limit):
+                self.rejected += 1
+                retry_after = self._retry_after(route)
+            else:
+                self.inflight += 1
+                self._route_inflight[route] = route_inflight + 1
+                self.admitted += 1
+                retry_after = None
+
+        if retry_after is not None:
+            metrics.inc('admission_rejected_total', {'route': route})
+            raise Overloaded("服务繁忙,请稍后重试", retry_after)
+        metrics.add_gauge('admission_in_flight', {'route': route}, 1)
+
+    def release(self, route: str, seconds: float):
+        with self._lock:
+            self.inflight -= 1
+            self._route_inflight[route] = self._route_inflight.get(route, 1) - 1
+            previous = self._durations.get(route)
+            self._durations[route] = seconds if previous is None else \
+                previous + EWMA_ALPHA * (seconds - previous)
+        metrics.add_gauge('admission_in_flight', {'route': route}, -1)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': ENABLED,
+                'max_inflight': self.max_inflight,
+                'route_limits': dict(self.route_limits),
+                'inflight': self.inflight,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'retry_after': {route: round(seconds, 2) for route, seconds in self._durations.items()},
+            }
+
+
+controller = AdmissionController(
+    max_inflight=int(os.getenv('ADMISSION_MAX_INFLIGHT', 0)),
+    route_limits=parse_route_limits(os.getenv('ADMISSION_ROUTE_LIMITS', '')),
+)
+
+
+def configure_for_threads(threads: int):
+    """
+    按 worker 的处理线程数设置全局上限(ADMISSION_MAX_INFLIGHT 已设置时不覆盖)
+    gunicorn 的 post_fork 钩子和 ASGI 模式的阻塞线程池调用
+    """
+    if os.getenv('ADMISSION_MAX_INFLIGHT'):
+        return
+    controller.configure(max(1, threads - RESERVE))
+
+
+# ----------------------------------------------------------------------
+# 请求生命周期
+# ----------------------------------------------------------------------
+
+def begin(route: str):
+    """请求开始时登记路由, 返回传给 end 的句柄"""
+    if not ENABLED:
+        return None
+    ticket = _Ticket(route)
+    return ticket, _current.set(ticket)
+
+
+def enter_upstream():
+    """
+    当前请求即将访问上游或等待上游结果, 占用名额(每个请求只占用一次)
+    名额已满时抛出 Overloaded; 不在请求上下文中时不做任何事
+    """
+    ticket = _current.get()
+    if ticket is None:
+        return
+    with ticket.lock:
+        if ticket.finished or ticket.released or ticket.admitted_at is not None:
+            return
+        controller.acquire(ticket.route)
+        ticket.admitted_at = time.perf_counter()
+
+
+def leave_upstream():
+    """
+    当前请求不再等待上游(如解析完成后开始长时间转发媒体数据), 提前释放名额
+    之后同一个请求不会再占用名额
+    """
+    ticket = _current.get()
+    if ticket is None:
+        return
+    with ticket.lock:
+        if ticket.finished or ticket.released:
+            return
+        ticket.released = True
+        if ticket.admitted_at is not None:
+            controller.release(ticket.route, time.perf_counter() - ticket.admitted_at)
+            ticket.admitted_at = None
+
+
+def end(handle):
+    """请求结束, 释放名额(可重复调用)"""
+    if handle is None:
+        return
+    ticket, token = handle
+    with ticket.lock:
+        if ticket.finished:
+            return
+        ticket.finished = True
+        if ticket.admitted_at is not None:
+            controller.release(ticket.route, time.perf_counter() - ticket.admitted_at)
+    try:
+        _current.reset(token)
+    except ValueError:
+        # 在其他上下文中结束
+        _current.set(None)
+
+
+def stats() -> Dict:
+    return controller.stats()
@@ -4,12 +4,38 @@ YouTube 字幕服务 API
 提供 YouTube 视频字幕获取功能
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
-from youtube_transcript_api import YouTubeTranscriptApi
-from youtube_transcript_api.formatters import SRTFormatter
+import contextvars
+import json
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from youtube_iiilab import IIILabYouTubeService, extract_video_id, build_youtube_url
+from transcript_store import TranscriptStore, parse_translation_source
+from transcript_resolver import TranscriptResolver
+from search_index import MAX_SEARCH_RESULTS, TranscriptSearch
+from media_cache import MediaURLCache
+from refresher import BackgroundRefresher
+from singleflight import SingleFlight
+from rate_limiter import PRIORITY_BACKGROUND, PRIORITY_BATCH, RateLimitExceeded
+from admission import Overloaded
+from subtitle_formats import TIMESTAMP_COLUMNS_CONTENT_TYPE, RenderCache, dumps_compact, encode_timestamp_columns
+from http_cache import Representation, make_etag, negotiate
+from vocab_index import VocabCache
+from dictionary import DictionaryService
+from extractor_router import ExtractorBackend, ExtractorRouter, normalize_snapany, normalize_ytdlp
+from cache_snapshot import CacheSnapshot
+from bilingual import AlignCache
+from media_proxy import MediaProxy, RangeNotSatisfiable, UpstreamStreamError, create_block_cache, select_stream_url
+import admission
+import http_cache
+import media_proxy
+import metrics
+import profiling
+import upstream_http
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
@@ -18,8 +44,822 @@ CORS(app)  # 允许跨域请求
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 合并相同视频的并发上游请求
+upstream_flight = SingleFlight()
+
+# 播放地址缓存(/api/youtube-info 和 /api/video-url 共用)
+media_cache = MediaURLCache()
+
+# 后台刷新: 过期缓存先返回旧数据并在后台续期, 热门条目提前刷新
+refresher = BackgroundRefresher()
+
 # 初始化 iiilab YouTube 服务
-iiilab_service = IIILabYouTubeService()
+iiilab_service = IIILabYouTubeService(flight=upstream_flight, cache=media_cache, refresher=refresher)
+
+# 字幕持久化存储(所有 worker 共享)
+transcript_store = TranscriptStore()
+
+# 已缓存字幕的全文搜索索引(后台建立)
+transcript_search = TranscriptSearch()
+
+# 字幕目录与语言解析计划(各字幕接口共用)
+transcript_resolver = TranscriptResolver(transcript_store, upstream_flight, refresher, search_index=transcript_search)
+
+# SRT / VTT / 时间戳 JSON 渲染结果(按字幕内容缓存)
+rendered_transcripts = RenderCache()
+
+# 双语字幕对齐结果(按两条字幕的内容缓存)
+aligned_transcripts = AlignCache()
+
+# 词汇倒排索引(与字幕一起存储)
+vocab_cache = VocabCache(transcript_store)
+
+# 单词释义(持久化缓存 + 批量上游请求)
+dictionary_service = DictionaryService()
+
+# 单次 /api/define 请求最多查询的单词数
+DEFINE_MAX_WORDS = int(os.getenv('DEFINE_MAX_WORDS', 50))
+
+
+def _collect_upstream_counters():
+    """限流拒绝次数和 SingleFlight 合并次数(进程内累计值)"""
+    scheduler = iiilab_service.scheduler
+    yield 'counter', 'ratelimit_rejected_total', {'limiter': scheduler.name}, scheduler.stats()['rejected']
+    for operation, counts in upstream_flight.stats()['operations'].items():
+        for result in ('executed', 'coalesced'):
+            yield 'counter', 'singleflight_calls_total', {'operation': operation, 'result': result}, counts[result]
+
+
+# 指标: 各缓存的命中率和上游调用统计
+metrics.register_cache('media', media_cache.stats)
+metrics.register_cache('transcript_store', transcript_store.stats)
+metrics.register_cache('transcript_lists', transcript_resolver.stats)
+metrics.register_cache('render', rendered_transcripts.stats)
+metrics.register_cache('bilingual', aligned_transcripts.stats)
+metrics.register_cache('vocab', vocab_cache.stats)
+metrics.register_cache('response', http_cache.stats)
+metrics.register_cache('dictionary', dictionary_service.stats)
+metrics.register_collector(_collect_upstream_counters)
+
+# 批量接口的并发上限(所有批量请求共用)
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 4))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 100))
+# 批量任务等待 SnapAny 频率限制的最长时间(秒): 占用的是批量线程而不是请求线程, 可以比单个请求等得久
+BATCH_MAX_WAIT = float(os.getenv('BATCH_MAX_WAIT', 30))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+
+# 双语字幕并行获取次语言字幕的线程数
+BILINGUAL_WORKERS = int(os.getenv('BILINGUAL_WORKERS', 4))
+bilingual_executor = ThreadPoolExecutor(max_workers=BILINGUAL_WORKERS, thread_name_prefix='bilingual')
+
+
+def _rate_limited_response(error, video_id):
+    """上游限流时返回 429 和 Retry-After"""
+    retry_after = max(1, int(error.retry_after + 0.999))
+    response = jsonify({
+        'success': False,
+        'error': str(error),
+        'retry_after': retry_after,
+        'video_id': video_id
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _overloaded_response(error, video_id=None):
+    """等待上游的请求已满时返回 503 和 Retry-After"""
+    retry_after = max(1, int(error.retry_after + 0.999))
+    body = {
+        'success': False,
+        'error': str(error),
+        'retry_after': retry_after,
+    }
+    if video_id is not None:
+        body['video_id'] = video_id
+    response = jsonify(body)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+JSON_CONTENT_TYPE = 'application/json'
+
+# 纯文本字幕格式及其 Content-Type
+SUBTITLE_FORMATS = {
+    'srt': 'application/x-subrip; charset=utf-8',
+    'vtt': 'text/vtt; charset=utf-8',
+}
+
+# 时间戳接口可协商的格式, 第一个为默认格式
+TIMESTAMP_CONTENT_TYPES = [JSON_CONTENT_TYPE, TIMESTAMP_COLUMNS_CONTENT_TYPE]
+
+
+def _load_subtitles(video_id, preferred_lang):
+    return transcript_resolver.load(video_id, [preferred_lang])
+
+
+def _subtitles_body(video_id, entry, available_languages):
+    index = entry['index']
+    return {
+        'success': True,
+        'video_id': video_id,
+        'language': entry['language_code'],
+        'language_name': entry['language_name'],
+        'is_generated': entry['is_generated'],
+        'subtitle_srt': rendered_transcripts.get(index).srt,
+        'subtitle_count': len(index),
+        'available_languages': available_languages
+    }
+
+
+def subtitles_payload(video_id, preferred_lang='en'):
+    """
+    获取 YouTube 视频字幕(供各服务模式共用)
+    
+    返回:
+        /api/subtitles 的响应数据
+    """
+    entry, available_languages = _load_subtitles(video_id, preferred_lang)
+    return _subtitles_body(video_id, entry, available_languages)
+
+
+def subtitles_representation(video_id, preferred_lang='en', fmt='json'):
+    """
+    获取 YouTube 视频字幕, 返回可条件请求和压缩的响应
+    
+    参数:
+        fmt: json(默认) / srt / vtt
+    """
+    if fmt != 'json' and fmt not in SUBTITLE_FORMATS:
+        raise ValueError(f"不支持的字幕格式: {fmt}")
+    
+    entry, available_languages = _load_subtitles(video_id, preferred_lang)
+    index = entry['index']
+    
+    if fmt in SUBTITLE_FORMATS:
+        return Representation(
+            make_etag(fmt, index.digest()), SUBTITLE_FORMATS[fmt],
+            lambda: getattr(rendered_transcripts.get(index), fmt).encode('utf-8')
+        )
+    
+    etag = make_etag(
+        'subtitles', video_id, index.digest(), entry['language_code'], entry['language_name'],
+        entry['is_generated'], dumps_compact(available_languages)
+    )
+    return Representation(
+        etag, JSON_CONTENT_TYPE,
+        lambda: dumps_compact(_subtitles_body(video_id, entry, available_languages)).encode('utf-8')
+    )
+
+
+def languages_payload(video_id):
+    """
+    获取视频可用的字幕语言列表(供各服务模式共用)
+    
+    返回:
+        /api/languages 的响应数据
+    """
+    return {
+        'success': True,
+        'video_id': video_id,
+        'languages': transcript_resolver.catalog(video_id)
+    }
+
+
+def languages_representation(video_id):
+    """获取视频可用的字幕语言列表, 返回可条件请求和压缩的响应"""
+    payload = languages_payload(video_id)
+    body = dumps_compact(payload).encode('utf-8')
+    return Representation(make_etag('languages', body), JSON_CONTENT_TYPE, lambda: body)
+
+
+def _select_video_url(info):
+    """从 yt-dlp 的解析结果中选择播放地址"""
+    video_url = None
+    
+    # 优先从 formats 中选择合适的格式
+    if 'formats' in info and info['formats']:
+        # 第一优先级:寻找包含视频和音频的格式
+        for fmt in reversed(info['formats']):
+            if (fmt.get('url') and 
+                fmt.get('vcodec') != 'none' and 
+                fmt.get('acodec') != 'none' and
+                'storyboard' not in fmt.get('format_id', '')):
+                video_url = fmt['url']
+                break
+        
+        # 第二优先级:如果没有合并格式,尝试找 HLS 流
+        if not video_url:
+            for fmt in info['formats']:
+                if (fmt.get('url') and 
+                    fmt.get('protocol') == 'm3u8_native' and
+                    'storyboard' not in fmt.get('format_id', '')):
+                    video_url = fmt['url']
+                    break
+        
+        # 第三优先级:任何有视频的格式(可能没有音频)
+        if not video_url:
+            for fmt in reversed(info['formats']):
+                if (fmt.get('url') and 
+                    fmt.get('vcodec') != 'none' and
+                    'storyboard' not in fmt.get('format_id', '')):
+                    video_url = fmt['url']
+                    break
+    
+    # 备用方案:使用 info 中的 url
+    if not video_url and 'url' in info:
+        video_url = info['url']
+    
+    if not video_url or 'storyboard' in video_url:
+        raise Exception("无法提取有效的视频 URL")
+    
+    return video_url
+
+
+def video_url_payload(video_id, quality='720p', force=False):
+    """
+    使用 yt-dlp 获取视频播放地址(供各服务模式共用)
+    
+    参数:
+        force: 忽略缓存重新解析
+    
+    返回:
+        /api/video-url 的响应数据
+    """
+    cache_key = f"video_url_{video_id}_{quality}"
+    entry = None if force else media_cache.get_entry(cache_key)
+    if entry is not None:
+        refresh_key = f"yt_dlp:{video_id}:{quality}"
+        refresh = partial(video_url_payload, video_id, quality, force=True)
+        refresher.touch(refresh_key, refresh, entry['expires_at'])
+        if entry['stale']:
+            refresher.schedule(refresh_key, refresh)
+        return entry['value']
+    
+    info = ytdlp_info(video_id)
+    video_url = _select_video_url(info)
+    
+    # 获取视频信息
+    video_info = {
+        'success': True,
+        'video_id': video_id,
+        'title': info.get('title'),
+        'duration': info.get('duration'),
+        'video_url': video_url,
+        'thumbnail': info.get('thumbnail'),
+        'description': (info.get('description') or '')[:200]
+    }
+    
+    # 有效期由 video_url 的 expire 参数决定
+    media_cache.set(cache_key, video_info)
+    return video_info
+
+
+def ytdlp_info(video_id):
+    """使用 yt-dlp 解析视频(相同视频的并发请求只解析一次)"""
+    def load():
+        import yt_dlp
+        
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+        }
+        
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl, metrics.upstream('yt_dlp.extract_info'):
+            return ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+    
+    return upstream_flight.do(f"yt_dlp:{video_id}", load)
+
+
+# 播放地址解析路由: SnapAny 与 yt-dlp 按耗时和错误率选择, 慢时对冲, 失败时熔断
+extractor_router = ExtractorRouter([
+    ExtractorBackend('snapany', lambda video_id: normalize_snapany(
+        iiilab_service.extract_video_info(build_youtube_url(video_id)), video_id)),
+    ExtractorBackend('yt_dlp', lambda video_id: normalize_ytdlp(ytdlp_info(video_id), video_id)),
+], cache=media_cache)
+metrics.register_collector(extractor_router.collect_metrics)
+
+
+def extract_payload(video_id):
+    """
+    通过解析路由获取播放地址(供各服务模式共用)
+    
+    返回:
+        /api/extract 的响应数据(统一格式, source 为实际使用的解析服务)
+    """
+    _, extracted_id = resolve_youtube_target(video_id)
+    return extractor_router.extract(extracted_id)
+
+
+def stream_url(video_id, fmt, force=False):
+    """
+    代理播放时解析上游地址(与 /api/extract 共用解析结果)
+    
+    参数:
+        force: 丢弃缓存的解析结果重新解析(地址失效时)
+    """
+    _, extracted_id = resolve_youtube_target(video_id)
+    if force:
+        media_cache.pop(f"extract_{extracted_id}")
+    return select_stream_url(extractor_router.extract(extracted_id), fmt)
+
+
+# 播放地址代理: 转发 Range 请求, 上游连接池和可选的磁盘块缓存
+stream_proxy = MediaProxy(stream_url, cache=create_block_cache())
+if stream_proxy.cache is not None:
+    metrics.register_cache('stream_blocks', stream_proxy.cache.stats)
+
+
+def warm_video(video_id):
+    """
+    预热一个视频(启动后在后台调用): 语言列表、默认语言字幕和 SnapAny 解析结果
+    已缓存的部分直接命中, 上游请求使用后台优先级
+    """
+    subtitles_payload(video_id)
+    iiilab_service.extract_video_info(build_youtube_url(video_id), priority=PRIORITY_BACKGROUND)
+
+
+# 缓存快照: 启动时(preload 时在 fork 之前)恢复未过期的条目, 各 worker 定期保存
+cache_snapshot = CacheSnapshot(media_cache, transcript_store, rendered_transcripts, warm=warm_video)
+cache_snapshot.restore()
+
+
+def resolve_youtube_target(video_id):
+    """
+    将视频 ID 或完整 URL 转换为 (youtube_url, extracted_id)
+    
+    无法识别时抛出异常
+    """
+    # 构建完整的 YouTube URL
+    if 'youtube.com' in video_id or 'youtu.be' in video_id:
+        youtube_url = video_id
+        extracted_id = extract_video_id(video_id)
+    else:
+        youtube_url = build_youtube_url(video_id)
+        extracted_id = video_id
+    
+    if not extracted_id:
+        raise Exception("无效的 YouTube 视频 ID 或 URL")
+    
+    return youtube_url, extracted_id
+
+
+# 按时间窗口查询时单次最多返回的字幕条数
+MAX_WINDOW_CUES = 1000
+
+
+def parse_timestamp_window(params):
+    """
+    从请求参数中读取时间窗口
+    
+    支持:
+        from / to: 返回与 [from, to) 秒重叠的字幕
+        around / count: 返回播放位置附近的 count 条字幕(默认 20)
+    
+    返回:
+        窗口参数字典, 未指定时返回 None
+    """
+    try:
+        if params.get('around') is not None:
+            count = int(params.get('count', 20))
+            return {'around': float(params['around']), 'count': max(0, min(count, MAX_WINDOW_CUES))}
+        if params.get('from') is not None or params.get('to') is not None:
+            start = float(params.get('from', 0))
+            end = float(params['to']) if params.get('to') is not None else float('inf')
+            return {'from': start, 'to': end}
+    except (TypeError, ValueError):
+        raise ValueError("时间窗口参数必须是数字")
+    return None
+
+
+def _load_timestamps(video_id, languages, window):
+    """获取时间戳字幕, 返回 (entry, lo, hi)"""
+    logger.info(f"获取视频 {video_id} 的时间戳字幕,语言: {languages}")
+    
+    entry, _ = transcript_resolver.load(video_id, languages)
+    index = entry['index']
+    
+    # 按时间窗口二分查找
+    if window is None:
+        lo, hi = 0, len(index)
+    elif 'around' in window:
+        lo, hi = index.around(window['around'], window['count'])
+    else:
+        lo, hi = index.window(window['from'], window['to'])
+        hi = min(hi, lo + MAX_WINDOW_CUES)
+    return entry, lo, hi
+
+
+def _timestamps_head(video_id, entry, lo, hi, window):
+    """时间戳字幕响应中除 timestamps 以外的字段"""
+    head = {
+        'success': True,
+        'video_id': video_id,
+        'language': entry['language_code'],
+        'count': hi - lo
+    }
+    if window is not None:
+        head['total_count'] = len(entry['index'])
+        head['range'] = {'start_index': lo, 'end_index': hi}
+    return head
+
+
+def timestamps_payload(video_id, languages, window=None):
+    """
+    获取带时间戳字幕(供各服务模式共用)
+    
+    参数:
+        window: parse_timestamp_window 的结果, 为 None 时返回全部字幕
+    
+    返回:
+        /api/video-timestamps 的响应数据
+    """
+    entry, lo, hi = _load_timestamps(video_id, languages, window)
+    
+    # 转换为时间戳格式
+    timestamps = entry['index'].to_segments(lo, hi)
+    logger.info(f"成功获取 {len(timestamps)} 条字幕")
+    
+    payload = _timestamps_head(video_id, entry, lo, hi, window)
+    payload['timestamps'] = timestamps
+    return payload
+
+
+def timestamps_representation(video_id, languages, window=None, accept=None):
+    """
+    获取带时间戳字幕, 返回可条件请求和压缩的响应
+    
+    参数:
+        accept: 请求的 Accept 头, 接受 TIMESTAMP_COLUMNS_CONTENT_TYPE 时返回按列的二进制格式, 默认 JSON
+    """
+    entry, lo, hi = _load_timestamps(video_id, languages, window)
+    index = entry['index']
+    content_type = negotiate(accept, TIMESTAMP_CONTENT_TYPES)
+    etag = make_etag('timestamps', video_id, index.digest(), entry['language_code'], window is not None, lo, hi,
+                     content_type)
+    
+    if content_type == TIMESTAMP_COLUMNS_CONTENT_TYPE:
+        return Representation(
+            etag, content_type,
+            lambda: encode_timestamp_columns(_timestamps_head(video_id, entry, lo, hi, window), index, lo, hi),
+            vary='Accept, Accept-Encoding'
+        )
+    
+    def render():
+        # 完整字幕直接拼接预先渲染的 JSON
+        if window is None:
+            timestamps = rendered_transcripts.get(index).timestamps
+        else:
+            timestamps = dumps_compact(index.to_segments(lo, hi))
+        head = dumps_compact(_timestamps_head(video_id, entry, lo, hi, window))
+        return f'{head[:-1]},"timestamps":{timestamps}}}'.encode('utf-8')
+    
+    return Representation(etag, JSON_CONTENT_TYPE, render, vary='Accept, Accept-Encoding')
+
+
+def _track_info(entry):
+    """双语字幕响应中一条字幕轨的语言信息"""
+    return {
+        'language': entry['language_code'],
+        'language_name': entry['language_name'],
+        'is_generated': entry['is_generated'],
+        'translated_from': parse_translation_source(entry['translated_from'])[0],
+    }
+
+
+def _load_bilingual(video_id, primary, secondary):
+    """
+    并行获取两种语言的字幕(字幕列表由 SingleFlight 合并, 只请求一次), 返回 (主语言 entry, 次语言 entry)
+    次语言在线程池中获取, 主语言在当前线程获取; 线程池沿用当前请求的上下文, 两者都受准入控制
+    """
+    logger.info(f"获取视频 {video_id} 的双语字幕: {primary} + {secondary}")
+    context = contextvars.copy_context()
+    future = bilingual_executor.submit(context.run, transcript_resolver.load, video_id, [secondary])
+    try:
+        primary_entry, _ = transcript_resolver.load(video_id, [primary])
+    except Exception:
+        future.cancel()
+        raise
+    secondary_entry, _ = future.result()
+    return primary_entry, secondary_entry
+
+
+def _bilingual_body(video_id, primary_entry, secondary_entry):
+    cues = aligned_transcripts.get(primary_entry['index'], secondary_entry['index'])
+    return {
+        'success': True,
+        'video_id': video_id,
+        'primary': _track_info(primary_entry),
+        'secondary': _track_info(secondary_entry),
+        'count': len(cues),
+        'cues': cues
+    }
+
+
+def bilingual_payload(video_id, primary='en', secondary='zh-Hans'):
+    """
+    获取按时间对齐的双语字幕(供各服务模式共用)
+    
+    返回:
+        /api/bilingual 的响应数据
+    """
+    primary_entry, secondary_entry = _load_bilingual(video_id, primary, secondary)
+    return _bilingual_body(video_id, primary_entry, secondary_entry)
+
+
+def bilingual_representation(video_id, primary='en', secondary='zh-Hans'):
+    """获取按时间对齐的双语字幕, 返回可条件请求和压缩的响应(对齐结果随响应体按 ETag 缓存)"""
+    primary_entry, secondary_entry = _load_bilingual(video_id, primary, secondary)
+    etag = make_etag(
+        'bilingual', video_id,
+        primary_entry['index'].digest(), dumps_compact(_track_info(primary_entry)),
+        secondary_entry['index'].digest(), dumps_compact(_track_info(secondary_entry))
+    )
+    return Representation(
+        etag, JSON_CONTENT_TYPE,
+        lambda: dumps_compact(_bilingual_body(video_id, primary_entry, secondary_entry)).encode('utf-8')
+    )
+
+
+def _vocab_body(video_id, entry, vocab, word=None, limit=None, min_count=1):
+    index = entry['index']
+    if word is not None:
+        found = vocab.lookup(word)
+        items = [found] if found is not None else []
+    else:
+        items = [item for item in vocab.ranked() if item[1] >= min_count]
+        if limit is not None:
+            items = items[:limit]
+    
+    return {
+        'success': True,
+        'video_id': video_id,
+        'language': entry['language_code'],
+        'total_words': vocab.tokens,
+        'unique_words': len(vocab.words),
+        'words': [
+            {
+                'word': lemma,
+                'count': count,
+                'forms': forms,
+                'cues': cues.tolist(),
+                'starts': [index.starts[cue] for cue in cues]
+            }
+            for lemma, count, forms, cues in items
+        ]
+    }
+
+
+def vocab_payload(video_id, languages, word=None, limit=None, min_count=1):
+    """
+    获取视频的词汇索引(供各服务模式共用)
+    
+    参数:
+        word: 只查询该单词(任意词形)
+        limit: 最多返回的词数(按出现次数从高到低)
+        min_count: 最少出现次数
+    
+    返回:
+        /api/vocab 的响应数据
+    """
+    entry, _ = transcript_resolver.load(video_id, languages)
+    key = (video_id, entry['language_code'], entry['is_generated'], entry['translated_from'])
+    vocab = vocab_cache.get(key, entry['index'])
+    return _vocab_body(video_id, entry, vocab, word, limit, min_count)
+
+
+def vocab_representation(video_id, languages, word=None, limit=None, min_count=1):
+    """获取视频的词汇索引, 返回可条件请求和压缩的响应"""
+    entry, _ = transcript_resolver.load(video_id, languages)
+    index = entry['index']
+    key = (video_id, entry['language_code'], entry['is_generated'], entry['translated_from'])
+    etag = make_etag('vocab', video_id, index.digest(), entry['language_code'], word, limit, min_count)
+    return Representation(etag, JSON_CONTENT_TYPE, lambda: dumps_compact(
+        _vocab_body(video_id, entry, vocab_cache.get(key, index), word, limit, min_count)
+    ).encode('utf-8'))
+
+
+def parse_vocab_params(params):
+    """
+    读取 /api/vocab 的查询参数
+    
+    返回:
+        (word, limit, min_count) 元组
+    """
+    try:
+        limit = int(params['limit']) if params.get('limit') is not None else None
+        min_count = int(params.get('min_count', 1))
+    except (TypeError, ValueError):
+        raise ValueError("limit / min_count 必须是整数")
+    return params.get('word') or None, limit, min_count
+
+
+def search_payload(params):
+    """
+    在已缓存的字幕中搜索短语(供各服务模式共用)
+    
+    参数:
+        params: 查询参数, q(必需) / limit / video_id / lang
+    
+    返回:
+        /api/search 的响应数据
+    """
+    query = (params.get('q') or '').strip()
+    if not query:
+        raise ValueError("缺少查询参数 q")
+    try:
+        limit = int(params.get('limit', 20))
+    except (TypeError, ValueError):
+        raise ValueError("limit 必须是整数")
+    
+    results = transcript_search.search(
+        query, limit=min(limit, MAX_SEARCH_RESULTS),
+        video_id=params.get('video_id'), language=params.get('lang')
+    )
+    return {
+        'success': True,
+        'query': query,
+        'count': len(results),
+        'results': results
+    }
+
+
+def define_payload(words):
+    """
+    批量查询单词释义(供各服务模式共用)
+    
+    参数:
+        words: 单词列表, 或逗号分隔的字符串
+    
+    返回:
+        /api/define 的响应数据
+    """
+    if isinstance(words, str):
+        words = words.split(',')
+    if not isinstance(words, list) or not all(isinstance(word, str) for word in words):
+        raise ValueError("words 必须是字符串数组")
+    if not any(word.strip() for word in words):
+        raise ValueError("缺少参数 words")
+    if len(words) > DEFINE_MAX_WORDS:
+        raise ValueError(f"单次最多查询 {DEFINE_MAX_WORDS} 个单词")
+    
+    result = dictionary_service.define(words)
+    return {
+        'success': True,
+        'count': len(result['definitions']),
+        'definitions': result['definitions'],
+        'errors': result['errors']
+    }
+
+
+def _timestamp_languages():
+    """从 GET 参数或 POST 请求体中读取语言列表"""
+    # 支持 GET 和 POST 请求
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        return data.get('languages', ['en'])
+    
+    lang_param = request.args.get('languages', 'en')
+    return [lang_param] if isinstance(lang_param, str) else lang_param
+
+
+def _timestamp_window():
+    """从 URL 参数(POST 时也可以放在请求体中)读取时间窗口"""
+    params = dict(request.args.items())
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        params.update({k: data[k] for k in ('from', 'to', 'around', 'count') if k in data})
+    return parse_timestamp_window(params)
+
+
+def _send(representation):
+    """按 If-None-Match / Accept-Encoding 发送响应"""
+    status, body, headers = representation.respond(
+        request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding')
+    )
+    return Response(body, status=status, headers=headers)
+
+
+def _error_response(e, video_id):
+    """统一的错误响应"""
+    if isinstance(e, RateLimitExceeded):
+        return _rate_limited_response(e, video_id)
+    if isinstance(e, Overloaded):
+        return _overloaded_response(e, video_id)
+    return jsonify({
+        'success': False,
+        'error': str(e),
+        'video_id': video_id
+    }), 400
+
+
+def _batch_youtube_info(video_id, options):
+    youtube_url, _ = resolve_youtube_target(video_id)
+    return iiilab_service.extract_video_info(youtube_url, priority=PRIORITY_BATCH, max_wait=BATCH_MAX_WAIT)
+
+
+# 批量接口支持的操作: 操作名 -> 处理函数(video_id, options)
+BATCH_OPERATIONS = {
+    'subtitles': lambda video_id, options: subtitles_payload(video_id, options.get('lang', 'en')),
+    'languages': lambda video_id, options: languages_payload(video_id),
+    'bilingual': lambda video_id, options: bilingual_payload(
+        video_id, options.get('primary', 'en'), options.get('secondary', 'zh-Hans')),
+    'youtube-info': _batch_youtube_info,
+}
+
+
+def _parse_batch_items(data):
+    """
+    解析批量请求
+
+    支持两种格式:
+        {"items": [{"video_id": "...", "op": "subtitles", "lang": "en"}, ...]}
+        {"video_ids": ["...", ...], "ops": ["subtitles", "languages"], "lang": "en"}
+    """
+    if 'items' in data:
+        items = data['items']
+    else:
+        video_ids = data.get('video_ids') or []
+        ops = data.get('ops') or ['subtitles']
+        options = {k: v for k, v in data.items() if k not in ('video_ids', 'ops')}
+        items = [dict(options, video_id=video_id, op=op) for video_id in video_ids for op in ops]
+
+    if not isinstance(items, list) or not items:
+        raise ValueError("请求中没有需要处理的视频")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"单次最多处理 {BATCH_MAX_ITEMS} 项")
+
+    for item in items:
+        if not isinstance(item, dict) or not item.get('video_id'):
+            raise ValueError("每一项都必须包含 video_id")
+        if item.get('op', 'subtitles') not in BATCH_OPERATIONS:
+            raise ValueError(f"不支持的操作: {item.get('op')}")
+    return items
+
+
+def _run_batch_item(index, item):
+    """
+    执行批量请求中的一项,结果与单独调用接口时的响应一致
+    每一项在批量任务线程中单独登记准入(路由为 /api/batch),需要访问上游时与普通请求一样占用名额
+    """
+    video_id = item['video_id']
+    op = item.get('op', 'subtitles')
+    line = {'index': index, 'video_id': video_id, 'op': op}
+    ticket = admission.begin('/api/batch')
+    try:
+        line['status'] = 200
+        line['result'] = BATCH_OPERATIONS[op](video_id, item)
+    except RateLimitExceeded as e:
+        line['status'] = 429
+        line['result'] = {'success': False, 'error': str(e), 'retry_after': max(1, int(e.retry_after + 0.999))}
+    except Overloaded as e:
+        line['status'] = 503
+        line['result'] = {'success': False, 'error': str(e), 'retry_after': max(1, int(e.retry_after + 0.999)),
+                          'video_id': video_id}
+    except Exception as e:
+        line['status'] = 400
+        line['result'] = {'success': False, 'error': str(e), 'video_id': video_id}
+    finally:
+        admission.end(ticket)
+    return line
+
+
+@app.before_request
+def _start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.perf_counter()
+    g.timing = profiling.begin(g.metrics_route, request.headers.get('X-Profile'))
+    g.admission = admission.begin(g.metrics_route)
+    metrics.add_gauge('http_requests_in_flight', {'route': g.metrics_route}, 1)
+
+
+@app.after_request
+def _record_response_status(response):
+    g.metrics_status = response.status_code
+    # Server-Timing 和性能分析结果
+    response.headers.update(profiling.finish(g.pop('timing', None)))
+    return response
+
+
+@app.teardown_request
+def _finish_request_metrics(error=None):
+    profiling.finish(g.pop('timing', None))
+    admission.end(g.pop('admission', None))
+    route = g.pop('metrics_route', None)
+    if route is None:
+        return
+    metrics.add_gauge('http_requests_in_flight', {'route': route}, -1)
+    metrics.observe_request(route, request.method, g.pop('metrics_status', 500),
+                            time.perf_counter() - g.metrics_started)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 指标(汇总所有 worker)"""
+    if not metrics.ENABLED:
+        return jsonify({'success': False, 'error': '指标已关闭(METRICS_ENABLED=0)'}), 404
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/health', methods=['GET'])
@@ -28,7 +868,23 @@ def health_check():
     return jsonify({
         'status': 'ok',
         'service': 'YouTube Subtitle Service',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'singleflight': upstream_flight.stats(),
+        'snapany_scheduler': iiilab_service.scheduler.stats(),
+        'refresher': refresher.stats(),
+        'media_cache': media_cache.stats(),
+        'transcript_lists': transcript_resolver.stats(),
+        'render_cache': rendered_transcripts.stats(),
+        'bilingual_cache': aligned_transcripts.stats(),
+        'vocab_cache': vocab_cache.stats(),
+        'search': transcript_search.stats(),
+        'dictionary': dictionary_service.stats(),
+        'upstream_http': upstream_http.stats(),
+        'admission': admission.stats(),
+        'extractors': extractor_router.stats(),
+        'cache_snapshot': cache_snapshot.stats(),
+        'stream_proxy': stream_proxy.stats(),
+        'response_cache': http_cache.stats()
     })
 
 
@@ -40,80 +896,19 @@ def get_subtitles(video_id):
     参数:
         video_id: YouTube 视频 ID
         lang: 语言代码(可选,默认: en)
+        format: json(默认) / srt / vtt
     
     返回:
-        JSON 格式的字幕数据
+        JSON 格式的字幕数据, format 为 srt / vtt 时返回字幕文件
     """
     try:
         # 获取语言参数(默认英文)
         preferred_lang = request.args.get('lang', 'en')
-        
-        # 获取字幕列表
-        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-        
-        # 扩展语言匹配逻辑
-        zh_variants = ['zh-Hans', 'zh-Hant', 'zh', 'zh-CN', 'zh-TW', 'zh-HK', 'zh-SG']
-        en_variants = ['en', 'en-US', 'en-GB']
-        
-        # 尝试获取指定语言的字幕
-        try:
-            # 如果是中文, 尝试所有变体
-            lang_to_search = zh_variants if preferred_lang.startswith('zh') else [preferred_lang]
-            transcript = transcript_list.find_transcript(lang_to_search)
-        except:
-            # 如果指定语言不存在, 尝试翻译
-            try:
-                # 优先找英文进行翻译
-                try:
-                    source_transcript = transcript_list.find_transcript(en_variants)
-                except:
-                    # 没英文就找第一个可用的
-                    source_transcript = list(transcript_list)[0]
-                
-                transcript = source_transcript.translate(preferred_lang)
-            except Exception as te:
-                # 如果翻译失败, 回退到获取第一个可用字幕
-                available_transcripts = list(transcript_list)
-                if not available_transcripts:
-                    raise Exception("No subtitles available for this video")
-                transcript = available_transcripts[0]
-        
-        # 获取字幕数据
-        subtitle_data = transcript.fetch()
-        
-        # 格式化为 SRT
-        formatter = SRTFormatter()
-        srt_formatted = formatter.format_transcript(subtitle_data)
-        
-        # 获取可用语言列表
-        available_languages = [
-            {
-                'code': t.language_code,
-                'name': t.language,
-                'is_generated': t.is_generated,
-                'is_translatable': t.is_translatable
-            }
-            for t in transcript_list
-        ]
-        
-        
-        return jsonify({
-            'success': True,
-            'video_id': video_id,
-            'language': transcript.language_code,
-            'language_name': transcript.language,
-            'is_generated': transcript.is_generated,
-            'subtitle_srt': srt_formatted,
-            'subtitle_count': len(subtitle_data),
-            'available_languages': available_languages
-        })
+        fmt = request.args.get('format', 'json')
+        return _send(subtitles_representation(video_id, preferred_lang, fmt))
         
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e),
-            'video_id': video_id
-        }), 400
+        return _error_response(e, video_id)
 
 
 @app.route('/api/languages/<video_id>', methods=['GET'])
@@ -128,31 +923,10 @@ def get_available_languages(video_id):
         可用语言列表
     """
     try:
-        
-        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-        
-        languages = [
-            {
-                'code': t.language_code,
-                'name': t.language,
-                'is_generated': t.is_generated,
-                'is_translatable': t.is_translatable
-            }
-            for t in transcript_list
-        ]
-        
-        return jsonify({
-            'success': True,
-            'video_id': video_id,
-            'languages': languages
-        })
+        return _send(languages_representation(video_id))
         
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e),
-            'video_id': video_id
-        }), 400
+        return _error_response(e, video_id)
 
 
 @app.route('/api/video-url/<video_id>', methods=['GET'])
@@ -170,78 +944,11 @@ def get_video_url(video_id):
         视频播放 URL
     """
     try:
-        import yt_dlp
-        
         quality = request.args.get('quality', '720p')
-        
-        
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
-            
-            # 获取视频 URL
-            video_url = None
-            
-            # 优先从 formats 中选择合适的格式
-            if 'formats' in info and info['formats']:
-                # 第一优先级:寻找包含视频和音频的格式
-                for fmt in reversed(info['formats']):
-                    if (fmt.get('url') and 
-                        fmt.get('vcodec') != 'none' and 
-                        fmt.get('acodec') != 'none' and
-                        'storyboard' not in fmt.get('format_id', '')):
-                        video_url = fmt['url']
-                        break
-                
-                # 第二优先级:如果没有合并格式,尝试找 HLS 流
-                if not video_url:
-                    for fmt in info['formats']:
-                        if (fmt.get('url') and 
-                            fmt.get('protocol') == 'm3u8_native' and
-                            'storyboard' not in fmt.get('format_id', '')):
-                            video_url = fmt['url']
-                            break
-                
-                # 第三优先级:任何有视频的格式(可能没有音频)
-                if not video_url:
-                    for fmt in reversed(info['formats']):
-                        if (fmt.get('url') and 
-                            fmt.get('vcodec') != 'none' and
-                            'storyboard' not in fmt.get('format_id', '')):
-                            video_url = fmt['url']
-                            break
-            
-            # 备用方案:使用 info 中的 url
-            if not video_url and 'url' in info:
-                video_url = info['url']
-            
-            if not video_url or 'storyboard' in video_url:
-                raise Exception("无法提取有效的视频 URL")
-            
-            # 获取视频信息
-            video_info = {
-                'success': True,
-                'video_id': video_id,
-                'title': info.get('title'),
-                'duration': info.get('duration'),
-                'video_url': video_url,
-                'thumbnail': info.get('thumbnail'),
-                'description': info.get('description', '')[:200]
-            }
-            
-            
-            return jsonify(video_info)
+        return jsonify(video_url_payload(video_id, quality))
         
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e),
-            'video_id': video_id
-        }), 400
+        return _error_response(e, video_id)
 
 
 @app.route('/api/youtube-info/<path:video_id>', methods=['GET'])
@@ -256,30 +963,60 @@ def get_youtube_info(video_id):
         包含视频信息、多种清晰度的播放地址和字幕信息
     """
     try:
-        
-        # 构建完整的 YouTube URL
-        if 'youtube.com' in video_id or 'youtu.be' in video_id:
-            youtube_url = video_id
-            extracted_id = extract_video_id(video_id)
-        else:
-            youtube_url = build_youtube_url(video_id)
-            extracted_id = video_id
-        
-        if not extracted_id:
-            raise Exception("无效的 YouTube 视频 ID 或 URL")
+        youtube_url, _ = resolve_youtube_target(video_id)
         
         # 调用 iiilab 服务
         result = iiilab_service.extract_video_info(youtube_url)
         
-        
         return jsonify(result)
         
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e),
-            'video_id': video_id
-        }), 400
+        return _error_response(e, video_id)
+
+
+@app.route('/api/extract/<path:video_id>', methods=['GET'])
+def extract(video_id):
+    """
+    获取视频播放地址, 由服务端在 SnapAny 和 yt-dlp 之间选择
+    
+    参数:
+        video_id: YouTube 视频 ID 或完整 URL
+    
+    返回:
+        统一格式的视频信息和各清晰度播放地址, source 为实际使用的解析服务
+    """
+    try:
+        return jsonify(extract_payload(video_id))
+        
+    except Exception as e:
+        return _error_response(e, video_id)
+
+
+@app.route('/api/stream/<video_id>/<fmt>', methods=['GET'])
+def stream(video_id, fmt):
+    """
+    代理播放地址, 转发 Range 请求(STREAM_PROXY_ENABLED=1 时开启)
+    
+    参数:
+        video_id: YouTube 视频 ID
+        fmt: best / audio / 画质(如 720p)
+    
+    返回:
+        媒体数据(200 或 206), 区间超出文件大小时返回 416
+    """
+    if not media_proxy.ENABLED:
+        return jsonify({'success': False, 'error': '播放地址代理已关闭(STREAM_PROXY_ENABLED=0)'}), 404
+    try:
+        status, headers, body = stream_proxy.open(video_id, fmt, request.headers.get('Range'))
+    except RangeNotSatisfiable as e:
+        return Response(status=416, headers={'Content-Range': f'bytes */{e.size}'})
+    except UpstreamStreamError as e:
+        return jsonify({'success': False, 'error': str(e), 'video_id': video_id}), 502
+    except Exception as e:
+        return _error_response(e, video_id)
+    # 解析完成, 转发媒体数据期间不占用准入名额
+    admission.leave_upstream()
+    return Response(body, status=status, headers=headers, direct_passthrough=True)
 
 
 @app.route('/api/video-timestamps/<video_id>', methods=['GET', 'POST'])
@@ -292,107 +1029,156 @@ def get_video_timestamps(video_id):
         video_id: YouTube 视频 ID (从URL路径获取)
         languages: 语言代码列表(可选,从请求体获取,默认: ["en"])
     
+        from / to: 只返回与该时间区间(秒)重叠的字幕(可选)
+        around / count: 只返回播放位置附近的 count 条字幕(可选)
+    
     返回:
-        带时间戳的字幕数据
+        带时间戳的字幕数据(JSON; Accept 为 application/vnd.littlesprout.timestamps 时为按列的二进制格式)
     """
     try:
-        # 支持 GET 和 POST 请求
-        if request.method == 'POST':
-            data = request.get_json() or {}
-            languages = data.get('languages', ['en'])
-        else:
-            lang_param = request.args.get('languages', 'en')
-            languages = [lang_param] if isinstance(lang_param, str) else lang_param
-        
-        logger.info(f"获取视频 {video_id} 的时间戳字幕,语言: {languages}")
-        
-        # 获取字幕列表
-        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-        
-        # 尝试按优先级获取字幕
-        transcript = None
-        used_language = None
-        
-        for lang in languages:
-            try:
-                # 扩展语言变体
-                if lang.startswith('zh'):
-                    lang_variants = ['zh-Hans', 'zh-Hant', 'zh', 'zh-CN', 'zh-TW']
-                elif lang.startswith('en'):
-                    lang_variants = ['en', 'en-US', 'en-GB']
-                else:
-                    lang_variants = [lang]
-                
-                transcript = transcript_list.find_transcript(lang_variants)
-                used_language = transcript.language_code
-                logger.info(f"找到字幕语言: {used_language}")
-                break
-            except:
-                continue
+        languages = _timestamp_languages()
+        window = _timestamp_window()
+        return _send(timestamps_representation(video_id, languages, window, request.headers.get('Accept')))
         
-        # 如果没找到,尝试翻译
-        if not transcript:
-            try:
-                # 找第一个可用的字幕进行翻译
-                available_transcripts = list(transcript_list)
-                if available_transcripts:
-                    source_transcript = available_transcripts[0]
-                    target_lang = languages[0]
-                    transcript = source_transcript.translate(target_lang)
-                    used_language = target_lang
-                    logger.info(f"使用翻译字幕: {source_transcript.language_code} -> {target_lang}")
-            except Exception as te:
-                logger.error(f"翻译失败: {te}")
-        
-        # 如果还是没有,使用第一个可用的
-        if not transcript:
-            available_transcripts = list(transcript_list)
-            if not available_transcripts:
-                raise Exception("该视频没有可用的字幕")
-            transcript = available_transcripts[0]
-            used_language = transcript.language_code
-            logger.info(f"使用第一个可用字幕: {used_language}")
-        
-        # 获取字幕数据
-        subtitle_data = transcript.fetch()
+    except Exception as e:
+        logger.error(f"获取时间戳字幕失败: {e}")
+        return _error_response(e, video_id)
+
+
+@app.route('/api/bilingual/<video_id>', methods=['GET'])
+def get_bilingual(video_id):
+    """
+    获取按时间对齐的双语字幕
+    
+    参数:
+        video_id: YouTube 视频 ID
+        primary: 主语言(可选,默认: en), 决定字幕条数和时间
+        secondary: 次语言(可选,默认: zh-Hans), 没有该语言的字幕时自动翻译
+    
+    返回:
+        双语字幕数据
+    """
+    try:
+        primary = request.args.get('primary', 'en')
+        secondary = request.args.get('secondary', 'zh-Hans')
+        return _send(bilingual_representation(video_id, primary, secondary))
         
-        # 转换为时间戳格式
-        timestamps = [
-            {
-                'text': item['text'],
-                'start': item['start'],
-                'duration': item['duration']
-            }
-            for item in subtitle_data
-        ]
+    except Exception as e:
+        logger.error(f"获取双语字幕失败: {e}")
+        return _error_response(e, video_id)
+
+
+@app.route('/api/vocab/<video_id>', methods=['GET'])
+def get_vocab(video_id):
+    """
+    获取视频的词汇索引: 规范化词元 -> 出现的字幕下标和开始时间, 按出现次数排序
+    
+    参数:
+        video_id: YouTube 视频 ID
+        languages: 语言代码(可选,默认: en)
+        word: 只查询该单词(可选, 任意词形)
+        limit: 最多返回的词数(可选)
+        min_count: 最少出现次数(可选,默认: 1)
+    
+    返回:
+        词汇索引数据
+    """
+    try:
+        languages = [request.args.get('languages', 'en')]
+        word, limit, min_count = parse_vocab_params(request.args)
+        return _send(vocab_representation(video_id, languages, word, limit, min_count))
         
-        logger.info(f"成功获取 {len(timestamps)} 条字幕")
+    except Exception as e:
+        return _error_response(e, video_id)
+
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """
+    在所有已缓存的字幕中搜索短语
+    
+    参数:
+        q: 查询短语, 如 "take it for granted"
+        limit: 最多返回的结果数(可选,默认: 20,最多 100)
+        video_id: 只搜索该视频(可选)
+        lang: 只搜索该语言的字幕(可选)
+    
+    返回:
+        按相关度排序的命中位置(视频、字幕下标、开始时间、字幕文本)
+    """
+    try:
+        return jsonify(search_payload(request.args))
         
-        return jsonify({
-            'success': True,
-            'video_id': video_id,
-            'language': used_language,
-            'timestamps': timestamps,
-            'count': len(timestamps)
-        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/define', methods=['GET', 'POST'])
+def define():
+    """
+    批量查询单词释义
+    
+    请求体(POST):
+        {"words": ["actually", "granted", ...]}
+    查询参数(GET):
+        words: 逗号分隔的单词
+    
+    返回:
+        规范化单词(小写, 去掉首尾标点) -> 释义, 释义格式与客户端 WordDefinition 相同;
+        查询失败的单词列在 errors 中
+    """
+    try:
+        if request.method == 'POST':
+            words = (request.get_json(silent=True) or {}).get('words')
+        else:
+            words = request.args.get('words', '')
+        return jsonify(define_payload(words))
         
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
-        logger.error(f"获取时间戳字幕失败: {e}")
-        return jsonify({
-            'success': False,
-            'error': str(e),
-            'video_id': video_id
-        }), 400
+        return jsonify({'success': False, 'error': str(e)}), 400
 
 
-if __name__ == '__main__':
-    import os
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """
+    批量获取字幕、语言列表和视频信息
     
+    请求体:
+        {"items": [{"video_id": "...", "op": "subtitles|languages|youtube-info", "lang": "en"}, ...]}
+        或 {"video_ids": [...], "ops": [...], "lang": "en"}
+    
+    返回:
+        NDJSON 流,每完成一项输出一行 {"index", "video_id", "op", "status", "result"},
+        顺序为完成顺序而非请求顺序
+    """
+    try:
+        items = _parse_batch_items(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    futures = [batch_executor.submit(_run_batch_item, index, item) for index, item in enumerate(items)]
+    
+    def generate():
+        try:
+            for future in as_completed(futures):
+                yield json.dumps(future.result(), ensure_ascii=False) + '\n'
+        finally:
+            # 客户端提前断开时取消尚未开始的任务
+            for future in futures:
+                future.cancel()
+    
+    return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+
+if __name__ == '__main__':
     # 从环境变量获取端口,默认 5001
     port = int(os.getenv('PORT', 5001))
     
     
     # 生产环境使用 gunicorn,开发环境使用 Flask 内置服务器
     is_production = os.getenv('RENDER', False)
+    cache_snapshot.start()
     app.run(host='0.0.0.0', port=port, debug=not is_production)
 
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+YouTube 字幕服务 ASGI 入口
+以 asyncio 方式提供与 app.py 相同的接口,适合大量慢速上游请求并发的场景
+
+- /api/youtube-info 使用带连接池的异步 SnapAny 客户端
+- youtube_transcript_api / yt_dlp 等阻塞调用在有界线程池中执行
+- 其余接口转交给 Flask 应用处理
+
+启动方式:
+    SERVER_MODE=asgi gunicorn -c gunicorn.conf.py
+或本地开发:
+    uvicorn asgi:app --port 5001
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.middleware import Middleware
+from starlette.routing import Match, Mount, Route
+
+from app import (
+    app as flask_app,
+    bilingual_representation,
+    cache_snapshot,
+    define_payload,
+    extract_payload,
+    iiilab_service,
+    languages_representation,
+    parse_timestamp_window,
+    parse_vocab_params,
+    resolve_youtube_target,
+    search_payload,
+    stream_proxy,
+    subtitles_representation,
+    timestamps_representation,
+    video_url_payload,
+    vocab_representation,
+)
+import admission
+import media_proxy
+import metrics
+import profiling
+from admission import Overloaded
+from media_proxy import AsyncMediaProxy, RangeNotSatisfiable, UpstreamStreamError
+from rate_limiter import RateLimitExceeded
+from youtube_iiilab import AsyncIIILabYouTubeService
+
+logger = logging.getLogger(__name__)
+
+# 阻塞调用线程池大小
+BLOCKING_WORKERS = int(os.getenv('ASGI_BLOCKING_WORKERS', 32))
+
+# SnapAny 连接池大小
+UPSTREAM_CONNECTIONS = int(os.getenv('ASGI_UPSTREAM_CONNECTIONS', 20))
+
+# 播放地址代理的连接池大小
+STREAM_CONNECTIONS = int(os.getenv('ASGI_STREAM_CONNECTIONS', 64))
+
+# 转交给 Flask 的请求使用的线程数
+WSGI_WORKERS = int(os.getenv('ASGI_WSGI_WORKERS', 8))
+
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix='upstream')
+
+# 等待上游的请求最多占用阻塞线程池中的这么多线程, 其余留给缓存命中的请求
+admission.configure_for_threads(BLOCKING_WORKERS)
+async_iiilab_service = None
+async_stream_proxy = None
+
+
+def _run_attached(fn):
+    with profiling.attach():
+        return fn()
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """在有界线程池中执行阻塞函数(沿用当前请求的上下文, 耗时计入其 Server-Timing)"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(blocking_executor, context.run, _run_attached, partial(fn, *args, **kwargs))
+
+
+def _json(data, status_code=200, headers=None):
+    """JSON 响应(与 Flask-CORS 一致,允许跨域)"""
+    response = JSONResponse(data, status_code=status_code, headers=headers)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+async def _send(request, representation):
+    """按 If-None-Match / Accept-Encoding 发送响应,与 app.py 保持一致(渲染和压缩在线程池中执行)"""
+    status, body, headers = await run_blocking(
+        representation.respond,
+        request.headers.get('if-none-match'), request.headers.get('accept-encoding')
+    )
+    response = Response(body, status_code=status, headers=headers)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+def _overloaded(e, video_id=None):
+    """等待上游的请求已满时返回 503,与 app.py 保持一致"""
+    retry_after = max(1, int(e.retry_after + 0.999))
+    body = {'success': False, 'error': str(e), 'retry_after': retry_after}
+    if video_id is not None:
+        body['video_id'] = video_id
+    return _json(body, status_code=503, headers={'Retry-After': str(retry_after)})
+
+
+def _error(e, video_id):
+    """统一的错误响应,与 app.py 保持一致"""
+    if isinstance(e, Overloaded):
+        return _overloaded(e, video_id)
+    if isinstance(e, RateLimitExceeded):
+        retry_after = max(1, int(e.retry_after + 0.999))
+        return _json({
+            'success': False,
+            'error': str(e),
+            'retry_after': retry_after,
+            'video_id': video_id
+        }, status_code=429, headers={'Retry-After': str(retry_after)})
+    return _json({
+        'success': False,
+        'error': str(e),
+        'video_id': video_id
+    }, status_code=400)
+
+
+async def get_subtitles(request):
+    """获取 YouTube 视频字幕"""
+    video_id = request.path_params['video_id']
+    try:
+        preferred_lang = request.query_params.get('lang', 'en')
+        fmt = request.query_params.get('format', 'json')
+        return await _send(request, await run_blocking(subtitles_representation, video_id, preferred_lang, fmt))
+    except Exception as e:
+        return _error(e, video_id)
+
+
+async def get_available_languages(request):
+    """获取视频可用的字幕语言列表"""
+    video_id = request.path_params['video_id']
+    try:
+        return await _send(request, await run_blocking(languages_representation, video_id))
+    except Exception as e:
+        return _error(e, video_id)
+
+
+async def get_video_url(request):
+    """获取 YouTube 视频的直接播放 URL"""
+    video_id = request.path_params['video_id']
+    try:
+        quality = request.query_params.get('quality', '720p')
+        return _json(await run_blocking(video_url_payload, video_id, quality))
+    except Exception as e:
+        return _error(e, video_id)
+
+
+async def get_youtube_info(request):
+    """使用 iiilab 服务获取 YouTube 视频信息"""
+    video_id = request.path_params['video_id']
+    try:
+        youtube_url, _ = resolve_youtube_target(video_id)
+        return _json(await async_iiilab_service.extract_video_info(youtube_url))
+    except Exception as e:
+        return _error(e, video_id)
+
+
+async def extract(request):
+    """获取视频播放地址, 由服务端在 SnapAny 和 yt-dlp 之间选择"""
+    video_id = request.path_params['video_id']
+    try:
+        return _json(await run_blocking(extract_payload, video_id))
+    except Exception as e:
+        return _error(e, video_id)
+
+
+async def stream(request):
+    """代理播放地址, 转发 Range 请求(每个播放中的客户端不占用线程)"""
+    video_id = request.path_params['video_id']
+    if not media_proxy.ENABLED:
+        return _json({'success': False, 'error': '播放地址代理已关闭(STREAM_PROXY_ENABLED=0)'}, status_code=404)
+    try:
+        status, headers, body = await async_stream_proxy.open(
+            video_id, request.path_params['fmt'], request.headers.get('range')
+        )
+    except RangeNotSatisfiable as e:
+        return Response(status_code=416, headers={'Content-Range': f'bytes */{e.size}'})
+    except UpstreamStreamError as e:
+        return _json({'success': False, 'error': str(e), 'video_id': video_id}, status_code=502)
+    except Exception as e:
+        return _error(e, video_id)
+
+    # 解析已完成, 转发期间不占用准入名额
+    admission.leave_upstream()
+    if request.method == 'HEAD':
+        await body.aclose()
+        response = Response(status_code=status, headers=headers)
+    else:
+        response = StreamingResponse(body, status_code=status, headers=headers)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+async def get_video_timestamps(request):
+    """获取 YouTube 视频的带时间戳字幕"""
+    video_id = request.path_params['video_id']
+    try:
+        params = dict(request.query_params)
+        if request.method == 'POST':
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            data = data or {}
+            languages = data.get('languages', ['en'])
+            params.update({k: data[k] for k in ('from', 'to', 'around', 'count') if k in data})
+        else:
+            languages = [request.query_params.get('languages', 'en')]
+        window = parse_timestamp_window(params)
+        return await _send(request, await run_blocking(
+            timestamps_representation, video_id, languages, window, request.headers.get('accept')
+        ))
+    except Exception as e:
+        logger.error(f"获取时间戳字幕失败: {e}")
+        return _error(e, video_id)
+
+
+async def get_bilingual(request):
+    """获取按时间对齐的双语字幕"""
+    video_id = request.path_params['video_id']
+    try:
+        primary = request.query_params.get('primary', 'en')
+        secondary = request.query_params.get('secondary', 'zh-Hans')
+        return await _send(request, await run_blocking(bilingual_representation, video_id, primary, secondary))
+    except Exception as e:
+        logger.error(f"获取双语字幕失败: {e}")
+        return _error(e, video_id)
+
+
+async def get_vocab(request):
+    """获取视频的词汇索引"""
+    video_id = request.path_params['video_id']
+    try:
+        languages = [request.query_params.get('languages', 'en')]
+        word, limit, min_count = parse_vocab_params(request.query_params)
+        return await _send(request, await run_blocking(vocab_representation, video_id, languages, word, limit, min_count))
+    except Exception as e:
+        return _error(e, video_id)
+
+
+async def search(request):
+    """在所有已缓存的字幕中搜索短语"""
+    try:
+        return _json(await run_blocking(search_payload, dict(request.query_params)))
+    except Exception as e:
+        return _json({'success': False, 'error': str(e)}, status_code=400)
+
+
+async def define(request):
+    """批量查询单词释义"""
+    try:
+        if request.method == 'POST':
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            words = (data or {}).get('words') if isinstance(data, dict) else None
+        else:
+            words = request.query_params.get('words', '')
+        return _json(await run_blocking(define_payload, words))
+    except Overloaded as e:
+        return _overloaded(e)
+    except Exception as e:
+        return _json({'success': False, 'error': str(e)}, status_code=400)
+
+
+def _flask_rule(path):
+    """Starlette 路径转换为 Flask 规则写法, 指标中两种模式的 route 标签一致"""
+    return re.sub(r'\{(\w+)(?::(\w+))?\}', lambda m: f'<{m.group(2)}:{m.group(1)}>' if m.group(2) else f'<{m.group(1)}>', path)
+
+
+class RequestMetrics:
+    """
+    记录原生路由的请求耗时和进行中的请求数, 登记准入控制, 并添加 Server-Timing 响应头
+    (转交给 Flask 的请求由 Flask 自己记录)
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = [(route, _flask_rule(route.path)) for route in routes if isinstance(route, Route)]
+
+    async def __call__(self, scope, receive, send):
+        rule = None
+        if scope['type'] == 'http':
+            rule = next((rule for route, rule in self.routes if route.matches(scope)[0] == Match.FULL), None)
+        if rule is None:
+            return await self.app(scope, receive, send)
+
+        status = 500
+        profile_header = next((v.decode('latin-1') for k, v in scope['headers'] if k == b'x-profile'), None)
+        timing = profiling.begin(rule, profile_header)
+        ticket = admission.begin(rule)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                extra = profiling.finish(timing)
+                if extra:
+                    message = dict(message, headers=list(message.get('headers', [])) + [
+                        (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in extra.items()
+                    ])
+            await send(message)
+
+        started = time.perf_counter()
+        metrics.add_gauge('http_requests_in_flight', {'route': rule}, 1)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiling.finish(timing)
+            admission.end(ticket)
+            metrics.add_gauge('http_requests_in_flight', {'route': rule}, -1)
+            metrics.observe_request(rule, scope['method'], status, time.perf_counter() - started)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    global async_iiilab_service, async_stream_proxy
+    async_iiilab_service = AsyncIIILabYouTubeService(iiilab_service, max_connections=UPSTREAM_CONNECTIONS)
+    async_stream_proxy = AsyncMediaProxy(
+        stream_proxy, lambda video_id, fmt, force: run_blocking(stream_proxy.target, video_id, fmt, force),
+        max_connections=STREAM_CONNECTIONS,
+    )
+    cache_snapshot.start()
+    try:
+        yield
+    finally:
+        await async_iiilab_service.aclose()
+        await async_stream_proxy.aclose()
+        blocking_executor.shutdown(wait=False)
+
+
+# 未匹配的路径和方法(/health、/metrics、OPTIONS 预检等)交给 Flask 处理
+routes = [
+    Route('/api/subtitles/{video_id}', get_subtitles, methods=['GET']),
+    Route('/api/languages/{video_id}', get_available_languages, methods=['GET']),
+    Route('/api/video-url/{video_id}', get_video_url, methods=['GET']),
+    Route('/api/youtube-info/{video_id:path}', get_youtube_info, methods=['GET']),
+    Route('/api/extract/{video_id:path}', extract, methods=['GET']),
+    Route('/api/stream/{video_id}/{fmt}', stream, methods=['GET', 'HEAD']),
+    Route('/api/video-timestamps/{video_id}', get_video_timestamps, methods=['GET', 'POST']),
+    Route('/api/bilingual/{video_id}', get_bilingual, methods=['GET']),
+    Route('/api/vocab/{video_id}', get_vocab, methods=['GET']),
+    Route('/api/search', search, methods=['GET']),
+    Route('/api/define', define, methods=['GET', 'POST']),
+    Mount('/', WSGIMiddleware(flask_app, workers=WSGI_WORKERS)),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(RequestMetrics, routes=routes)],
+    lifespan=lifespan,
+)
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+基准测试
+启动上游替身和真实的 gunicorn 服务(gunicorn.conf.py), 按配置的接口比例持续施压,
+输出每个接口的吞吐量和 p50 / p95 / p99 延迟; 可与之前保存的结果对比, 发现性能退化
+
+在 backend 目录下运行:
+    python3 bench/run.py --duration 30 --concurrency 16
+    python3 bench/run.py --server-mode asgi --workers 2 --json asgi.json
+    python3 bench/run.py --baseline asgi.json --tolerance 0.2
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import stubs  # noqa: E402
+
+# 接口 -> 请求路径模板
+ENDPOINTS = {
+    'subtitles': '/api/subtitles/{video_id}?lang=en',
+    'subtitles-srt': '/api/subtitles/{video_id}?lang=en&format=srt',
+    'subtitles-zh': '/api/subtitles/{video_id}?lang=zh-Hans',
+    'bilingual': '/api/bilingual/{video_id}?primary=en&secondary=zh-Hans',
+    'timestamps': '/api/video-timestamps/{video_id}?languages=en',
+    'languages': '/api/languages/{video_id}',
+    'vocab': '/api/vocab/{video_id}?limit=50',
+    'youtube-info': '/api/youtube-info/{video_id}',
+    'video-url': '/api/video-url/{video_id}',
+    'search': '/api/search?q={phrase}',
+    'health': '/health',
+}
+
+DEFAULT_MIX = 'subtitles=30,timestamps=20,languages=10,vocab=10,youtube-info=10,video-url=5,search=10,health=5'
+
+PHRASES = ['take+it+for+granted', 'the+people', 'running+through+water', 'every+word', 'right+now']
+
+
+def parse_mix(text: str) -> List[Tuple[str, float]]:
+    mix = []
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"未知的接口: {name}(可选: {', '.join(ENDPOINTS)})")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def video_ids(count: int) -> List[str]:
+    """11 位的假视频 ID"""
+    return [f'bv{i:09d}' for i in range(count)]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# ----------------------------------------------------------------------
+# 服务进程
+# ----------------------------------------------------------------------
+
+class Server:
+    """在上游替身前运行的 gunicorn 服务"""
+
+    def __init__(self, args, upstream_url: str):
+        self.port = args.port or free_port()
+        self.state_dir = tempfile.mkdtemp(prefix='bench-')
+        self.log_path = os.path.join(self.state_dir, 'server.log')
+
+        env = dict(os.environ)
+        env.update({
+            'PORT': str(self.port),
+            'SERVER_MODE': args.server_mode,
+            'BENCH_UPSTREAM_URL': upstream_url,
+            # 缓存和状态文件放在临时目录, 每次从冷缓存开始
+            'TRANSCRIPT_STORE_PATH': os.path.join(self.state_dir, 'transcripts.db'),
+            'TRANSCRIPT_SEARCH_PATH': os.path.join(self.state_dir, 'search.db'),
+            'DICTIONARY_CACHE_PATH': os.path.join(self.state_dir, 'definitions.db'),
+            'SNAPANY_RATE_STATE': os.path.join(self.state_dir, 'snapany_rate.state'),
+            'METRICS_DIR': os.path.join(self.state_dir, 'metrics'),
+            'PROFILE_DIR': os.path.join(self.state_dir, 'profiles'),
+            'CACHE_SNAPSHOT_PATH': os.path.join(self.state_dir, 'snapshot.json.gz'),
+            'SNAPANY_RATE': str(args.snapany_rate),
+            'SNAPANY_BURST': str(max(1, args.snapany_rate)),
+        })
+
+        command = [sys.executable, os.path.join(BENCH_DIR, 'serve.py'), '-c', 'gunicorn.conf.py',
+                   '--access-logfile', '/dev/null', '--log-level', 'warning']
+        if args.workers:
+            command += ['--workers', str(args.workers)]
+        if args.threads:
+            command += ['--threads', str(args.threads)]
+        if args.worker_class:
+            command += ['--worker-class', args.worker_class]
+
+        self._log = open(self.log_path, 'w')
+        self.process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=self._log,
+                                        stderr=subprocess.STDOUT, start_new_session=True)
+
+    def wait_ready(self, timeout: float = 60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+                connection.request('GET', '/health')
+                if connection.getresponse().status == 200:
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        with open(self.log_path) as f:
+            sys.exit(f'服务启动失败:\n{f.read()[-4000:]}')
+
+    def stop(self):
+        if self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+        self._log.close()
+        shutil.rmtree(self.state_dir, ignore_errors=True)
+
+
+# ----------------------------------------------------------------------
+# 施压
+# ----------------------------------------------------------------------
+
+class LoadGenerator:
+    """
+    固定并发数的闭环压测: 每个线程一个长连接, 收到响应后立即发出下一个请求
+
+    视频按 Zipf 分布选取(少数热门视频占大多数请求), 缓存命中率接近真实流量
+    """
+
+    def __init__(self, port: int, mix: List[Tuple[str, float]], videos: List[str], zipf: float, seed: int):
+        self.port = port
+        self.names = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.videos = videos
+        self.video_weights = [1.0 / (rank + 1) ** zipf for rank in range(len(videos))]
+        self.seed = seed
+        self._runs = 0
+
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def _path(self, rng: random.Random) -> Tuple[str, str]:
+        name = rng.choices(self.names, self.weights)[0]
+        video_id = rng.choices(self.videos, self.video_weights)[0]
+        return name, ENDPOINTS[name].format(video_id=video_id, phrase=rng.choice(PHRASES))
+
+    def _worker(self, index: int, run: int, deadline: float, record: bool):
+        rng = random.Random(f'{self.seed}:{run}:{index}')
+        connection = None
+        latencies = defaultdict(list)
+        statuses = defaultdict(lambda: defaultdict(int))
+
+        while time.time() < deadline:
+            name, path = self._path(rng)
+            started = time.perf_counter()
+            try:
+                if connection is None:
+                    connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=180)
+                connection.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+                if response.getheader('Connection', '').lower() == 'close':
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException):
+                status = 0
+                if connection is not None:
+                    connection.close()
+                connection = None
+            elapsed = time.perf_counter() - started
+
+            if record:
+                latencies[name].append(elapsed)
+                statuses[name][status] += 1
+
+        if connection is not None:
+            connection.close()
+        with self._lock:
+            for name, values in latencies.items():
+                self.latencies[name].extend(values)
+            for name, counts in statuses.items():
+                for status, count in counts.items():
+                    self.statuses[name][status] += count
+
+    def run(self, concurrency: int, duration: float, record: bool = True) -> float:
+        """施压 duration 秒, 返回实际耗时"""
+        self._runs += 1
+        started = time.time()
+        deadline = started + duration
+        threads = [threading.Thread(target=self._worker, args=(i, self._runs, deadline, record), daemon=True)
+                   for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - started
+
+
+def summarize(load: LoadGenerator, elapsed: float) -> Dict:
+    endpoints = {}
+    all_latencies = []
+    total_errors = 0
+    for name in sorted(load.latencies):
+        values = sorted(load.latencies[name])
+        all_latencies.extend(values)
+        errors = sum(count for status, count in load.statuses[name].items() if not (200 <= status < 400))
+        total_errors += errors
+        endpoints[name] = {
+            'requests': len(values),
+            'errors': errors,
+            'statuses': {str(k): v for k, v in sorted(load.statuses[name].items())},
+            'rps': len(values) / elapsed,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'max_ms': values[-1] * 1000 if values else 0.0,
+        }
+    all_latencies.sort()
+    return {
+        'elapsed': elapsed,
+        'total': {
+            'requests': len(all_latencies),
+            'errors': total_errors,
+            'rps': len(all_latencies) / elapsed,
+            'p50_ms': percentile(all_latencies, 0.50) * 1000,
+            'p95_ms': percentile(all_latencies, 0.95) * 1000,
+            'p99_ms': percentile(all_latencies, 0.99) * 1000,
+        },
+        'endpoints': endpoints,
+    }
+
+
+def print_report(result: Dict):
+    header = f"{'endpoint':<14}{'requests':>9}{'errors':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, row in result['endpoints'].items():
+        print(f"{name:<14}{row['requests']:>9}{row['errors']:>7}{row['rps']:>9.1f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+    total = result['total']
+    print('-' * len(header))
+    print(f"{'total':<14}{total['requests']:>9}{total['errors']:>7}{total['rps']:>9.1f}"
+          f"{total['p50_ms']:>10.1f}{total['p95_ms']:>10.1f}{total['p99_ms']:>10.1f}")
+    print(f"\n上游调用(含预热): {json.dumps(result['upstream_calls'], ensure_ascii=False, sort_keys=True)}")
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """与基线对比, 返回退化项"""
+    regressions = []
+    for name, row in result['endpoints'].items():
+        base = baseline.get('endpoints', {}).get(name)
+        if not base:
+            continue
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            # 低于 1ms 的差异视为噪声
+            if row[key] > base[key] * (1 + tolerance) and row[key] - base[key] > 1.0:
+                regressions.append(f'{name} {key}: {base[key]:.1f} -> {row[key]:.1f}')
+        if row['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{name} req/s: {base['rps']:.1f} -> {row['rps']:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='YouTube 字幕服务基准测试')
+    parser.add_argument('--duration', type=float, default=30, help='施压时长(秒)')
+    parser.add_argument('--warmup', type=float, default=5, help='预热时长(秒), 不计入结果')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发连接数')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'接口比例, 可选接口: {", ".join(ENDPOINTS)}')
+    parser.add_argument('--videos', type=int, default=200, help='视频数')
+    parser.add_argument('--zipf', type=float, default=1.1, help='视频热度分布的 Zipf 指数(0 为均匀分布)')
+    parser.add_argument('--server-mode', choices=('wsgi', 'asgi'), default='wsgi')
+    parser.add_argument('--workers', type=int, help='覆盖 gunicorn.conf.py 的 workers')
+    parser.add_argument('--threads', type=int, help='覆盖 gunicorn.conf.py 的 threads')
+    parser.add_argument('--worker-class', help='覆盖 gunicorn.conf.py 的 worker_class')
+    parser.add_argument('--snapany-rate', type=float, default=1000, help='SnapAny 限流速率(次/秒), 默认不限流')
+    parser.add_argument('--port', type=int, help='服务端口(默认随机)')
+    parser.add_argument('--json', help='把结果保存为 JSON')
+    parser.add_argument('--baseline', help='与之前保存的 JSON 结果对比')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的退化比例')
+    stubs.add_arguments(parser)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    upstream = stubs.StubServer(config=stubs.config_from_args(args)).start()
+    server = Server(args, upstream.base_url)
+    try:
+        server.wait_ready()
+        load = LoadGenerator(server.port, mix, video_ids(args.videos), args.zipf, args.seed)
+        if args.warmup > 0:
+            load.run(args.concurrency, args.warmup, record=False)
+        elapsed = load.run(args.concurrency, args.duration)
+    finally:
+        server.stop()
+        upstream.stop()
+
+    result = summarize(load, elapsed)
+    result['config'] = {k: v for k, v in vars(args).items() if k not in ('json', 'baseline')}
+    result['upstream_calls'] = upstream.stats()
+    print_report(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print('\n性能退化:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print('\n与基线相比没有超过容差的退化')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+连接上游替身启动服务
+把 YouTube 观看页、SnapAny 和 yt-dlp 的请求改到 BENCH_UPSTREAM_URL, 然后按原样运行 gunicorn,
+配置仍来自真实的 gunicorn.conf.py(命令行参数可以覆盖 workers / threads / worker-class)
+
+在 backend 目录下运行:
+    BENCH_UPSTREAM_URL=http://127.0.0.1:8900 python3 bench/serve.py -c gunicorn.conf.py --workers 2
+"""
+
+import os
+import sys
+
+SNAPANY_ORIGIN = 'https://api.snapany.com'
+
+
+def install(base_url: str):
+    """把上游请求改到 base_url(必须在导入 app 之前调用)"""
+    import httpx
+    import requests
+    import yt_dlp
+    from youtube_transcript_api import _transcripts
+
+    base_url = base_url.rstrip('/')
+
+    # youtube_transcript_api 从观看页解析字幕列表, 字幕地址由替身返回
+    _transcripts.WATCH_URL = f'{base_url}/watch?v={{video_id}}'
+
+    def rewrite(url):
+        text = str(url)
+        if text.startswith(SNAPANY_ORIGIN):
+            return base_url + text[len(SNAPANY_ORIGIN):]
+        return url
+
+    session_request = requests.Session.request
+
+    def request(self, method, url, *args, **kwargs):
+        return session_request(self, method, rewrite(url), *args, **kwargs)
+
+    requests.Session.request = request
+
+    async_request = httpx.AsyncClient.request
+
+    async def async_client_request(self, method, url, *args, **kwargs):
+        return await async_request(self, method, rewrite(url), *args, **kwargs)
+
+    httpx.AsyncClient.request = async_client_request
+
+    def extract_info(self, url, download=True, *args, **kwargs):
+        video_id = str(url).rsplit('v=', 1)[-1][:11]
+        try:
+            response = requests.get(f'{base_url}/ytdlp/{video_id}', timeout=60)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise yt_dlp.utils.DownloadError(f'stub: {e}')
+        return response.json()
+
+    yt_dlp.YoutubeDL.extract_info = extract_info
+
+
+def main():
+    base_url = os.getenv('BENCH_UPSTREAM_URL')
+    if not base_url:
+        sys.exit('需要设置 BENCH_UPSTREAM_URL(上游替身地址)')
+    install(base_url)
+
+    from gunicorn.app.wsgiapp import run
+    sys.argv = ['gunicorn'] + sys.argv[1:]
+    run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+本地上游替身
+模拟基准测试需要的三类上游, 延迟和失败率可配置:
+
+- YouTube 观看页(/watch)和字幕(/api/timedtext), 供 youtube_transcript_api 解析
+- SnapAny /v1/extract, 校验 G-Timestamp / G-Footer 签名
+- yt-dlp 解析结果(/ytdlp/<video_id>), 由 bench/serve.py 替换 YoutubeDL.extract_info 后请求
+
+单独运行:
+    python3 bench/stubs.py --port 8900 --latency transcript=0.3,snapany=1.5,ytdlp=2
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+# 与 youtube_iiilab.IIILabYouTubeService.SALT 相同
+SNAPANY_SALT = "6HTugjCXxR"
+
+# 签名时间戳允许的误差(毫秒)
+SIGNATURE_WINDOW_MS = 5 * 60 * 1000
+
+UPSTREAMS = ('transcript', 'snapany', 'ytdlp')
+
+TRANSLATION_LANGUAGES = [('zh-Hans', 'Chinese (Simplified)'), ('zh-Hant', 'Chinese (Traditional)'),
+                         ('es', 'Spanish'), ('ja', 'Japanese')]
+
+WORDS = ('the people take it for granted actually when we were running through water and time '
+         'she said they made a little change to every word you know about the world right now').split()
+
+
+def parse_pairs(text: Optional[str], cast=float) -> Dict[str, float]:
+    """解析 "transcript=0.3,snapany=1.5" 形式的参数"""
+    result = {}
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        name = name.strip()
+        if name not in UPSTREAMS:
+            raise ValueError(f"未知的上游: {name}(可选: {', '.join(UPSTREAMS)})")
+        result[name] = cast(value)
+    return result
+
+
+def sign(link: str, language: str, timestamp: str) -> str:
+    return hashlib.md5(f"{link}{language}{timestamp}{SNAPANY_SALT}".encode()).hexdigest()
+
+
+class StubConfig:
+    """
+    上游替身配置
+
+    参数:
+        latency: 上游 -> 平均延迟(秒)
+        jitter: 延迟的随机浮动比例(0.2 表示 ±20%)
+        failure_rate: 上游 -> 返回错误的概率
+        cues: 每条字幕的条数
+        seed: 随机种子
+    """
+
+    def __init__(self, latency: Optional[Dict[str, float]] = None, jitter: float = 0.2,
+                 failure_rate: Optional[Dict[str, float]] = None, cues: int = 300, seed: int = 1):
+        self.latency = {name: 0.0 for name in UPSTREAMS}
+        self.latency.update(latency or {})
+        self.failure_rate = {name: 0.0 for name in UPSTREAMS}
+        self.failure_rate.update(failure_rate or {})
+        self.jitter = jitter
+        self.cues = cues
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def delay(self, upstream: str) -> float:
+        base = self.latency[upstream]
+        with self.lock:
+            return max(0.0, base * (1 + self.random.uniform(-self.jitter, self.jitter)))
+
+    def fails(self, upstream: str) -> bool:
+        with self.lock:
+            return self.random.random() < self.failure_rate[upstream]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'StubServer'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body, content_type: str = 'application/json'):
+        if not isinstance(body, bytes):
+            body = (json.dumps(body) if content_type == 'application/json' else body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _upstream(self, upstream: str, operation: str) -> bool:
+        """计数并模拟延迟, 需要注入失败时返回 False"""
+        self.server.count(operation)
+        time.sleep(self.server.config.delay(upstream))
+        if self.server.config.fails(upstream):
+            self.server.count(f'{operation}_failed')
+            self._send(500, {'error': 'injected failure'})
+            return False
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path == '/watch':
+            if self._upstream('transcript', 'watch'):
+                self._send(200, self.server.watch_page(query.get('v', '')), 'text/html; charset=utf-8')
+        elif url.path == '/api/timedtext':
+            if self._upstream('transcript', 'timedtext'):
+                self._send(200, self.server.timedtext(query.get('v', ''), query.get('lang', 'en'),
+                                                      query.get('tlang')), 'text/xml; charset=utf-8')
+        elif url.path.startswith('/ytdlp/'):
+            if self._upstream('ytdlp', 'ytdlp'):
+                self._send(200, self.server.ytdlp_info(url.path[len('/ytdlp/'):]))
+        elif url.path == '/__stats':
+            self._send(200, self.server.stats())
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if url.path != '/v1/extract':
+            self._send(404, {'error': 'not found'})
+            return
+
+        try:
+            link = json.loads(body)['link']
+        except (ValueError, KeyError, TypeError):
+            self.server.count('extract_bad_request')
+            self._send(400, {'message': 'invalid body'})
+            return
+
+        timestamp = self.headers.get('G-Timestamp', '')
+        language = self.headers.get('Accept-Language', '')
+        footer = self.headers.get('G-Footer', '')
+        if (not timestamp.isdigit() or abs(int(timestamp) - time.time() * 1000) > SIGNATURE_WINDOW_MS
+                or footer != sign(link, language, timestamp)):
+            self.server.count('extract_bad_signature')
+            self._send(403, {'message': 'invalid signature'})
+            return
+
+        if self._upstream('snapany', 'extract'):
+            self._send(200, self.server.snapany_result(link))
+
+
+class StubServer(ThreadingHTTPServer):
+    """上游替身 HTTP 服务"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, config: Optional[StubConfig] = None):
+        super().__init__((host, port), _Handler)
+        self.config = config or StubConfig()
+        self._counts = Counter()
+        self._counts_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'StubServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='bench-stubs', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, operation: str):
+        with self._counts_lock:
+            self._counts[operation] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._counts_lock:
+            return dict(self._counts)
+
+    # ------------------------------------------------------------------
+    # 响应内容
+    # ------------------------------------------------------------------
+
+    def watch_page(self, video_id: str) -> str:
+        base = f'{self.base_url}/api/timedtext?v={video_id}'
+        captions = {
+            'playerCaptionsTracklistRenderer': {
+                'captionTracks': [
+                    {'baseUrl': f'{base}&lang=en', 'name': {'simpleText': 'English'},
+                     'languageCode': 'en', 'isTranslatable': True},
+                    {'baseUrl': f'{base}&lang=en&kind=asr', 'name': {'simpleText': 'English (auto-generated)'},
+                     'languageCode': 'en', 'kind': 'asr', 'isTranslatable': True},
+                ],
+                'translationLanguages': [
+                    {'languageCode': code, 'languageName': {'simpleText': name}}
+                    for code, name in TRANSLATION_LANGUAGES
+                ],
+            }
+        }
+        return (f'<html><body><script>var ytInitialPlayerResponse = {{"playabilityStatus":{{"status":"OK"}},'
+                f'"captions":{json.dumps(captions)},"videoDetails":{{"videoId":"{video_id}"}}}};</script></body></html>')
+
+    def timedtext(self, video_id: str, lang: str, tlang: Optional[str]) -> str:
+        rng = random.Random(f'{video_id}:{lang}')
+        prefix = f'[{tlang}] ' if tlang else ''
+        cues = []
+        for i in range(self.config.cues):
+            text = prefix + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 10)))
+            cues.append(f'<text start="{i * 2.5:.2f}" dur="2.5">{escape(text)}</text>')
+        return f'<?xml version="1.0" encoding="utf-8" ?><transcript>{"".join(cues)}</transcript>'
+
+    def snapany_result(self, link: str) -> Dict:
+        expire = int(time.time()) + 6 * 3600
+        video = link.rsplit('v=', 1)[-1][:11]
+        return {
+            'text': f'Stub video {video}',
+            'duration': 600,
+            'medias': [{
+                'media_type': 'video',
+                'preview_url': f'{self.base_url}/thumb/{video}.jpg',
+                'formats': [
+                    {'quality': quality, 'video_ext': 'mp4', 'separate': 0, 'video_size': quality * 100000,
+                     'video_url': f'https://rr1.googlevideo.com/videoplayback?id={video}&itag={itag}&expire={expire}'}
+                    for quality, itag in ((720, 22), (360, 18))
+                ],
+            }],
+        }
+
+    def ytdlp_info(self, video_id: str) -> Dict:
+        expire = int(time.time()) + 6 * 3600
+        return {
+            'id': video_id,
+            'title': f'Stub video {video_id}',
+            'duration': 600,
+            'thumbnail': f'{self.base_url}/thumb/{video_id}.jpg',
+            'description': 'stub',
+            'formats': [
+                {'format_id': '18', 'height': 360, 'vcodec': 'avc1', 'acodec': 'mp4a', 'protocol': 'https',
+                 'url': f'https://rr1.googlevideo.com/videoplayback?id={video_id}&itag=18&expire={expire}'},
+                {'format_id': '22', 'height': 720, 'vcodec': 'avc1', 'acodec': 'mp4a', 'protocol': 'https',
+                 'url': f'https://rr1.googlevideo.com/videoplayback?id={video_id}&itag=22&expire={expire}'},
+            ],
+        }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """上游替身的命令行参数(run.py 共用)"""
+    parser.add_argument('--latency', default='transcript=0.2,snapany=1.0,ytdlp=1.5',
+                        help='各上游的平均延迟(秒), 如 transcript=0.3,snapany=1.5,ytdlp=2')
+    parser.add_argument('--jitter', type=float, default=0.2, help='延迟浮动比例')
+    parser.add_argument('--fail', default='', help='各上游的失败率, 如 snapany=0.1')
+    parser.add_argument('--cues', type=int, default=300, help='每条字幕的条数')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+
+
+def config_from_args(args) -> StubConfig:
+    return StubConfig(latency=parse_pairs(args.latency), jitter=args.jitter,
+                      failure_rate=parse_pairs(args.fail), cues=args.cues, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地上游替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer(args.host, args.port, config_from_args(args))
+    print(f'上游替身: {server.base_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+双语字幕对齐
+把两种语言的字幕按时间合并为一条字幕轨: 以主语言字幕为准, 每条次语言字幕归入与其时间重叠最多的
+主语言字幕(没有重叠时归入开始时间最近的一条)。两条轨都按开始时间排序, 双指针线性扫描一遍即可。
+对齐结果按两条字幕的内容摘要缓存(AlignCache)。
+"""
+
+import os
+from typing import Dict, List, Optional
+
+from cache import BoundedCache
+from transcript_index import TranscriptIndex
+
+
+def align(primary: TranscriptIndex, secondary: TranscriptIndex, separator: str = ' ') -> List[Dict]:
+    """
+    按时间对齐两条字幕
+
+    参数:
+        primary: 主语言字幕, 决定返回的字幕条数和时间
+        secondary: 次语言字幕
+        separator: 多条次语言字幕归入同一条主语言字幕时的分隔符
+
+    返回:
+        [{start, duration, text, secondary}], secondary 为对应的次语言文本(没有时为空字符串)
+    """
+    count = len(primary)
+    if count == 0:
+        return []
+
+    starts, durations = primary.starts, primary.durations
+    matched: List[List[str]] = [[] for _ in range(count)]
+
+    i = 0
+    for j in range(len(secondary)):
+        start = secondary.starts[j]
+        end = start + secondary.durations[j]
+
+        # 跳过已经在当前次语言字幕开始前结束的主语言字幕(次语言字幕按开始时间排序, 指针只前进)
+        while i < count - 1 and starts[i] + durations[i] <= start:
+            i += 1
+
+        # 在与 [start, end) 重叠的主语言字幕中选择重叠最多的一条
+        best, best_overlap = -1, 0.0
+        k = i
+        while k < count and starts[k] < end:
+            overlap = min(end, starts[k] + durations[k]) - max(start, starts[k])
+            if overlap > best_overlap:
+                best, best_overlap = k, overlap
+            k += 1
+
+        if best < 0:
+            # 没有重叠(落在两条主语言字幕之间的空隙): 归入开始时间最近的一条
+            best = i
+            if i > 0 and abs(starts[i - 1] - start) < abs(starts[i] - start):
+                best = i - 1
+        matched[best].append(secondary.text(j))
+
+    return [
+        {
+            'start': starts[i],
+            'duration': durations[i],
+            'text': primary.text(i),
+            'secondary': separator.join(matched[i]),
+        }
+        for i in range(count)
+    ]
+
+
+class AlignCache:
+    """
+    按两条字幕的内容摘要缓存对齐结果(LRU, 按条目数和近似字节数限制大小)
+    /api/bilingual 的响应体另按 ETag 缓存, 这里供批量接口等直接使用对齐结果的调用方共用
+
+    参数:
+        max_entries: 最多缓存的字幕对数
+        max_bytes: 近似字节数上限
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        self._cache = BoundedCache(
+            max_entries=max_entries if max_entries is not None else int(os.getenv('BILINGUAL_CACHE_MAX_ENTRIES', 128)),
+            max_bytes=max_bytes if max_bytes is not None else int(os.getenv('BILINGUAL_CACHE_MAX_BYTES', 16 * 1024 * 1024)),
+            sweep_interval=0,
+            name='align-cache',
+        )
+
+    def get(self, primary: TranscriptIndex, secondary: TranscriptIndex) -> List[Dict]:
+        """读取对齐结果, 没有时对齐并缓存"""
+        key = f'{primary.digest()}:{secondary.digest()}'
+        cues = self._cache.get(key)
+        if cues is None:
+            cues = align(primary, secondary)
+            size = primary.nbytes() + sum(len(cue['secondary']) for cue in cues) + 64 * len(cues)
+            self._cache.set(key, cues, float('inf'), size=size)
+        return cues
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+进程内有界缓存
+线程安全的 LRU + TTL 缓存,按条目数和近似字节数限制大小,后台定期清理过期条目
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def approximate_size(value: Any) -> int:
+    """估算缓存值占用的字节数(按 JSON 序列化后的长度)"""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    nbytes = getattr(value, 'nbytes', None)
+    if callable(nbytes):
+        return nbytes()
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+    except (TypeError, ValueError):
+        return 1024
+
+
+class _Entry:
+    __slots__ = ('value', 'expires_at', 'stale_until', 'size')
+
+    def __init__(self, value: Any, expires_at: float, stale_until: float, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.size = size
+
+
+class BoundedCache:
+    """
+    线程安全的有界缓存
+
+    - 每个条目有过期时间 expires_at, 以及可作为旧数据返回的截止时间 stale_until
+    - 超过 max_entries 或 max_bytes 时淘汰最久未使用的条目
+    - 后台线程每隔 sweep_interval 秒清理彻底过期的条目
+
+    参数:
+        max_entries: 最多条目数
+        max_bytes: 近似字节数上限
+        sweep_interval: 清理间隔(秒), 0 表示不启动清理线程
+        name: 缓存名称(用于日志和统计)
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024,
+                 sweep_interval: float = 60, name: str = 'cache'):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self._bytes = 0
+        self._sweeper_pid = None
+
+        # 统计
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # ------------------------------------------------------------------
+    # 读写
+    # ------------------------------------------------------------------
+
+    def get_entry(self, key: str) -> Optional[Dict]:
+        """
+        读取缓存, 包括仍可作为旧数据返回的条目
+
+        返回:
+            {'value': ..., 'expires_at': ..., 'stale': bool}, 不存在或已彻底过期时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.expires_at <= now and entry.stale_until <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            stale = entry.expires_at <= now
+            if stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return {'value': entry.value, 'expires_at': entry.expires_at, 'stale': stale}
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取未过期的缓存"""
+        entry = self.get_entry(key)
+        if entry is None or entry['stale']:
+            return None
+        return entry['value']
+
+    def set(self, key: str, value: Any, expires_at: float, stale_until: Optional[float] = None,
+            size: Optional[int] = None):
+        """
+        写入缓存
+
+        参数:
+            expires_at: 过期时间(Unix 时间戳)
+            stale_until: 可作为旧数据返回的截止时间, 默认与 expires_at 相同
+            size: 近似字节数, 默认按 JSON 长度估算
+        """
+        size = approximate_size(value) if size is None else size
+        stale_until = expires_at if stale_until is None else stale_until
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = _Entry(value, expires_at, stale_until, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+        self._ensure_sweeper()
+
+    def pop(self, key: str) -> Optional[Any]:
+        """删除条目"""
+        with self._lock:
+            entry = self._remove(key)
+        return entry.value if entry is not None else None
+
+    def _remove(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+
+    def items(self) -> Iterator[Tuple[str, Any, float, float]]:
+        """遍历 (key, value, expires_at, stale_until) 快照"""
+        with self._lock:
+            snapshot = [(k, e.value, e.expires_at, e.stale_until) for k, e in self._entries.items()]
+        return iter(snapshot)
+
+    def restore(self, entries: Iterable[Tuple[str, Any, float, float]]) -> int:
+        """
+        写入 items() 格式的条目(保留原有的过期时间), 跳过已彻底过期的条目
+        不启动清理线程, 可以在 fork 之前调用
+
+        返回:
+            写入的条目数
+        """
+        now = time.time()
+        restored = 0
+        for key, value, expires_at, stale_until in entries:
+            if max(expires_at, stale_until) <= now:
+                continue
+            size = approximate_size(value)
+            with self._lock:
+                if key in self._entries or size > self.max_bytes:
+                    continue
+                self._entries[key] = _Entry(value, expires_at, stale_until, size)
+                self._bytes += size
+                while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+                    self.evictions += 1
+            restored += 1
+        return restored
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ------------------------------------------------------------------
+    # 过期清理
+    # ------------------------------------------------------------------
+
+    def sweep(self) -> int:
+        """清理彻底过期的条目, 返回清理数量"""
+        now = time.time()
+        with self._lock:
+            expired = [k for k, e in self._entries.items() if e.expires_at <= now and e.stale_until <= now]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def _ensure_sweeper(self):
+        """fork 之后在每个 worker 中各自启动清理线程"""
+        if self.sweep_interval <= 0 or self._sweeper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+        threading.Thread(target=self._sweep_loop, name=f'{self.name}-sweeper', daemon=True).start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"{self.name} 清理失败: {e}")
+
+    def stats(self) -> Dict:
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+缓存快照与预热
+进程内的缓存(播放地址解析结果、渲染好的字幕)在重启和免费实例休眠后全部丢失,
+本模块定期以及进程退出时把热点条目写入一个压缩快照文件, 启动时(gunicorn preload 的 master 中,
+fork 之前)恢复未过期的条目, 所有 worker 一开始就能命中缓存。
+
+快照内容:
+- media:    MediaURLCache 的条目(保留原有的过期时间)
+- rendered: 最近使用的 SRT / VTT / 时间戳渲染结果
+- store:    最近访问的字幕及其语言列表和请求别名(字幕库不在持久磁盘上时仍可恢复)
+- videos:   最近访问的视频, 作为预热候选
+
+多个 worker 各自保存, 写入时在文件锁内与已有快照合并, 通过临时文件 + rename 原子替换。
+启动后可以在后台重新获取 WARMUP_VIDEO_IDS 和快照中最近访问的 WARMUP_TOP_N 个视频(只在一个 worker 中执行)。
+"""
+
+import atexit
+import base64
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 本地开发时不加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'snapshot.json.gz')
+
+# 快照格式版本, 不一致时忽略旧快照
+SNAPSHOT_VERSION = 2
+
+
+class CacheSnapshot:
+    """
+    缓存快照
+
+    参数:
+        media_cache: 播放地址缓存(MediaURLCache)
+        store: 字幕存储(TranscriptStore)
+        render_cache: 字幕渲染缓存(RenderCache)
+        warm: 预热一个视频的函数, 参数为 video_id
+        path: 快照文件路径, 空字符串表示关闭
+        interval: 保存间隔(秒), 0 表示只在进程退出时保存
+        max_transcripts: 最多保存的字幕数
+        max_rendered: 最多保存的渲染结果数
+        warmup_top_n: 启动后预热快照中最近访问的视频数
+        warmup_ids: 启动后总是预热的视频
+    """
+
+    def __init__(self, media_cache, store, render_cache, warm: Optional[Callable[[str], object]] = None,
+                 path: Optional[str] = None, interval: Optional[float] = None,
+                 max_transcripts: Optional[int] = None, max_rendered: Optional[int] = None,
+                 warmup_top_n: Optional[int] = None, warmup_ids: Optional[List[str]] = None):
+        self.media_cache = media_cache
+        self.store = store
+        self.render_cache = render_cache
+        self.warm = warm
+        self.path = path if path is not None else os.getenv('CACHE_SNAPSHOT_PATH', DEFAULT_SNAPSHOT_PATH)
+        self.interval = interval if interval is not None else float(os.getenv('CACHE_SNAPSHOT_INTERVAL', 300))
+        self.max_transcripts = max_transcripts if max_transcripts is not None else \
+            int(os.getenv('CACHE_SNAPSHOT_MAX_TRANSCRIPTS', 100))
+        self.max_rendered = max_rendered if max_rendered is not None else \
+            int(os.getenv('CACHE_SNAPSHOT_MAX_RENDERED', 64))
+        self.warmup_top_n = warmup_top_n if warmup_top_n is not None else int(os.getenv('WARMUP_TOP_N', 0))
+        self.warmup_ids = warmup_ids if warmup_ids is not None else \
+            [v.strip() for v in os.getenv('WARMUP_VIDEO_IDS', '').split(',') if v.strip()]
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._videos: List[str] = []
+        # 启动标识: preload 时在 master 中生成, 所有 worker 相同
+        self._boot_id = f'{os.getpid()}-{time.time():.0f}'
+
+        # 统计
+        self.restored: Dict[str, int] = {}
+        self.saves = 0
+        self.save_failures = 0
+        self.last_saved_at: Optional[float] = None
+        self.warmed = 0
+        self.warm_failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    # ------------------------------------------------------------------
+    # 读写
+    # ------------------------------------------------------------------
+
+    def _read(self) -> Optional[Dict]:
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取缓存快照失败: {e}")
+            return None
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            return None
+        return snapshot
+
+    def _write(self, snapshot: Dict):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=6) as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+    def _build(self, previous: Optional[Dict]) -> Dict:
+        """当前进程的缓存与已有快照合并(同一个键以当前进程为准), 丢弃已彻底过期的条目"""
+        now = time.time()
+        previous = previous or {}
+
+        media = {entry[0]: entry for entry in previous.get('media', [])}
+        for key, value, expires_at, stale_until in self.media_cache.items():
+            media.pop(key, None)
+            media[key] = [key, value, expires_at, stale_until]
+        media_entries = []
+        for entry in media.values():
+            if max(entry[2], entry[3]) <= now:
+                continue
+            try:
+                json.dumps(entry[1])
+            except (TypeError, ValueError):
+                continue
+            media_entries.append(entry)
+
+        rendered = {entry[0]: entry for entry in previous.get('rendered', [])}
+        for entry in self.render_cache.export(self.max_rendered):
+            rendered.pop(entry[0], None)
+            rendered[entry[0]] = entry
+
+        rows = self.store.export_recent(self.max_transcripts)
+        for row in rows['transcripts']:
+            row[5] = base64.b64encode(row[5]).decode('ascii')
+
+        return {
+            'version': SNAPSHOT_VERSION,
+            'saved_at': now,
+            'media': media_entries[-self.media_cache.max_entries:],
+            'rendered': list(rendered.values())[-self.max_rendered:] if self.max_rendered > 0 else [],
+            'store': rows,
+            'videos': list(dict.fromkeys(row[0] for row in rows['transcripts'])),
+        }
+
+    def save(self) -> bool:
+        """保存快照(与其他 worker 写入的快照合并), 返回是否成功"""
+        if not self.enabled:
+            return False
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        started = time.perf_counter()
+        try:
+            with open(f'{self.path}.lock', 'a') as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                snapshot = self._build(self._read())
+                self._write(snapshot)
+        except Exception as e:
+            self.save_failures += 1
+            logger.warning(f"保存缓存快照失败: {e}")
+            return False
+
+        self.saves += 1
+        self.last_saved_at = time.time()
+        logger.debug(f"缓存快照已保存: {len(snapshot['media'])} 个播放地址, {len(snapshot['rendered'])} 个渲染结果, "
+                     f"{len(snapshot['store']['transcripts'])} 条字幕 ({time.perf_counter() - started:.3f}s)")
+        return True
+
+    def restore(self) -> Dict[str, int]:
+        """
+        恢复快照中未过期的条目(已有的条目不覆盖), 在开始处理请求前调用
+
+        返回:
+            各部分恢复的条目数
+        """
+        snapshot = self._read() if self.enabled else None
+        if snapshot is None:
+            return {}
+
+        restored = {
+            'media': self.media_cache.restore(tuple(entry) for entry in snapshot.get('media', [])),
+            'rendered': self.render_cache.restore(snapshot.get('rendered', [])),
+            'transcripts': 0,
+        }
+        rows = snapshot.get('store') or {}
+        for row in rows.get('transcripts', []):
+            row[5] = base64.b64decode(row[5])
+        try:
+            restored['transcripts'] = self.store.import_rows(rows)
+        except Exception as e:
+            logger.warning(f"恢复字幕快照失败: {e}")
+
+        self._videos = snapshot.get('videos', [])
+        self.restored = restored
+        age = time.time() - snapshot.get('saved_at', 0)
+        logger.info(f"已从缓存快照恢复 {restored['media']} 个播放地址, {restored['rendered']} 个渲染结果, "
+                    f"{restored['transcripts']} 条字幕(快照保存于 {age:.0f} 秒前)")
+        return restored
+
+    # ------------------------------------------------------------------
+    # 后台任务
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """
+        在当前进程中启动定期保存和预热(gunicorn 的 post_fork 钩子、ASGI lifespan 和开发服务器调用)
+        进程正常退出时再保存一次
+        """
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+        if self.interval > 0:
+            threading.Thread(target=self._save_loop, name='cache-snapshot', daemon=True).start()
+        atexit.register(self.save)
+
+        targets = self.warmup_targets()
+        if targets and self.warm is not None:
+            threading.Thread(target=self._warm_up, args=(targets,), name='cache-warmup', daemon=True).start()
+
+    def _save_loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.save()
+
+    def warmup_targets(self) -> List[str]:
+        """需要预热的视频: WARMUP_VIDEO_IDS 加上快照中最近访问的 warmup_top_n 个视频"""
+        recent = self._videos[:self.warmup_top_n] if self.warmup_top_n > 0 else []
+        return list(dict.fromkeys(self.warmup_ids + recent))
+
+    def _claim_warmup(self) -> bool:
+        """同一次启动只由一个 worker 预热"""
+        if fcntl is None:
+            return True
+        marker = f'{self.path}.warmup'
+        with open(marker, 'a+') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return False
+            f.seek(0)
+            if f.read().strip() == self._boot_id:
+                return False
+            f.seek(0)
+            f.truncate()
+            f.write(self._boot_id)
+            return True
+
+    def _warm_up(self, video_ids: List[str]):
+        try:
+            if not self._claim_warmup():
+                return
+        except OSError as e:
+            logger.warning(f"预热失败: {e}")
+            return
+
+        started = time.perf_counter()
+        for video_id in video_ids:
+            try:
+                self.warm(video_id)
+                self.warmed += 1
+            except Exception as e:
+                self.warm_failed += 1
+                logger.warning(f"预热 {video_id} 失败: {e}")
+        logger.info(f"预热完成: {self.warmed} 个视频成功, {self.warm_failed} 个失败 "
+                    f"({time.perf_counter() - started:.1f}s)")
+
+    def stats(self) -> Dict:
+        """快照统计信息"""
+        return {
+            'path': self.path or None,
+            'interval': self.interval,
+            'restored': self.restored,
+            'saves': self.saves,
+            'save_failures': self.save_failures,
+            'last_saved_at': self.last_saved_at,
+            'warmup_targets': len(self.warmup_targets()),
+            'warmed': self.warmed,
+            'warm_failed': self.warm_failed,
+        }
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+部署配置
+按名称(DEPLOY_PROFILE)选择服务模式、worker 类型和 worker / 线程数, gunicorn.conf.py 使用。
+auto(默认)按容器的 CPU 配额和内存上限选择:
+
+- free:     免费套餐(512 MB、不足 1 个 CPU), 1 个 worker, 4 个线程
+- standard: 每个 CPU 一个 worker(受内存限制), 每个 worker 8 个线程
+- async:    asyncio 模式(见 asgi.py), worker 数同 standard
+
+单项仍可用环境变量覆盖: SERVER_MODE、WEB_CONCURRENCY(worker 数)、GUNICORN_THREADS(线程数)
+"""
+
+import math
+import os
+from typing import NamedTuple, Optional
+
+# 每个 worker 的内存估算(MB), 以及留给 master 和系统的内存
+WORKER_MEMORY_MB = int(os.getenv('WORKER_MEMORY_MB', 150))
+RESERVED_MEMORY_MB = int(os.getenv('RESERVED_MEMORY_MB', 100))
+
+# 低于该内存(MB)或不足 1 个 CPU 时 auto 使用 free
+FREE_TIER_MEMORY_MB = 1024
+
+# 名称 -> (服务模式, worker 数(0 表示按资源计算), 线程数)
+PROFILES = {
+    'free': ('wsgi', 1, 4),
+    'standard': ('wsgi', 0, 8),
+    'async': ('asgi', 0, 1),
+}
+
+
+class DeploymentProfile(NamedTuple):
+    """解析后的部署配置"""
+    name: str
+    server_mode: str
+    workers: int
+    threads: int
+    cpus: float
+    memory_mb: Optional[int]
+
+    @property
+    def worker_class(self) -> str:
+        if self.server_mode == 'asgi':
+            return 'uvicorn.workers.UvicornWorker'
+        return 'gthread' if self.threads > 1 else 'sync'
+
+    @property
+    def wsgi_app(self) -> str:
+        return 'asgi:app' if self.server_mode == 'asgi' else 'app:app'
+
+    def describe(self) -> str:
+        memory = f'{self.memory_mb} MB' if self.memory_mb else '未知'
+        return (f'{self.name}: {self.server_mode}, {self.workers} 个 worker ({self.worker_class}), '
+                f'{self.threads} 个线程 (CPU {self.cpus:g}, 内存 {memory})')
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def available_cpus() -> float:
+    """可用 CPU 数, 优先使用 cgroup 配额(容器中 os.cpu_count 返回的是宿主机的核数)"""
+    # cgroup v2: "配额 周期" 或 "max 周期"
+    quota = _read('/sys/fs/cgroup/cpu.max')
+    if quota:
+        limit, _, period = quota.partition(' ')
+        if limit != 'max' and period:
+            return int(limit) / int(period)
+    # cgroup v1
+    limit, period = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us'), _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if limit and period and int(limit) > 0:
+        return int(limit) / int(period)
+    try:
+        return float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return float(os.cpu_count() or 1)
+
+
+def available_memory_mb() -> Optional[int]:
+    """可用内存(MB), 取 cgroup 上限和物理内存中较小的一个"""
+    candidates = []
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        value = _read(path)
+        # 未限制时 v2 为 "max", v1 为一个极大的数
+        if value and value.isdigit() and int(value) < 1 << 60:
+            candidates.append(int(value) // (1024 * 1024))
+    meminfo = _read('/proc/meminfo')
+    if meminfo:
+        for line in meminfo.splitlines():
+            if line.startswith('MemTotal:'):
+                candidates.append(int(line.split()[1]) // 1024)
+                break
+    return min(candidates) if candidates else None
+
+
+def _auto_workers(cpus: float, memory_mb: Optional[int]) -> int:
+    workers = max(1, math.ceil(cpus))
+    if memory_mb:
+        workers = min(workers, max(1, (memory_mb - RESERVED_MEMORY_MB) // WORKER_MEMORY_MB))
+    return workers
+
+
+def resolve(name: Optional[str] = None) -> DeploymentProfile:
+    """按名称(默认 DEPLOY_PROFILE)和当前资源解析部署配置"""
+    cpus = available_cpus()
+    memory_mb = available_memory_mb()
+
+    name = (name or os.getenv('DEPLOY_PROFILE', 'auto')).lower()
+    if name == 'auto':
+        small = cpus < 1 or (memory_mb is not None and memory_mb < FREE_TIER_MEMORY_MB)
+        name = 'free' if small else 'standard'
+    if name not in PROFILES:
+        raise ValueError(f"未知的 DEPLOY_PROFILE: {name}(可选: auto, {', '.join(PROFILES)})")
+
+    server_mode, workers, threads = PROFILES[name]
+    server_mode = os.getenv('SERVER_MODE', server_mode)
+    workers = int(os.getenv('WEB_CONCURRENCY') or workers or _auto_workers(cpus, memory_mb))
+    threads = int(os.getenv('GUNICORN_THREADS') or threads)
+    return DeploymentProfile(name, server_mode, workers, threads, cpus, memory_mb)
+
+
+if __name__ == '__main__':
+    print(resolve().describe())
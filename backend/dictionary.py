@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+单词释义服务
+代替客户端逐个单词调用大模型: 批量查询的单词先去重并读取持久化缓存,
+未命中的单词合并为一次上游请求(OpenAI 兼容接口),结果写入缓存供所有用户复用
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+import admission
+import metrics
+import profiling
+import upstream_http
+from cache import BoundedCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'definitions.db')
+
+# 与客户端 DictionaryService 一致: 小写, 去掉首尾标点
+_EDGE_PUNCTUATION = re.compile(r'^[^\w]+|[^\w]+$')
+
+# 上游返回的内容可能包在 ```json 代码块中
+_CODE_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+
+def normalize_word(word: str) -> str:
+    """规范化单词(小写, 去掉首尾标点和空白)"""
+    return _EDGE_PUNCTUATION.sub('', (word or '').strip().lower())
+
+
+def build_prompt(words: List[str]) -> str:
+    """批量释义的提示词, 单个单词的格式与客户端 DictionaryService 相同"""
+    listed = '\n'.join(f'- {word}' for word in words)
+    return f"""请提供以下每个单词的详细释义:
+{listed}
+
+以JSON格式返回:
+{{
+  "words": [
+    {{
+      "word": "单词(与上面列表中的写法一致)",
+      "phonetic": "音标",
+      "definitions": [
+        {{
+          "partOfSpeech": "词性(如 n., v., adj.)",
+          "meanings": ["主要释义"]
+        }}
+      ],
+      "examples": ["例句1", "例句2"],
+      "chineseTranslation": "中文翻译"
+    }}
+  ]
+}}
+要求：
+1. 每个单词只返回1个词性的1个主要释义
+2. 每个单词提供2个简短易懂的英文例句
+3. chineseTranslation 只返回简洁的中文翻译(1-3个词)
+4. 只返回JSON,不要其他内容"""
+
+
+class DictionaryError(Exception):
+    """上游释义接口调用失败"""
+
+
+class DictionaryService:
+    """
+    带持久化缓存的批量单词释义
+
+    - 释义保存在 SQLite 文件中, 所有 worker 和重启后的进程共享; 常用词在进程内另有一份热点缓存
+    - 同一单词正在被其他请求查询时等待其结果, 不重复请求上游
+    - 一次查询中未命中的单词合并为一次上游请求(单词数受 /api/define 的 DEFINE_MAX_WORDS 限制)
+
+    参数:
+        base_url: OpenAI 兼容接口地址(如 https://api.vveai.com/v1)
+        api_key: 接口密钥
+        model: 模型名称
+        path: 缓存文件路径
+        ttl: 释义有效期(秒)
+        timeout: 上游请求超时(秒)
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 model: Optional[str] = None, path: Optional[str] = None, ttl: Optional[float] = None,
+                 timeout: Optional[float] = None):
+        self.base_url = (base_url or os.getenv('DICTIONARY_API_BASE_URL')
+                         or os.getenv('VVEAI_API_BASE_URL', 'https://api.vveai.com/v1')).rstrip('/')
+        self.api_key = api_key if api_key is not None else (
+            os.getenv('DICTIONARY_API_KEY') or os.getenv('VVEAI_API_KEY', ''))
+        self.model = model or os.getenv('DICTIONARY_MODEL', 'gpt-4o-mini')
+        self.path = path or os.getenv('DICTIONARY_CACHE_PATH', DEFAULT_DICTIONARY_PATH)
+        self.ttl = ttl if ttl is not None else float(os.getenv('DICTIONARY_TTL', 30 * 24 * 3600))
+        self.timeout = timeout if timeout is not None else float(os.getenv('DICTIONARY_TIMEOUT', 60))
+
+        self.session = upstream_http.create_session()
+        self._local = threading.local()
+        self._hot = BoundedCache(max_entries=int(os.getenv('DICTIONARY_HOT_ENTRIES', 2000)),
+                                 sweep_interval=0, name='dictionary-hot')
+
+        # 正在查询的单词 -> Future
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.upstream_calls = 0
+        self.upstream_failures = 0
+
+    # ------------------------------------------------------------------
+    # 持久化缓存
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=10000')
+        if conn.execute('PRAGMA user_version').fetchone()[0] != self.SCHEMA_VERSION:
+            conn.execute('DROP TABLE IF EXISTS definitions')
+            conn.execute(f'PRAGMA user_version={self.SCHEMA_VERSION}')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS definitions (
+                word TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @profiling.timed('cache')
+    def _read_cached(self, words: Iterable[str]) -> Dict[str, Dict]:
+        found = {}
+        remaining = []
+        for word in words:
+            cached = self._hot.get(word)
+            if cached is not None:
+                found[word] = cached
+            else:
+                remaining.append(word)
+        if not remaining:
+            return found
+
+        now = time.time()
+        try:
+            placeholders = ','.join('?' * len(remaining))
+            rows = self._connect().execute(
+                f'SELECT word, data, expires_at FROM definitions WHERE word IN ({placeholders})', remaining
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"读取释义缓存失败: {e}")
+            return found
+
+        for word, data, expires_at in rows:
+            if expires_at > now:
+                definition = json.loads(data)
+                found[word] = definition
+                self._hot.set(word, definition, expires_at)
+        return found
+
+    def _write_cached(self, definitions: Dict[str, Dict]):
+        expires_at = time.time() + self.ttl
+        for word, definition in definitions.items():
+            self._hot.set(word, definition, expires_at)
+        try:
+            self._connect().executemany(
+                'INSERT OR REPLACE INTO definitions (word, data, expires_at) VALUES (?, ?, ?)',
+                [(word, json.dumps(definition, ensure_ascii=False), expires_at) for word, definition in definitions.items()]
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"写入释义缓存失败: {e}")
+
+    # ------------------------------------------------------------------
+    # 上游请求
+    # ------------------------------------------------------------------
+
+    def _fetch_upstream(self, words: List[str]) -> Dict[str, Dict]:
+        """一次上游请求获取一组单词的释义, 返回 规范化单词 -> 释义"""
+        if not self.api_key:
+            raise DictionaryError("未配置释义接口密钥(DICTIONARY_API_KEY)")
+
+        with self._lock:
+            self.upstream_calls += 1
+        try:
+            with metrics.upstream('dictionary'):
+                response = self.session.post(
+                    f"{self.base_url}/chat/completions",
+                    headers={'Authorization': f'Bearer {self.api_key}'},
+                    json={
+                        'model': self.model,
+                        'messages': [{'role': 'user', 'content': build_prompt(words)}],
+                        'temperature': 0.3,
+                    },
+                    timeout=self.timeout,
+                )
+                response.raise_for_status()
+            content = response.json()['choices'][0]['message']['content']
+            if not isinstance(content, str):
+                # 拒答或工具调用时 content 为 null
+                raise ValueError(f"回复中没有文本内容: {content!r}")
+            items = json.loads(_CODE_FENCE.sub('', content.strip()))
+        except (requests.RequestException, ValueError, KeyError, IndexError, TypeError) as e:
+            with self._lock:
+                self.upstream_failures += 1
+            raise DictionaryError(f"释义接口调用失败: {e}")
+
+        if isinstance(items, dict):
+            items = items.get('words', [items])
+
+        requested = set(words)
+        definitions = {}
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            word = normalize_word(str(item.get('word', '')))
+            if word in requested:
+                definitions[word] = item
+        return definitions
+
+    def _resolve(self, words: List[str]) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+        """
+        查询未命中缓存的单词, 正在被其他请求查询的单词等待其结果
+
+        返回:
+            (释义, 失败的单词 -> 错误信息)
+        """
+        admission.enter_upstream()
+        owned: Dict[str, Future] = {}
+        waiting: Dict[str, Future] = {}
+        with self._lock:
+            for word in words:
+                if word in self._pending:
+                    waiting[word] = self._pending[word]
+                else:
+                    owned[word] = self._pending[word] = Future()
+
+        definitions: Dict[str, Dict] = {}
+        errors: Dict[str, str] = {}
+        try:
+            batch = list(owned)
+            # 等待期间其他请求可能已经写入缓存
+            definitions.update(self._read_cached(batch))
+            batch = [word for word in batch if word not in definitions]
+
+            if batch:
+                try:
+                    fetched = self._fetch_upstream(batch)
+                except DictionaryError as e:
+                    errors.update({word: str(e) for word in batch})
+                else:
+                    self._write_cached(fetched)
+                    definitions.update(fetched)
+                    errors.update({word: "释义接口未返回该单词" for word in batch if word not in fetched})
+        finally:
+            with self._lock:
+                for word, future in owned.items():
+                    self._pending.pop(word, None)
+                    future.set_result(definitions.get(word))
+
+        deadline = time.monotonic() + self.timeout * 2
+        for word, future in waiting.items():
+            try:
+                definition = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                errors[word] = "释义查询超时"
+                continue
+            if definition is not None:
+                definitions[word] = definition
+            else:
+                errors[word] = "释义查询失败"
+        return definitions, errors
+
+    # ------------------------------------------------------------------
+    # 对外接口
+    # ------------------------------------------------------------------
+
+    def define(self, words: Iterable[str]) -> Dict:
+        """
+        批量查询单词释义
+
+        返回:
+            {'definitions': {单词: 释义}, 'errors': {单词: 错误信息}}, 单词为规范化后的形式
+        """
+        unique = list(dict.fromkeys(w for w in (normalize_word(word) for word in words) if w))
+
+        definitions = self._read_cached(unique)
+        missing = [word for word in unique if word not in definitions]
+        with self._lock:
+            self.hits += len(definitions)
+            self.misses += len(missing)
+
+        errors: Dict[str, str] = {}
+        if missing:
+            fetched, errors = self._resolve(missing)
+            definitions.update(fetched)
+
+        return {
+            'definitions': {word: definitions[word] for word in unique if word in definitions},
+            'errors': errors,
+        }
+
+    def stats(self) -> Dict:
+        """释义服务统计信息"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'pending': len(self._pending),
+                'upstream_calls': self.upstream_calls,
+                'upstream_failures': self.upstream_failures,
+            }
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+播放地址解析路由
+SnapAny 和 yt-dlp 是两个互相独立的解析服务, 路由按各自的滚动耗时和错误率选择:
+
+- 优先请求当前更快、更稳定的服务; 它超过自身 p90 耗时仍未返回时, 再向另一个服务发出对冲请求,
+  先成功返回的结果生效(失败时立即改用另一个服务)
+- 连续失败或错误率过高的服务熔断一段时间, 期间不再请求; 冷却结束后放行一次试探请求,
+  成功则恢复, 失败则加倍冷却时间
+- 两个服务的结果统一为同一种格式(normalize_snapany / normalize_ytdlp)
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import admission
+import profiling
+from rate_limiter import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractorsUnavailable(admission.Overloaded):
+    """所有解析服务都处于熔断状态(与 Overloaded 一样返回 503 + Retry-After)"""
+
+
+# 本进程的限流和准入控制抛出的异常: 请求没有发出, 不代表解析服务出错
+LOCAL_REJECTIONS = (RateLimitExceeded, admission.Overloaded)
+
+
+# ----------------------------------------------------------------------
+# 结果格式
+# ----------------------------------------------------------------------
+
+def _best_url(formats: List[Dict]) -> Optional[str]:
+    """音视频合并的最高画质地址, 没有时取第一个地址"""
+    for fmt in formats:
+        if fmt['has_audio'] and fmt['video_url']:
+            return fmt['video_url']
+    return next((fmt['video_url'] for fmt in formats if fmt['video_url']), None)
+
+
+def normalize_snapany(result: Dict, video_id: str) -> Dict:
+    """SnapAny 解析结果(IIILabYouTubeService.extract_video_info)转换为统一格式"""
+    formats = [{
+        'quality': fmt.get('quality'),
+        'height': fmt.get('height') or 0,
+        'format': fmt.get('format') or 'mp4',
+        'video_url': fmt.get('video_url') or '',
+        'audio_url': fmt.get('audio_url'),
+        'has_audio': bool(fmt.get('has_audio')),
+        'filesize': fmt.get('filesize') or 0,
+    } for fmt in result.get('formats', [])]
+    return {
+        'success': True,
+        'video_id': video_id,
+        'source': 'snapany',
+        'title': result.get('title') or '',
+        'duration': result.get('duration') or 0,
+        'thumbnail': result.get('thumbnail') or '',
+        'video_url': _best_url(formats),
+        'formats': formats,
+    }
+
+
+def normalize_ytdlp(info: Dict, video_id: str) -> Dict:
+    """yt-dlp 解析结果(extract_info)转换为统一格式, 只保留有画面的直接地址和 HLS 流"""
+    formats = []
+    for fmt in info.get('formats') or []:
+        url = fmt.get('url')
+        if not url or fmt.get('vcodec') == 'none' or 'storyboard' in (fmt.get('format_id') or ''):
+            continue
+        height = fmt.get('height') or 0
+        hls = (fmt.get('protocol') or '').startswith('m3u8')
+        formats.append({
+            'quality': f"{height}p" if height else (fmt.get('format_note') or ''),
+            'height': height,
+            'format': 'm3u8' if hls else (fmt.get('ext') or 'mp4'),
+            'video_url': url,
+            'audio_url': None,
+            'has_audio': fmt.get('acodec') not in (None, 'none'),
+            'filesize': fmt.get('filesize') or fmt.get('filesize_approx') or 0,
+        })
+    # 与 SnapAny 一致: 按画质从高到低, 同画质时音视频合并的在前
+    formats.sort(key=lambda fmt: (fmt['height'], fmt['has_audio']), reverse=True)
+    return {
+        'success': True,
+        'video_id': video_id,
+        'source': 'yt_dlp',
+        'title': info.get('title') or '',
+        'duration': info.get('duration') or 0,
+        'thumbnail': info.get('thumbnail') or '',
+        'video_url': _best_url(formats),
+        'formats': formats,
+    }
+
+
+# ----------------------------------------------------------------------
+# 解析服务的统计和熔断
+# ----------------------------------------------------------------------
+
+class ExtractorBackend:
+    """
+    一个解析服务
+
+    参数:
+        name: 名称
+        extract: extract(video_id) -> 统一格式的结果
+        window: 滚动统计的样本数
+        min_samples: 按错误率熔断、按 p90 对冲前至少需要的样本数
+        error_threshold: 错误率达到该值时熔断
+        consecutive_failures: 连续失败该次数时熔断
+        cooldown: 首次熔断的冷却时间(秒), 试探失败后加倍, 最长 max_cooldown
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, extract: Callable[[str], Dict], window: int = 50, min_samples: int = 5,
+                 error_threshold: float = 0.5, consecutive_failures: int = 3,
+                 cooldown: float = 30.0, max_cooldown: float = 600.0):
+        self.name = name
+        self.extract = extract
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.consecutive_failures = consecutive_failures
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self._lock = threading.Lock()
+        # (耗时, 是否成功)
+        self._samples = deque(maxlen=window)
+        self._failures_in_row = 0
+        self.state = self.CLOSED
+        self.cooldown = cooldown
+        self.opened_at = 0.0
+        self._probing = False
+
+        self.calls = 0
+        self.wins = 0
+        self.trips = 0
+
+    def record(self, seconds: float, ok: bool):
+        """记录一次调用结果, 并更新熔断状态"""
+        with self._lock:
+            self._samples.append((seconds, ok))
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if ok:
+                    logger.info(f"解析服务 {self.name} 试探成功, 恢复使用")
+                    self.state = self.CLOSED
+                    self.cooldown = self.base_cooldown
+                    self._failures_in_row = 0
+                    self._samples.clear()
+                    self._samples.append((seconds, ok))
+                else:
+                    self._open(min(self.cooldown * 2, self.max_cooldown))
+                return
+
+            self._failures_in_row = 0 if ok else self._failures_in_row + 1
+            if self.state == self.CLOSED and not ok and (
+                    self._failures_in_row >= self.consecutive_failures or
+                    (len(self._samples) >= self.min_samples and self._error_rate() >= self.error_threshold)):
+                self._open(self.base_cooldown)
+
+    def skip(self):
+        """
+        调用在本进程内就被拒绝(令牌桶或准入控制), 请求没有到达服务: 不计入统计,
+        试探请求被拒绝时允许下一次试探
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+
+    def _open(self, cooldown: float):
+        self.state = self.OPEN
+        self.cooldown = cooldown
+        self.opened_at = time.time()
+        self.trips += 1
+        logger.warning(f"解析服务 {self.name} 熔断 {cooldown:.0f} 秒")
+
+    def allow(self) -> bool:
+        """是否可以发出请求; 冷却结束后只放行一个试探请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def available(self) -> bool:
+        """不改变状态地判断是否可以发出请求(用于排序)"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN:
+                return not self._probing
+            return time.time() - self.opened_at >= self.cooldown
+
+    def retry_in(self) -> float:
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.cooldown - time.time())
+
+    def _error_rate(self) -> float:
+        if not self._samples:
+            return 0.0
+        return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def _latency(self, q: float) -> Optional[float]:
+        latencies = sorted(seconds for seconds, ok in self._samples if ok)
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def hedge_delay(self, default: float) -> float:
+        """对冲等待时间: 成功请求的 p90 耗时, 样本不足时使用 default"""
+        with self._lock:
+            p90 = self._latency(0.9)
+        return default if p90 is None else p90
+
+    def score(self, default_latency: float) -> float:
+        """排序分数(越小越优先): 中位耗时按错误率加权"""
+        with self._lock:
+            p50 = self._latency(0.5)
+            error_rate = self._error_rate()
+        return (default_latency if p50 is None else p50) * (1 + 4 * error_rate)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            p50, p90 = self._latency(0.5), self._latency(0.9)
+            return {
+                'state': self.state,
+                'samples': len(self._samples),
+                'error_rate': round(self._error_rate(), 3),
+                'p50': None if p50 is None else round(p50, 3),
+                'p90': None if p90 is None else round(p90, 3),
+                'calls': self.calls,
+                'wins': self.wins,
+                'trips': self.trips,
+                'cooldown': self.cooldown if self.state != self.CLOSED else 0,
+            }
+
+
+class ExtractorRouter:
+    """
+    按耗时和错误率在多个解析服务之间路由, 并发出对冲请求
+
+    参数:
+        backends: ExtractorBackend 列表(顺序为没有统计数据时的优先顺序)
+        cache: MediaURLCache, 缓存统一格式的结果
+        hedge_delay: 首选服务样本不足时, 发出对冲请求前的等待时间(秒)
+        min_hedge_delay: 对冲等待时间下限(秒)
+        timeout: 整体超时(秒)
+        workers: 解析线程数
+    """
+
+    def __init__(self, backends: List[ExtractorBackend], cache=None, hedge_delay: Optional[float] = None,
+                 min_hedge_delay: Optional[float] = None, timeout: Optional[float] = None,
+                 workers: Optional[int] = None):
+        self.backends = backends
+        self.cache = cache
+        self.hedge_delay = hedge_delay if hedge_delay is not None else float(os.getenv('EXTRACTOR_HEDGE_DELAY', 5))
+        self.min_hedge_delay = min_hedge_delay if min_hedge_delay is not None else float(os.getenv('EXTRACTOR_MIN_HEDGE_DELAY', 0.5))
+        self.timeout = timeout if timeout is not None else float(os.getenv('EXTRACTOR_TIMEOUT', 45))
+        workers = workers if workers is not None else int(os.getenv('EXTRACTOR_WORKERS', 8))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='extract')
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.failovers = 0
+
+    def _count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _candidates(self) -> List[ExtractorBackend]:
+        available = [backend for backend in self.backends if backend.available()]
+        if not available:
+            retry_after = min(backend.retry_in() for backend in self.backends)
+            raise ExtractorsUnavailable("视频解析服务暂不可用,请稍后重试", max(1.0, retry_after))
+        # 稳定排序: 分数相同时保持配置顺序
+        return sorted(available, key=lambda backend: backend.score(self.hedge_delay))
+
+    def extract(self, video_id: str) -> Dict:
+        """解析视频, 返回统一格式的结果"""
+        cache_key = f"extract_{video_id}"
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        admission.enter_upstream()
+        self._count('requests')
+        with profiling.phase('upstream_extract'):
+            backend, result = self._race(video_id, self._candidates())
+        if self.cache is not None:
+            self.cache.set(cache_key, result)
+        return result
+
+    def _launch(self, backend: ExtractorBackend, video_id: str, done: queue.Queue):
+        with backend._lock:
+            backend.calls += 1
+        started = time.perf_counter()
+        future = self._executor.submit(backend.extract, video_id)
+
+        def finished(f):
+            error = f.exception()
+            if isinstance(error, LOCAL_REJECTIONS):
+                backend.skip()
+            else:
+                backend.record(time.perf_counter() - started, error is None)
+            done.put((backend, f))
+
+        future.add_done_callback(finished)
+
+    def _race(self, video_id: str, candidates: List[ExtractorBackend]) -> Tuple[ExtractorBackend, Dict]:
+        """依次启动解析服务, 返回最先成功的结果"""
+        done = queue.Queue()
+        waiting = list(candidates)
+        errors = []
+        pending = 0
+
+        def launch_next(reason: Optional[str] = None) -> Optional[ExtractorBackend]:
+            nonlocal pending
+            while waiting:
+                backend = waiting.pop(0)
+                if backend.allow():
+                    if reason:
+                        self._count(reason)
+                        logger.info(f"视频 {video_id} 向 {backend.name} 发出{'对冲' if reason == 'hedged' else '备用'}请求")
+                    self._launch(backend, video_id, done)
+                    pending += 1
+                    return backend
+            return None
+
+        primary = launch_next()
+        if primary is None:
+            raise ExtractorsUnavailable("视频解析服务暂不可用,请稍后重试",
+                                        max(1.0, min(backend.retry_in() for backend in self.backends)))
+
+        started = time.time()
+        deadline = started + self.timeout
+        hedge_at = started + max(self.min_hedge_delay, min(primary.hedge_delay(self.hedge_delay), self.timeout))
+
+        while pending:
+            now = time.time()
+            if now >= deadline:
+                break
+            wait_until = min(deadline, hedge_at) if waiting else deadline
+            try:
+                backend, future = done.get(timeout=max(0.0, wait_until - now))
+            except queue.Empty:
+                if waiting and time.time() >= hedge_at:
+                    # 首选服务超过其 p90 仍未返回
+                    launch_next('hedged')
+                    hedge_at = float('inf')
+                continue
+
+            pending -= 1
+            error = future.exception()
+            if error is None:
+                with backend._lock:
+                    backend.wins += 1
+                return backend, future.result()
+
+            errors.append(f"{backend.name}: {error}")
+            logger.warning(f"视频 {video_id} 使用 {backend.name} 解析失败: {error}")
+            if not pending:
+                launch_next('failovers')
+                hedge_at = float('inf')
+
+        if errors and not pending:
+            raise Exception(f"视频解析失败({'; '.join(errors)})")
+        raise Exception(f"视频解析超时({self.timeout:.0f} 秒)")
+
+    def collect_metrics(self):
+        """metrics.register_collector 使用"""
+        for backend in self.backends:
+            stats = backend.stats()
+            yield 'gauge', 'extractor_circuit_open', {'backend': backend.name}, \
+                0 if stats['state'] == ExtractorBackend.CLOSED else 1
+            yield 'counter', 'extractor_wins_total', {'backend': backend.name}, stats['wins']
+        with self._lock:
+            yield 'counter', 'extractor_hedged_total', {}, self.hedged
+
+    def stats(self) -> Dict:
+        with self._lock:
+            summary = {'requests': self.requests, 'hedged': self.hedged, 'failovers': self.failovers}
+        summary['backends'] = {backend.name: backend.stats() for backend in self.backends}
+        return summary
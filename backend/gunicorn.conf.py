@@ -4,19 +4,30 @@ Gunicorn 配置文件
 """
 
 import os
-import multiprocessing
+
+import deployment
+
+# 部署配置: 按 DEPLOY_PROFILE(默认 auto, 按 CPU 和内存选择)确定服务模式和 worker / 线程数
+profile = deployment.resolve()
+
+# 服务模式: wsgi(Flask) 或 asgi(asyncio, 见 asgi.py)
+server_mode = profile.server_mode
+
+# 应用入口(命令行指定的应用优先)
+wsgi_app = profile.wsgi_app
 
 # 服务器绑定地址
 bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
 
-# Worker 进程数 (免费套餐建议使用 1 个)
-workers = 1
+# Worker 进程数
+workers = profile.workers
 
 # 每个 worker 的线程数
-threads = 2
+threads = profile.threads
 
 # Worker 类型
-worker_class = "sync"
+# asgi 模式下每个 worker 是一个事件循环, threads 不再生效
+worker_class = profile.worker_class
 
 # 超时时间 (秒)
 timeout = 120
@@ -36,3 +47,32 @@ graceful_timeout = 30
 
 # 预加载应用
 preload_app = True
+
+
+def on_starting(server):
+    """master 启动时清空上一次运行留下的指标文件"""
+    import metrics
+    metrics.reset_directory()
+    server.log.info(f"部署配置 {profile.describe()}")
+
+
+def post_fork(server, worker):
+    """按实际线程数(命令行参数可能覆盖配置)设置准入控制的上限, asgi 模式由 asgi.py 按阻塞线程池设置"""
+    if server.cfg.worker_class_str.startswith('uvicorn'):
+        return
+    import admission
+    admission.configure_for_threads(server.cfg.threads)
+
+
+def post_worker_init(worker):
+    """worker 加载应用后启动缓存快照的定期保存(退出时再保存一次)和预热, asgi 模式在 lifespan 中启动"""
+    if worker.cfg.worker_class_str.startswith('uvicorn'):
+        return
+    from app import cache_snapshot
+    cache_snapshot.start()
+
+
+def child_exit(server, worker):
+    """worker 退出后把其累计指标并入归档, 删除其指标文件"""
+    import metrics
+    metrics.mark_process_dead(worker.pid)
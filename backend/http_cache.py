@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+条件请求与压缩
+- 响应带强 ETag, 客户端通过 If-None-Match 重新验证时返回 304
+- 根据 Accept-Encoding 协商 gzip 压缩, 根据 Accept 选择响应格式
+- 序列化和压缩后的响应体按 ETag 缓存, 相同内容不重复计算
+"""
+
+import gzip
+import hashlib
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import profiling
+from cache import BoundedCache
+
+# 小于该字节数的响应不压缩
+GZIP_MIN_BYTES = int(os.getenv('RESPONSE_GZIP_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', 6))
+
+_GZIP_SUFFIX = '-gzip'
+
+# 已序列化的响应体(所有 Representation 共用)
+_bodies = BoundedCache(
+    max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 512)),
+    max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    sweep_interval=0,
+    name='response-cache',
+)
+
+
+def make_etag(*parts) -> str:
+    """根据决定响应内容的各部分计算强 ETag"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否命中(弱比较, 同一内容的压缩和未压缩版本视为相同)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+
+    opaque = etag.strip('"')
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"')
+        if candidate.endswith(_GZIP_SUFFIX):
+            candidate = candidate[:-len(_GZIP_SUFFIX)]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """客户端是否接受 gzip(支持 q 值, q=0 表示拒绝; 明确列出的 gzip 优先于通配符)"""
+    if not accept_encoding:
+        return False
+
+    qualities = {}
+    for coding, quality in _weighted(accept_encoding):
+        if coding in ('gzip', 'x-gzip', '*'):
+            qualities.setdefault('*' if coding == '*' else 'gzip', quality)
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+def _weighted(header: str):
+    """解析 Accept / Accept-Encoding, 依次返回 (小写的值, q 值)"""
+    for item in header.split(','):
+        value, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, text = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(text)
+                except ValueError:
+                    quality = 0.0
+        yield value.strip().lower(), quality
+
+
+def negotiate(accept: Optional[str], offered: List[str]) -> str:
+    """
+    按 Accept 从 offered 中选择响应格式, q 值相同时按 offered 的顺序
+    没有 Accept、只有通配符或都不接受时返回 offered[0](默认格式)
+    """
+    if not accept:
+        return offered[0]
+
+    qualities = {}
+    for media_type, quality in _weighted(accept):
+        if media_type in offered:
+            qualities[media_type] = max(quality, qualities.get(media_type, 0.0))
+    best = max(offered, key=lambda media_type: qualities.get(media_type, 0.0))
+    return best if qualities.get(best, 0.0) > 0 else offered[0]
+
+
+class Representation:
+    """
+    一个可以条件请求和压缩的响应
+
+    参数:
+        etag: 强 ETag(由决定响应内容的参数计算, 无需先序列化)
+        content_type: Content-Type
+        render: 生成响应体的函数, 只在缓存未命中时调用
+        vary: Vary 响应头(按 Accept 协商格式的接口需要加上 Accept)
+    """
+
+    __slots__ = ('etag', 'content_type', 'render', 'vary')
+
+    def __init__(self, etag: str, content_type: str, render: Callable[[], bytes], vary: str = 'Accept-Encoding'):
+        self.etag = etag
+        self.content_type = content_type
+        self.render = render
+        self.vary = vary
+
+    def _bodies(self) -> Dict:
+        cached = _bodies.get(self.etag)
+        if cached is None:
+            with profiling.phase('serialize'):
+                body = self.render()
+                compressed = gzip.compress(body, GZIP_LEVEL, mtime=0) if len(body) >= GZIP_MIN_BYTES else None
+            cached = {'body': body, 'gzip': compressed}
+            _bodies.set(self.etag, cached, float('inf'), size=len(body) + len(compressed or b''))
+        return cached
+
+    def respond(self, if_none_match: Optional[str] = None,
+                accept_encoding: Optional[str] = None) -> Tuple[int, bytes, Dict[str, str]]:
+        """
+        生成响应
+
+        返回:
+            (状态码, 响应体, 响应头)
+        """
+        headers = {
+            'Content-Type': self.content_type,
+            'Cache-Control': 'no-cache',
+            'Vary': self.vary,
+        }
+        gzip_etag = self.etag[:-1] + _GZIP_SUFFIX + '"'
+
+        if etag_matches(if_none_match, self.etag):
+            # 304 沿用客户端已缓存的版本的 ETag
+            headers['ETag'] = gzip_etag if gzip_etag in if_none_match else self.etag
+            return 304, b'', headers
+
+        cached = self._bodies()
+        if accepts_gzip(accept_encoding) and cached['gzip'] is not None:
+            headers['ETag'] = gzip_etag
+            headers['Content-Encoding'] = 'gzip'
+            return 200, cached['gzip'], headers
+
+        headers['ETag'] = self.etag
+        return 200, cached['body'], headers
+
+
+def stats() -> Dict:
+    """响应体缓存统计信息"""
+    return _bodies.stats()
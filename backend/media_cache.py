@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+媒体地址缓存
+googlevideo 等播放地址带有 expire 参数,缓存有效期按最早过期的地址计算,
+解析结果可以一直复用到地址失效前,且不会返回已失效的地址
+"""
+
+import os
+import re
+import time
+from typing import Any, Iterable, Iterator, Optional
+from urllib.parse import parse_qs, urlparse
+
+from cache import BoundedCache
+
+# HLS 清单等地址把参数写在路径中: /expire/1700000000/
+_PATH_EXPIRE = re.compile(r'/expire/(\d+)')
+
+
+def url_expiry(url: str) -> Optional[float]:
+    """读取地址中的 expire 参数(Unix 时间戳), 没有时返回 None"""
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return None
+
+    values = parse_qs(parsed.query).get('expire')
+    if values and values[0].isdigit():
+        return float(values[0])
+
+    match = _PATH_EXPIRE.search(parsed.path)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def collect_urls(value: Any) -> Iterator[str]:
+    """递归取出解析结果中的所有 http(s) 地址"""
+    if isinstance(value, str):
+        if value.startswith(('http://', 'https://')):
+            yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from collect_urls(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from collect_urls(item)
+
+
+def earliest_expiry(urls: Iterable[str]) -> Optional[float]:
+    """所有地址中最早的过期时间"""
+    expiries = [e for e in (url_expiry(url) for url in urls) if e is not None]
+    return min(expiries) if expiries else None
+
+
+class MediaURLCache(BoundedCache):
+    """
+    按地址过期时间设置有效期的缓存
+
+    - 有效期 = 最早的 expire - 安全余量
+    - 地址不带 expire 时使用默认有效期
+    - 剩余有效期不足安全余量的结果不缓存
+    - 过期后直到地址真正失效前 stale_floor 秒, 仍可作为旧数据返回(stale-while-revalidate)
+    - 按条目数和近似字节数限制大小, 超出时淘汰最久未使用的条目
+
+    参数:
+        default_ttl: 地址不带 expire 时的有效期(秒)
+        safety_margin: 提前失效的安全余量(秒), 给客户端留出开始播放的时间
+        max_ttl: 有效期上限(秒)
+        stale_floor: 返回旧数据时地址至少还要有效的秒数
+        max_entries: 最多条目数
+        max_bytes: 近似字节数上限
+        sweep_interval: 过期条目清理间隔(秒)
+    """
+
+    def __init__(self, default_ttl: Optional[float] = None, safety_margin: Optional[float] = None,
+                 max_ttl: Optional[float] = None, stale_floor: Optional[float] = None,
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 sweep_interval: Optional[float] = None):
+        super().__init__(
+            max_entries=max_entries if max_entries is not None else int(os.getenv('MEDIA_CACHE_MAX_ENTRIES', 1000)),
+            max_bytes=max_bytes if max_bytes is not None else int(os.getenv('MEDIA_CACHE_MAX_BYTES', 16 * 1024 * 1024)),
+            sweep_interval=sweep_interval if sweep_interval is not None else float(os.getenv('MEDIA_CACHE_SWEEP_INTERVAL', 300)),
+            name='media-cache',
+        )
+        self.default_ttl = default_ttl if default_ttl is not None else float(os.getenv('MEDIA_CACHE_DEFAULT_TTL', 600))
+        self.safety_margin = safety_margin if safety_margin is not None else float(os.getenv('MEDIA_CACHE_SAFETY_MARGIN', 1800))
+        self.max_ttl = max_ttl if max_ttl is not None else float(os.getenv('MEDIA_CACHE_MAX_TTL', 6 * 3600))
+        self.stale_floor = stale_floor if stale_floor is not None else float(os.getenv('MEDIA_CACHE_STALE_FLOOR', 600))
+
+    def expires_at(self, value: Any, now: Optional[float] = None) -> float:
+        """计算解析结果的缓存过期时间"""
+        return self._lifetime(value, time.time() if now is None else now)[0]
+
+    def _lifetime(self, value: Any, now: float):
+        """返回 (过期时间, 可作为旧数据返回的截止时间)"""
+        expiry = earliest_expiry(collect_urls(value))
+        if expiry is None:
+            expires_at = now + self.default_ttl
+            return expires_at, expires_at + self.safety_margin - self.stale_floor
+        expires_at = min(expiry - self.safety_margin, now + self.max_ttl)
+        return expires_at, expiry - self.stale_floor
+
+    def set(self, key: str, value: Any) -> bool:
+        """
+        写入缓存
+
+        返回:
+            是否已缓存(地址即将过期时不缓存)
+        """
+        now = time.time()
+        expires_at, stale_until = self._lifetime(value, now)
+        if expires_at <= now:
+            self.pop(key)
+            return False
+
+        super().set(key, value, expires_at, stale_until)
+        return True
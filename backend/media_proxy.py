@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""
+播放地址代理
+googlevideo 播放地址与解析时的出口 IP 绑定, 设备与解析服务器的 IP 不同时无法播放。
+/api/stream/<video_id>/<format> 由服务端解析地址并转发 Range 请求(STREAM_PROXY_ENABLED=1 时开启):
+
+- 请求的字节区间拆成固定大小(STREAM_BLOCK_SIZE)的块向上游请求, 逐块以 64 KB 为单位流式返回,
+  不会把整个文件或整个块读入内存, 同时在播放的客户端再多内存也保持平稳
+- 上游请求使用 keep-alive 连接池, 拖动进度条时不需要重新建立 TLS 连接
+- 可选的磁盘 LRU 缓存(STREAM_CACHE_MAX_BYTES > 0)按块保存热门区间, 所有 worker 共享
+- 上游返回 403 / 410(地址过期)时重新解析一次
+
+媒体数据不经过上游请求录制与回放(upstream_http.py), 直接使用独立的连接池。
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from cache import BoundedCache
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('STREAM_PROXY_ENABLED', '0').lower() in ('1', 'true', 'yes')
+
+# 向上游请求的块大小, 也是磁盘缓存的单位
+BLOCK_SIZE = int(os.getenv('STREAM_BLOCK_SIZE', 1024 * 1024))
+
+# 每次读取和返回的字节数
+READ_SIZE = 64 * 1024
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'stream')
+
+# 上游返回这些状态码时说明地址已失效, 重新解析
+_EXPIRED_STATUSES = (403, 410)
+
+
+class RangeNotSatisfiable(Exception):
+    """请求的区间超出文件大小(416)"""
+
+    def __init__(self, size: int):
+        super().__init__(f"请求的区间超出文件大小 {size}")
+        self.size = size
+
+
+class UpstreamStreamError(Exception):
+    """上游返回了非预期的响应(502)"""
+
+
+class StreamTarget(NamedTuple):
+    """
+    代理的媒体文件
+
+    - url:          上游地址
+    - key:          缓存标识, 同一个文件的不同签名地址相同
+    - size:         文件字节数
+    - content_type: Content-Type
+    """
+    url: str
+    key: str
+    size: Optional[int]
+    content_type: Optional[str]
+
+
+def select_stream_url(payload: Dict, fmt: str) -> str:
+    """
+    从 /api/extract 的统一格式中选择播放地址
+
+    参数:
+        fmt: best(音视频合并的最高画质) / audio(音频) / 画质, 如 720p
+    """
+    formats = [f for f in payload.get('formats', []) if f.get('format') != 'm3u8']
+    if fmt == 'best':
+        url = next((f['video_url'] for f in formats if f['has_audio'] and f['video_url']), None)
+        url = url or next((f['video_url'] for f in formats if f['video_url']), None)
+    elif fmt == 'audio':
+        url = next((f['audio_url'] for f in formats if f.get('audio_url')), None)
+    else:
+        matches = [f for f in formats if f['video_url'] and fmt in (f.get('quality'), f"{f.get('height')}p")]
+        matches.sort(key=lambda f: not f['has_audio'])
+        url = matches[0]['video_url'] if matches else None
+    if not url:
+        raise ValueError(f"没有可代理的 {fmt} 格式(HLS 不支持代理)")
+    return url
+
+
+def describe_target(video_id: str, fmt: str, url: str) -> StreamTarget:
+    """按地址参数(itag / clen / mime)确定缓存标识、文件大小和类型, 缺少的部分需要向上游探测"""
+    params = parse_qs(urlparse(url).query)
+    itag = params.get('itag', [''])[0]
+    clen = params.get('clen', [''])[0]
+    mime = unquote(params.get('mime', [''])[0]) or None
+
+    if itag and clen.isdigit():
+        key = f'{video_id}:{itag}:{clen}'
+    else:
+        key = f'{video_id}:{fmt}:{hashlib.sha1(urlparse(url).path.encode()).hexdigest()[:16]}'
+    return StreamTarget(url, key, int(clen) if clen.isdigit() else None, mime)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析 Range 请求头(只取第一个区间)
+
+    返回:
+        闭区间 (start, end), 没有 Range 或格式无法识别时返回 None(返回完整文件)
+    """
+    if not header or not header.strip().lower().startswith('bytes='):
+        return None
+    first = header.strip()[6:].split(',')[0].strip()
+    start_text, _, end_text = first.partition('-')
+    try:
+        if not start_text:
+            # 后缀区间: 最后 n 个字节
+            length = int(end_text)
+            if length <= 0:
+                raise RangeNotSatisfiable(size)
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise RangeNotSatisfiable(size)
+    return start, min(end, size - 1)
+
+
+def split_blocks(start: int, end: int, block_size: int) -> Iterator[Tuple[int, int, int]]:
+    """把闭区间 [start, end] 拆成 (块号, 块内起点, 块内终点(不含))"""
+    for block in range(start // block_size, end // block_size + 1):
+        base = block * block_size
+        yield block, max(start, base) - base, min(end + 1, base + block_size) - base
+
+
+class BlockCache:
+    """
+    按块保存媒体数据的磁盘 LRU 缓存(多个 worker 共享同一个目录)
+
+    每块一个文件, 读取时更新修改时间; 写入的数据累计超过上限的 1/20 时扫描目录,
+    总大小超过上限时按修改时间删除最旧的块, 直到低于上限的 90%
+
+    参数:
+        directory: 缓存目录
+        max_bytes: 总大小上限
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 启动后第一次写入时先扫描一次
+        self._written = max_bytes
+        self.entries = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key: str, block: int) -> str:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{digest}.{block}')
+
+    def get(self, key: str, block: int, size: int):
+        """
+        打开已缓存的块, 没有缓存或文件大小不是 size(写入不完整)时返回 None
+
+        返回打开的文件而不是路径: 之后其他线程或 worker 淘汰这个块也不影响读取
+        """
+        path = self.path(key, block)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            actual = os.fstat(f.fileno()).st_size
+        except OSError:
+            actual = None
+        if actual != size:
+            f.close()
+            logger.warning(f"媒体缓存块大小不符({actual}/{size}), 已删除: {path}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # 读取期间被淘汰: 已打开的文件仍然可以读取
+            pass
+        self.hits += 1
+        return f
+
+    def writer(self, key: str, block: int):
+        """打开一个临时文件, 写完后调用 commit(), 失败时调用 discard()"""
+        os.makedirs(self.directory, exist_ok=True)
+        return open(f'{self.path(key, block)}.{os.getpid()}.{threading.get_ident()}.tmp', 'wb')
+
+    def commit(self, f, key: str, block: int):
+        size = f.tell()
+        f.close()
+        os.replace(f.name, self.path(key, block))
+        with self._lock:
+            self.entries += 1
+            self.bytes += size
+            self._written += size
+            due = self._written >= self.max_bytes // 20
+            if due:
+                self._written = 0
+        if due:
+            self.evict()
+
+    @staticmethod
+    def discard(f):
+        f.close()
+        try:
+            os.remove(f.name)
+        except OSError:
+            pass
+
+    def evict(self):
+        """扫描目录, 超过上限时删除最久未读取的块"""
+        files = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.endswith('.tmp'):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            logger.warning(f"扫描媒体缓存失败: {e}")
+            return
+
+        total = sum(size for _, size, _ in files)
+        if total > self.max_bytes:
+            files.sort()
+            target = self.max_bytes * 0.9
+            while files and total > target:
+                _, size, path = files.pop(0)
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+        self.entries, self.bytes = len(files), total
+
+    def stats(self) -> Dict:
+        return {
+            'directory': self.directory,
+            'entries': self.entries,
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class MediaProxy:
+    """
+    Range 请求代理
+
+    参数:
+        resolve: (video_id, fmt, force) -> 上游地址, force 为 True 时忽略缓存重新解析
+        cache: 磁盘块缓存, None 表示不缓存
+        block_size: 块大小
+        pool_size: 每个上游主机保持的连接数
+        timeout: 连接和读取超时(秒)
+    """
+
+    def __init__(self, resolve: Callable[[str, str, bool], str], cache: Optional[BlockCache] = None,
+                 block_size: Optional[int] = None, pool_size: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        self.resolve = resolve
+        self.cache = cache
+        self.block_size = block_size or BLOCK_SIZE
+        self.pool_size = pool_size or int(os.getenv('STREAM_POOL_SIZE', 16))
+        self.timeout = timeout or float(os.getenv('STREAM_TIMEOUT', 30))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # 缓存标识 -> (文件大小, Content-Type), 地址不带 clen / mime 时探测一次
+        self._meta = BoundedCache(max_entries=1000, max_bytes=1024 * 1024, sweep_interval=0, name='stream-meta')
+
+        # 统计
+        self._lock = threading.Lock()
+        self.active = 0
+        self.streams = 0
+        self.reresolved = 0
+
+    # ------------------------------------------------------------------
+    # 解析
+    # ------------------------------------------------------------------
+
+    def target(self, video_id: str, fmt: str, force: bool = False) -> StreamTarget:
+        """解析播放地址, 补全文件大小和类型"""
+        target = describe_target(video_id, fmt, self.resolve(video_id, fmt, force))
+        if target.size is not None and target.content_type:
+            return target
+
+        meta = self._meta.get(target.key)
+        if meta is None:
+            meta = self._probe(target)
+            if meta is None:
+                # 缓存的播放地址已过期: 重新解析一次
+                if force:
+                    raise UpstreamStreamError("重新解析后的播放地址仍然不可用")
+                with self._lock:
+                    self.reresolved += 1
+                return self.target(video_id, fmt, force=True)
+            self._meta.set(target.key, meta, time.time() + 6 * 3600)
+        return target._replace(size=target.size or meta[0], content_type=target.content_type or meta[1])
+
+    def _probe(self, target: StreamTarget) -> Optional[Tuple[int, str]]:
+        """请求第一个字节, 从 Content-Range 读取文件大小, 地址已过期时返回 None"""
+        with metrics.upstream('googlevideo.range'):
+            response = self.session.get(target.url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=self.timeout)
+        with response:
+            if response.status_code in _EXPIRED_STATUSES:
+                return None
+            if response.status_code != 206:
+                raise UpstreamStreamError(f"上游不支持区间请求: HTTP {response.status_code}")
+            size = int(response.headers.get('Content-Range', '*/0').rpartition('/')[2])
+            return size, response.headers.get('Content-Type')
+
+    # ------------------------------------------------------------------
+    # 响应
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def response_head(target: StreamTarget, range_header: Optional[str]) -> Tuple[int, Dict[str, str], int, int]:
+        """
+        响应状态码和响应头
+
+        返回:
+            (状态码, 响应头, 起点, 终点(含)), 文件为空时终点为 -1
+        """
+        size = target.size
+        headers = {
+            'Content-Type': target.content_type or 'application/octet-stream',
+            'Accept-Ranges': 'bytes',
+            'ETag': f'"{hashlib.blake2b(target.key.encode(), digest_size=12).hexdigest()}"',
+        }
+        byte_range = parse_range(range_header, size) if size else None
+        if byte_range is None:
+            headers['Content-Length'] = str(size)
+            return 200, headers, 0, size - 1
+
+        start, end = byte_range
+        headers['Content-Length'] = str(end - start + 1)
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return 206, headers, start, end
+
+    def open(self, video_id: str, fmt: str, range_header: Optional[str] = None
+             ) -> Tuple[int, Dict[str, str], Iterator[bytes]]:
+        """
+        打开一次代理请求(解析和参数错误在返回前抛出)
+
+        返回:
+            (状态码, 响应头, 响应体迭代器)
+        """
+        target = self.target(video_id, fmt)
+        status, headers, start, end = self.response_head(target, range_header)
+        return status, headers, self._stream(video_id, fmt, target, start, end)
+
+    def _stream(self, video_id: str, fmt: str, target: StreamTarget, start: int, end: int) -> Iterator[bytes]:
+        with self._lock:
+            self.active += 1
+            self.streams += 1
+        try:
+            for block, lo, hi in split_blocks(start, end, self.block_size) if end >= start else ():
+                cached = self._cached_block(target, block)
+                if cached is not None:
+                    yield from self._read_cached(cached, lo, hi)
+                else:
+                    target = yield from self._stream_block(video_id, fmt, target, block, lo, hi)
+        except Exception as e:
+            # 响应头已经发出, 上游错误、重新解析失败(熔断、限流)和读取缓存失败都只能提前结束响应
+            logger.warning(f"代理 {video_id}/{fmt} 中断: {e}")
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def _cached_block(self, target: StreamTarget, block: int):
+        """打开磁盘缓存中的块(已校验大小), 没有缓存时返回 None"""
+        if self.cache is None:
+            return None
+        base = block * self.block_size
+        return self.cache.get(target.key, block, min(base + self.block_size, target.size) - base)
+
+    @staticmethod
+    def _read_cached(f, lo: int, hi: int) -> Iterator[bytes]:
+        with f:
+            f.seek(lo)
+            remaining = hi - lo
+            while remaining > 0:
+                data = f.read(min(READ_SIZE, remaining))
+                if not data:
+                    raise UpstreamStreamError(f"媒体缓存块不完整: {f.name}")
+                remaining -= len(data)
+                yield data
+        metrics.inc('stream_bytes_total', {'source': 'cache'}, hi - lo)
+
+    def _fetch(self, video_id: str, fmt: str, target: StreamTarget, first: int, last: int):
+        """请求 [first, last] 区间, 地址失效时重新解析一次, 返回 (target, response)"""
+        for attempt in range(2):
+            with metrics.upstream('googlevideo.range'):
+                response = self.session.get(target.url, headers={'Range': f'bytes={first}-{last}'},
+                                            stream=True, timeout=self.timeout)
+            if response.status_code == 206:
+                return target, response
+            response.close()
+            if response.status_code in _EXPIRED_STATUSES and attempt == 0:
+                with self._lock:
+                    self.reresolved += 1
+                target = self.target(video_id, fmt, force=True)
+                continue
+            raise UpstreamStreamError(f"上游返回 HTTP {response.status_code}")
+
+    def _stream_block(self, video_id: str, fmt: str, target: StreamTarget, block: int, lo: int, hi: int):
+        """
+        转发一个块中 [lo, hi) 的数据, 返回(可能重新解析过的) target
+        开启磁盘缓存时请求整个块并写入缓存, 否则只请求需要的区间
+        """
+        base = block * self.block_size
+        if self.cache is None:
+            first, last = base + lo, base + hi - 1
+        else:
+            first, last = base, min(base + self.block_size, target.size) - 1
+
+        target, response = self._fetch(video_id, fmt, target, first, last)
+        writer = self.cache.writer(target.key, block) if self.cache is not None else None
+        position = first - base
+        try:
+            with response:
+                for data in response.iter_content(READ_SIZE):
+                    if writer is not None:
+                        writer.write(data)
+                    # 只返回与 [lo, hi) 重叠的部分
+                    chunk_lo, chunk_hi = max(lo - position, 0), min(hi - position, len(data))
+                    position += len(data)
+                    if chunk_lo < chunk_hi:
+                        yield data if chunk_hi - chunk_lo == len(data) else data[chunk_lo:chunk_hi]
+            if position != last - base + 1:
+                raise UpstreamStreamError(f"上游数据不完整: {position - (first - base)}/{last - first + 1}")
+        except BaseException:
+            if writer is not None:
+                self.cache.discard(writer)
+            raise
+
+        if writer is not None:
+            self.cache.commit(writer, target.key, block)
+        metrics.inc('stream_bytes_total', {'source': 'upstream'}, last - first + 1)
+        return target
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = {
+                'enabled': ENABLED,
+                'block_size': self.block_size,
+                'pool_size': self.pool_size,
+                'active': self.active,
+                'streams': self.streams,
+                'reresolved': self.reresolved,
+            }
+        stats['disk_cache'] = self.cache.stats() if self.cache is not None else None
+        return stats
+
+
+class AsyncMediaProxy:
+    """
+    Range 请求代理的异步版本(仅 ASGI 模式使用)
+
+    与同步代理共享磁盘块缓存和响应头的计算, 使用带连接池的 httpx.AsyncClient 请求上游,
+    每个播放中的客户端不占用线程
+
+    参数:
+        proxy: 同步代理
+        resolve_target: 异步的 (video_id, fmt, force) -> StreamTarget(在线程池中调用 proxy.target)
+        max_connections: 连接池大小
+    """
+
+    def __init__(self, proxy: MediaProxy, resolve_target: Callable[..., Awaitable[StreamTarget]],
+                 max_connections: int = 32):
+        import httpx
+
+        self.proxy = proxy
+        self.resolve_target = resolve_target
+        self.client = httpx.AsyncClient(
+            timeout=proxy.timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def open(self, video_id: str, fmt: str, range_header: Optional[str] = None
+                   ) -> Tuple[int, Dict[str, str], AsyncIterator[bytes]]:
+        """同 MediaProxy.open"""
+        target = await self.resolve_target(video_id, fmt, False)
+        status, headers, start, end = self.proxy.response_head(target, range_header)
+        return status, headers, self._stream(video_id, fmt, target, start, end)
+
+    async def _stream(self, video_id: str, fmt: str, target: StreamTarget, start: int, end: int
+                      ) -> AsyncIterator[bytes]:
+        proxy = self.proxy
+        with proxy._lock:
+            proxy.active += 1
+            proxy.streams += 1
+        try:
+            for block, lo, hi in split_blocks(start, end, proxy.block_size) if end >= start else ():
+                cached = proxy._cached_block(target, block)
+                if cached is not None:
+                    for data in proxy._read_cached(cached, lo, hi):
+                        yield data
+                    continue
+                holder = [target]
+                async for data in self._stream_block(video_id, fmt, holder, block, lo, hi):
+                    yield data
+                target = holder[0]
+        except Exception as e:
+            # 同 MediaProxy._stream
+            logger.warning(f"代理 {video_id}/{fmt} 中断: {e}")
+        finally:
+            with proxy._lock:
+                proxy.active -= 1
+
+    async def _stream_block(self, video_id: str, fmt: str, holder: list, block: int, lo: int, hi: int):
+        """同 MediaProxy._stream_block, 重新解析后的 target 写回 holder[0]"""
+        proxy = self.proxy
+        base = block * proxy.block_size
+        if proxy.cache is None:
+            first, last = base + lo, base + hi - 1
+        else:
+            first, last = base, min(base + proxy.block_size, holder[0].size) - 1
+
+        for attempt in range(2):
+            request = self.client.build_request('GET', holder[0].url, headers={'Range': f'bytes={first}-{last}'})
+            with metrics.upstream('googlevideo.range'):
+                response = await self.client.send(request, stream=True)
+            if response.status_code == 206:
+                break
+            await response.aclose()
+            if response.status_code in _EXPIRED_STATUSES and attempt == 0:
+                with proxy._lock:
+                    proxy.reresolved += 1
+                holder[0] = await self.resolve_target(video_id, fmt, True)
+                continue
+            raise UpstreamStreamError(f"上游返回 HTTP {response.status_code}")
+
+        writer = proxy.cache.writer(holder[0].key, block) if proxy.cache is not None else None
+        position = first - base
+        try:
+            try:
+                async for data in response.aiter_bytes(READ_SIZE):
+                    if writer is not None:
+                        writer.write(data)
+                    chunk_lo, chunk_hi = max(lo - position, 0), min(hi - position, len(data))
+                    position += len(data)
+                    if chunk_lo < chunk_hi:
+                        yield data if chunk_hi - chunk_lo == len(data) else data[chunk_lo:chunk_hi]
+            finally:
+                await response.aclose()
+            if position != last - base + 1:
+                raise UpstreamStreamError(f"上游数据不完整: {position - (first - base)}/{last - first + 1}")
+        except BaseException:
+            if writer is not None:
+                proxy.cache.discard(writer)
+            raise
+
+        if writer is not None:
+            proxy.cache.commit(writer, holder[0].key, block)
+        metrics.inc('stream_bytes_total', {'source': 'upstream'}, last - first + 1)
+
+    async def aclose(self):
+        """关闭连接池"""
+        await self.client.aclose()
+
+
+def create_block_cache() -> Optional[BlockCache]:
+    """按 STREAM_CACHE_DIR / STREAM_CACHE_MAX_BYTES 创建磁盘块缓存, 上限为 0 时不缓存"""
+    max_bytes = int(os.getenv('STREAM_CACHE_MAX_BYTES', 0))
+    if max_bytes <= 0:
+        return None
+    return BlockCache(os.getenv('STREAM_CACHE_DIR', DEFAULT_CACHE_DIR), max_bytes)
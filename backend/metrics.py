@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Prometheus 指标
+- 接口和上游请求的耗时直方图、进行中的请求数、限流等待时间、缓存命中率
+- 每个进程把自己的指标定期写入 METRICS_DIR/<pid>.json, /metrics 汇总所有 worker 的文件后输出
+- worker 退出时(gunicorn child_exit)其计数器和直方图并入 archive.json, 进程重启后累计值不会倒退
+"""
+
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import profiling
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+DEFAULT_METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'metrics')
+
+# 写入指标文件的间隔(秒)
+FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+PREFIX = 'ytsub_'
+
+# 秒级直方图的桶(上游请求可能长达数十秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# 名称 -> (类型, 说明)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', '接口耗时'),
+    'http_requests_in_flight': ('gauge', '正在处理的接口请求数'),
+    'upstream_request_duration_seconds': ('histogram', '上游调用耗时'),
+    'upstream_requests_in_flight': ('gauge', '正在进行的上游调用数'),
+    'ratelimit_wait_seconds': ('histogram', '获得上游请求许可前的等待时间'),
+    'ratelimit_rejected_total': ('counter', '因排队已满或等待过久被拒绝的上游请求数'),
+    'cache_requests_total': ('counter', '缓存查询次数(result: hit / stale / miss)'),
+    'cache_hit_ratio': ('gauge', '缓存命中率(含旧数据命中), 由所有 worker 的累计次数计算'),
+    'cache_entries': ('gauge', '缓存条目数'),
+    'cache_bytes': ('gauge', '缓存近似字节数'),
+    'singleflight_calls_total': ('counter', '上游操作次数(result: executed / coalesced)'),
+    'admission_in_flight': ('gauge', '占用准入名额(正在等待上游)的请求数'),
+    'admission_rejected_total': ('counter', '因等待上游的请求已满被拒绝(503)的请求数'),
+    'extractor_circuit_open': ('gauge', '解析服务是否处于熔断状态(含试探中)'),
+    'extractor_wins_total': ('counter', '各解析服务返回的结果数'),
+    'extractor_hedged_total': ('counter', '发出的对冲请求数'),
+    'upstream_archive_total': ('counter', '上游归档操作次数(result: recorded / replayed / miss / fallback)'),
+    'stream_bytes_total': ('counter', '播放地址代理返回的字节数(source: upstream / cache)'),
+}
+
+_ARCHIVE = 'archive.json'
+
+
+def _label_string(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ''
+    return ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in sorted(labels.items())
+    )
+
+
+def _key(name: str, labels: Optional[Dict[str, str]]) -> str:
+    return f'{name}|{_label_string(labels)}'
+
+
+class _Registry:
+    """一个进程内的指标"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        # 键 -> [各桶计数(不累计, 最后一个为 +Inf), 总和]
+        self.histograms: Dict[str, list] = {}
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, Dict, float]]]] = []
+        self._flusher_pid = None
+
+    def _ensure_flusher(self):
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def inc(self, name: str, labels: Optional[Dict] = None, value: float = 1.0):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+        self._ensure_flusher()
+
+    def add_gauge(self, name: str, labels: Optional[Dict], delta: float):
+        key = _key(name, labels)
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0.0) + delta
+        self._ensure_flusher()
+
+    def observe(self, name: str, value: float, labels: Optional[Dict] = None):
+        key = _key(name, labels)
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+            histogram[0][index] += 1
+            histogram[1] += value
+        self._ensure_flusher()
+
+    def snapshot(self) -> Dict:
+        """当前进程的指标(含 collector 采集的累计值)"""
+        with self._lock:
+            data = {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {k: [list(v[0]), v[1]] for k, v in self.histograms.items()},
+            }
+            collectors = list(self.collectors)
+
+        for collect in collectors:
+            try:
+                for kind, name, labels, value in collect():
+                    target = data['counters'] if kind == 'counter' else data['gauges']
+                    key = _key(name, labels)
+                    target[key] = target.get(key, 0.0) + value
+            except Exception as e:
+                logger.warning(f"采集指标失败: {e}")
+        return data
+
+    def flush(self):
+        """把当前进程的指标写入文件"""
+        if not ENABLED:
+            return
+        try:
+            _write_json(os.path.join(metrics_dir(), f'{os.getpid()}.json'), self.snapshot())
+        except OSError as e:
+            logger.warning(f"写入指标文件失败: {e}")
+
+
+_registry = _Registry()
+
+
+def metrics_dir() -> str:
+    return os.getenv('METRICS_DIR', DEFAULT_METRICS_DIR)
+
+
+def _write_json(path: str, data: Dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# ----------------------------------------------------------------------
+# 记录
+# ----------------------------------------------------------------------
+
+def inc(name: str, labels: Optional[Dict] = None, value: float = 1.0):
+    """计数器加 value"""
+    if ENABLED:
+        _registry.inc(name, labels, value)
+
+
+def observe(name: str, value: float, labels: Optional[Dict] = None):
+    """向直方图记录一个值"""
+    if ENABLED:
+        _registry.observe(name, value, labels)
+
+
+def add_gauge(name: str, labels: Optional[Dict], delta: float):
+    """调整进程内的 gauge"""
+    if ENABLED:
+        _registry.add_gauge(name, labels, delta)
+
+
+def register_collector(collect: Callable[[], Iterable[Tuple[str, str, Dict, float]]]):
+    """
+    注册采集函数, 写入指标文件时调用
+
+    collect() 返回 (类型 'counter' / 'gauge', 名称, 标签, 值) 序列, 计数器为进程内的累计值
+    """
+    with _registry._lock:
+        _registry.collectors.append(collect)
+
+
+def register_cache(name: str, stats: Callable[[], Dict]):
+    """注册缓存, 按其 stats() 中的 hits / stale_hits / misses / entries / bytes 输出指标"""
+    def collect():
+        data = stats()
+        for result, field in (('hit', 'hits'), ('stale', 'stale_hits'), ('miss', 'misses')):
+            if field in data:
+                yield 'counter', 'cache_requests_total', {'cache': name, 'result': result}, data[field]
+        for metric, field in (('cache_entries', 'entries'), ('cache_bytes', 'bytes')):
+            if field in data:
+                yield 'gauge', metric, {'cache': name}, data[field]
+    register_collector(collect)
+
+
+def observe_request(route: str, method: str, status: int, seconds: float):
+    """记录一次接口请求"""
+    observe('http_request_duration_seconds', seconds, {'route': route, 'method': method, 'status': str(status)})
+
+
+@contextmanager
+def upstream(name: str):
+    """记录一次上游调用的耗时(outcome: ok / error)和进行中的调用数, 同时计入请求的 Server-Timing"""
+    with profiling.phase(profiling.UPSTREAM_PHASES.get(name, 'upstream')), _upstream_metrics(name):
+        yield
+
+
+@contextmanager
+def _upstream_metrics(name: str):
+    if not ENABLED:
+        yield
+        return
+    labels = {'upstream': name}
+    add_gauge('upstream_requests_in_flight', labels, 1)
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        add_gauge('upstream_requests_in_flight', labels, -1)
+        observe('upstream_request_duration_seconds', time.perf_counter() - started,
+                {'upstream': name, 'outcome': outcome})
+
+
+# ----------------------------------------------------------------------
+# 多进程汇总
+# ----------------------------------------------------------------------
+
+def _merge(total: Dict, data: Dict, gauges: bool = True):
+    for key, value in data.get('counters', {}).items():
+        total['counters'][key] = total['counters'].get(key, 0.0) + value
+    if gauges:
+        for key, value in data.get('gauges', {}).items():
+            total['gauges'][key] = total['gauges'].get(key, 0.0) + value
+    for key, (buckets, value_sum) in data.get('histograms', {}).items():
+        current = total['histograms'].get(key)
+        if current is None or len(current[0]) != len(buckets):
+            total['histograms'][key] = [list(buckets), value_sum]
+        else:
+            current[0] = [a + b for a, b in zip(current[0], buckets)]
+            current[1] += value_sum
+
+
+def _empty() -> Dict:
+    return {'counters': {}, 'gauges': {}, 'histograms': {}}
+
+
+def collect_all() -> Dict:
+    """汇总所有存活 worker 的指标和已退出 worker 的累计值"""
+    _registry.flush()
+    directory = metrics_dir()
+    total = _empty()
+
+    archive = _read_json(os.path.join(directory, _ARCHIVE))
+    if archive:
+        _merge(total, archive, gauges=False)
+
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        names = []
+    for name in names:
+        pid, ext = os.path.splitext(name)
+        if ext != '.json' or not pid.isdigit():
+            continue
+        # 已退出但尚未并入 archive 的进程(如开发环境的上一次运行)不计入
+        if int(pid) != os.getpid() and not _pid_alive(int(pid)):
+            continue
+        data = _read_json(os.path.join(directory, name))
+        if data:
+            _merge(total, data)
+    return total
+
+
+def mark_process_dead(pid: int):
+    """
+    worker 退出后调用(gunicorn child_exit): 计数器和直方图并入 archive, 删除其指标文件
+
+    只应由 gunicorn master 调用, archive 只有一个写入者
+    """
+    directory = metrics_dir()
+    path = os.path.join(directory, f'{pid}.json')
+    data = _read_json(path)
+    if data:
+        archive = _read_json(os.path.join(directory, _ARCHIVE)) or _empty()
+        archive.setdefault('counters', {})
+        archive.setdefault('histograms', {})
+        archive['gauges'] = {}
+        _merge(archive, data, gauges=False)
+        try:
+            _write_json(os.path.join(directory, _ARCHIVE), archive)
+        except OSError as e:
+            logger.warning(f"写入指标归档失败: {e}")
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def reset_directory():
+    """清空指标目录(gunicorn master 启动时调用, 丢弃上一次运行的数据)"""
+    directory = metrics_dir()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if name.endswith('.json') or name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+# ----------------------------------------------------------------------
+# 输出
+# ----------------------------------------------------------------------
+
+def _format_value(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _split(key: str) -> Tuple[str, str]:
+    name, _, labels = key.partition('|')
+    return name, labels
+
+
+def _series(name: str, labels: str, value: float, extra: str = '') -> str:
+    joined = ','.join(part for part in (labels, extra) if part)
+    return f'{PREFIX}{name}{{{joined}}} {_format_value(value)}' if joined else f'{PREFIX}{name} {_format_value(value)}'
+
+
+def _hit_ratios(counters: Dict[str, float]) -> Dict[str, float]:
+    totals: Dict[str, List[float]] = {}
+    for key, value in counters.items():
+        name, labels = _split(key)
+        if name != 'cache_requests_total':
+            continue
+        parts = dict(part.split('=', 1) for part in labels.split(','))
+        cache = parts.get('cache', '""')
+        hits = totals.setdefault(cache, [0.0, 0.0])
+        hits[1] += value
+        if parts.get('result') != '"miss"':
+            hits[0] += value
+    return {f'cache_hit_ratio|cache={cache}': hits / requests
+            for cache, (hits, requests) in totals.items() if requests}
+
+
+def render() -> str:
+    """Prometheus 文本格式的全部指标"""
+    data = collect_all()
+    gauges = dict(data['gauges'])
+    gauges.update(_hit_ratios(data['counters']))
+
+    grouped: Dict[str, List[str]] = {}
+    for source in (data['counters'], gauges):
+        for key in sorted(source):
+            name, labels = _split(key)
+            grouped.setdefault(name, []).append(_series(name, labels, source[key]))
+
+    for key in sorted(data['histograms']):
+        name, labels = _split(key)
+        buckets, value_sum = data['histograms'][key]
+        lines = grouped.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), buckets):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(_series(f'{name}_bucket', labels, cumulative, f'le="{le}"'))
+        lines.append(_series(f'{name}_sum', labels, value_sum))
+        lines.append(_series(f'{name}_count', labels, cumulative))
+
+    output = []
+    for name in sorted(grouped):
+        kind, description = METRICS.get(name, ('untyped', name))
+        output.append(f'# HELP {PREFIX}{name} {description}')
+        output.append(f'# TYPE {PREFIX}{name} {kind}')
+        output.extend(grouped[name])
+    return '\n'.join(output) + '\n'
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+请求耗时分析
+- Server-Timing: 每个请求按阶段(cache / ratelimit_wait / upstream_list / upstream_fetch / format / serialize 等)
+  统计耗时, 通过 Server-Timing 响应头返回; 阶段可以嵌套, 父阶段只计自身耗时
+- 采样分析: 按 PROFILE_SAMPLE_RATE 抽样或带 X-Profile 请求头的请求, 由后台线程定期采集处理线程的调用栈,
+  慢请求的结果以折叠栈格式(flamegraph.pl / speedscope 可直接读取)保存到 PROFILE_DIR
+"""
+
+import contextvars
+import functools
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+# 抽样比例(0 表示只分析带 X-Profile 请求头的请求)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+# 抽样的请求耗时超过该毫秒数才保存(X-Profile 请求总是保存)
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', 1000))
+# X-Profile 请求头需要与之相同才生效, 为空时不接受请求头触发
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+# 采样间隔(秒)
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))
+DEFAULT_PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'profiles')
+
+# 上游调用名称 -> Server-Timing 阶段
+UPSTREAM_PHASES = {
+    'list_transcripts': 'upstream_list',
+    'fetch': 'upstream_fetch',
+    'translate': 'upstream_translate',
+    'yt_dlp.extract_info': 'upstream_ytdlp',
+    'snapany.extract': 'upstream_snapany',
+    'dictionary': 'upstream_dictionary',
+}
+
+_current: contextvars.ContextVar = contextvars.ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    """一个请求的阶段耗时和(可选的)调用栈采样"""
+
+    def __init__(self, route: str, profile: bool = False, force: bool = False):
+        self.route = route
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self._stack: List[list] = []
+        self._lock = threading.Lock()
+        self.finished = False
+
+        # 采样分析
+        self.profile = profile or force
+        self.force = force
+        self.threads = {threading.get_ident()} if self.profile else set()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+            if self._stack:
+                self._stack[-1][1] += seconds
+
+    def push(self):
+        frame = [time.perf_counter(), 0.0]
+        with self._lock:
+            self._stack.append(frame)
+        return frame
+
+    def pop(self, frame: list, name: str):
+        elapsed = time.perf_counter() - frame[0]
+        with self._lock:
+            for i in range(len(self._stack) - 1, -1, -1):
+                if self._stack[i] is frame:
+                    del self._stack[i]
+                    break
+        self.add(name, max(0.0, elapsed - frame[1]))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def header(self) -> str:
+        """Server-Timing 响应头"""
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda item: -item[1])
+        parts = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in phases]
+        parts.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def current() -> Optional[RequestTiming]:
+    """当前请求的耗时记录(不在请求中时为 None)"""
+    return _current.get()
+
+
+@contextmanager
+def phase(name: str):
+    """把代码块的耗时计入当前请求的 name 阶段(嵌套的子阶段不重复计入)"""
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    frame = timing.push()
+    try:
+        yield
+    finally:
+        timing.pop(frame, name)
+
+
+def timed(name: str):
+    """装饰器: 函数的耗时计入当前请求的 name 阶段"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name: str, seconds: float):
+    """记录已测得的耗时(如限流等待)"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+@contextmanager
+def attach():
+    """在其他线程中为当前请求工作(如 ASGI 的阻塞线程池), 采样时一并采集该线程"""
+    timing = _current.get()
+    if timing is None or not timing.profile:
+        yield
+        return
+    ident = threading.get_ident()
+    with timing._lock:
+        added = ident not in timing.threads
+        timing.threads.add(ident)
+    try:
+        yield
+    finally:
+        if added:
+            with timing._lock:
+                timing.threads.discard(ident)
+
+
+# ----------------------------------------------------------------------
+# 请求开始与结束
+# ----------------------------------------------------------------------
+
+def begin(route: str, profile_header: Optional[str] = None):
+    """
+    开始记录一个请求
+
+    返回:
+        (RequestTiming, contextvars token), 传给 finish; 全部关闭时返回 None
+    """
+    force = bool(PROFILE_TOKEN) and profile_header == PROFILE_TOKEN
+    sampled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+    if not (SERVER_TIMING_ENABLED or force or sampled):
+        return None
+
+    timing = RequestTiming(route, profile=sampled, force=force)
+    if timing.profile:
+        _sampler.add(timing)
+    return timing, _current.set(timing)
+
+
+def finish(handle) -> Dict[str, str]:
+    """
+    结束记录, 返回需要添加的响应头(可重复调用, 只有第一次生效)
+    """
+    if handle is None:
+        return {}
+    timing, token = handle
+    if timing.finished:
+        return {}
+    timing.finished = True
+    try:
+        _current.reset(token)
+    except ValueError:
+        # 在其他上下文中结束(如流式响应)
+        _current.set(None)
+
+    headers = {}
+    if SERVER_TIMING_ENABLED:
+        headers['Server-Timing'] = timing.header()
+    if timing.profile:
+        _sampler.remove(timing)
+        if timing.force or timing.elapsed() * 1000 >= PROFILE_SLOW_MS:
+            name = _save_profile(timing)
+            if name:
+                headers['X-Profile'] = name
+    return headers
+
+
+# ----------------------------------------------------------------------
+# 调用栈采样
+# ----------------------------------------------------------------------
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _fold(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class _Sampler:
+    """后台采样线程, 只在有请求需要分析时运行"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: List[RequestTiming] = []
+        self._wakeup = threading.Event()
+        self._thread_pid = None
+
+    def add(self, timing: RequestTiming):
+        with self._lock:
+            self._active.append(timing)
+            if self._thread_pid != os.getpid():
+                self._thread_pid = os.getpid()
+                threading.Thread(target=self._run, name='profile-sampler', daemon=True).start()
+        self._wakeup.set()
+
+    def remove(self, timing: RequestTiming):
+        with self._lock:
+            if timing in self._active:
+                self._active.remove(timing)
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    self._wakeup.clear()
+            if not active:
+                self._wakeup.wait()
+                continue
+
+            frames = sys._current_frames()
+            for timing in active:
+                with timing._lock:
+                    threads = list(timing.threads)
+                for ident in threads:
+                    frame = frames.get(ident)
+                    if frame is not None and ident != me:
+                        timing.stacks[_fold(frame)] += 1
+                timing.samples += 1
+            del frames
+            time.sleep(PROFILE_INTERVAL)
+
+
+_sampler = _Sampler()
+
+
+def profile_dir() -> str:
+    return os.getenv('PROFILE_DIR', DEFAULT_PROFILE_DIR)
+
+
+def _save_profile(timing: RequestTiming) -> Optional[str]:
+    """保存折叠栈文件, 返回文件名"""
+    if not timing.stacks:
+        return None
+    directory = profile_dir()
+    route = re.sub(r'[^A-Za-z0-9]+', '_', timing.route).strip('_') or 'root'
+    name = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{route}-{int(timing.elapsed() * 1000)}ms.folded'
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, name), 'w') as f:
+            for stack, count in timing.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        _prune(directory)
+    except OSError as e:
+        logger.warning(f"保存性能分析结果失败: {e}")
+        return None
+    logger.info(f"已保存 {timing.route} 的性能分析结果: {name} ({timing.samples} 次采样)")
+    return name
+
+
+def _prune(directory: str):
+    """只保留最新的 PROFILE_MAX_FILES 个文件"""
+    files = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith('.folded')),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in files[:max(0, len(files) - PROFILE_MAX_FILES)]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+上游请求调度器
+基于令牌桶的频率控制,令牌状态保存在共享文件中,同一台机器上的所有线程和 worker 共用一个桶
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Optional
+
+import metrics
+import profiling
+
+try:
+    import fcntl
+except ImportError:  # Windows 本地开发时退化为进程内限流
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+# 请求优先级,数值越大越先获得令牌
+PRIORITY_BACKGROUND = 0
+PRIORITY_BATCH = 5
+PRIORITY_INTERACTIVE = 10
+
+# 状态文件格式: 当前令牌数, 上次更新时间
+_STATE_FORMAT = '<dd'
+_STATE_SIZE = struct.calcsize(_STATE_FORMAT)
+
+
+class RateLimitExceeded(Exception):
+    """等待队列已满或预计等待时间过长"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    跨进程令牌桶
+
+    参数:
+        rate: 每秒补充的令牌数
+        capacity: 桶容量(允许的突发请求数)
+        state_path: 共享状态文件路径, 为 None 时仅在进程内生效
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0, state_path: Optional[str] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.state_path = state_path if fcntl is not None else None
+
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+        # 进程内状态(无共享文件时使用)
+        self._tokens = capacity
+        self._updated_at = time.time()
+
+    def _open(self) -> int:
+        if self._fd is not None and self._pid == os.getpid():
+            return self._fd
+
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._pid = os.getpid()
+        return self._fd
+
+    def _refill(self, tokens: float, updated_at: float, now: float) -> float:
+        return min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate)
+
+    def try_acquire(self) -> float:
+        """
+        尝试取出一个令牌
+
+        返回:
+            0 表示已取得令牌, 否则为下一个令牌可用前需要等待的秒数
+        """
+        with self._lock:
+            if self.state_path is None:
+                now = time.time()
+                tokens = self._refill(self._tokens, self._updated_at, now)
+                wait = self._take(tokens, now)
+                return wait
+
+            fd = self._open()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                raw = os.pread(fd, _STATE_SIZE, 0)
+                if len(raw) == _STATE_SIZE:
+                    tokens, updated_at = struct.unpack(_STATE_FORMAT, raw)
+                    tokens = self._refill(tokens, updated_at, now)
+                else:
+                    tokens = self.capacity
+
+                wait = self._take(tokens, now)
+                os.pwrite(fd, struct.pack(_STATE_FORMAT, self._tokens, now), 0)
+                return wait
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _take(self, tokens: float, now: float) -> float:
+        self._updated_at = now
+        if tokens >= 1.0:
+            self._tokens = tokens - 1.0
+            return 0.0
+        self._tokens = tokens
+        return (1.0 - tokens) / self.rate
+
+
+class UpstreamScheduler:
+    """
+    上游请求调度器
+
+    进程内的等待请求按优先级排队,只有队首请求会去竞争令牌。
+    队列已满或预计等待超过 max_wait 时立即抛出 RateLimitExceeded,
+    不让请求线程长时间阻塞在 sleep 上。max_wait 默认 3 秒, 与原来固定的请求间隔相同,
+    请求线程最多被占用这么久, 更长的等待直接返回 429 和 Retry-After。
+    """
+
+    def __init__(self, bucket: TokenBucket, max_queue: int = 8, max_wait: float = 3.0, name: str = 'upstream'):
+        self.bucket = bucket
+        self.name = name
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._sequence = itertools.count()
+        # 协程等待队列: 与线程队列分开排序, 每个条目对应一个唤醒事件
+        self._async_waiters = []
+        self._async_events = {}
+        # 各队列队首预计取得下一个令牌的时间
+        self._ready_at = 0.0
+        self._async_ready_at = 0.0
+
+        # 统计
+        self.granted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    def _estimate_wait(self, position: int, ready_at: float) -> float:
+        """
+        预计排在第 position 位(1 表示紧跟在队首之后)的请求还要等多久才成为队首:
+        队首下一个令牌的剩余等待时间, 加上中间每个请求各一个令牌间隔。
+        成为队首后再按令牌桶的实际等待时间检查
+        """
+        return max(0.0, ready_at - time.time()) + (position - 1) / self.bucket.rate
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, max_wait: Optional[float] = None) -> float:
+        """
+        获取一次上游请求的许可
+
+        参数:
+            priority: 请求优先级
+            max_wait: 最长等待时间(秒), 默认使用调度器配置
+
+        返回:
+            实际等待的秒数
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        started = time.time()
+        entry = (-priority, next(self._sequence))
+
+        with self._cond:
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                retry_after = self._estimate_wait(len(self._waiters) + 1, self._ready_at)
+                raise RateLimitExceeded("上游请求排队已满,请稍后重试", retry_after)
+
+            heapq.heappush(self._waiters, entry)
+            # 入队时数一次排在前面的请求, 之后按已放行的请求数递减估算, 被唤醒时不再重新排序
+            ahead = sum(1 for other in self._waiters if other < entry)
+            granted_before = self.granted
+        try:
+            while True:
+                with self._cond:
+                    head = self._waiters[0] == entry
+                    if not head:
+                        position = max(1, ahead - (self.granted - granted_before))
+                        wait = self._estimate_wait(position, self._ready_at)
+                        elapsed = time.time() - started
+                        if elapsed + wait <= max_wait:
+                            # 其余请求等待队首出队的通知
+                            self._cond.wait(max_wait - elapsed)
+                            continue
+
+                if head:
+                    # 令牌桶要锁共享状态文件, 不能在持有 _cond 时调用, 否则一次慢 I/O 会卡住所有等待者
+                    wait = self.bucket.try_acquire()
+                    if wait == 0:
+                        break
+                    with self._cond:
+                        self._ready_at = time.time() + wait
+                    elapsed = time.time() - started
+
+                if elapsed + wait > max_wait:
+                    with self._cond:
+                        self.rejected += 1
+                    raise RateLimitExceeded("上游请求过于频繁,请稍后重试", wait)
+
+                # 队首按令牌时间等待
+                with self._cond:
+                    self._cond.wait(wait)
+        finally:
+            # 取得令牌、令牌桶读写状态文件失败等任何情况都要出队, 否则后面的请求会一直排在它后面
+            with self._cond:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+        waited = time.time() - started
+        with self._cond:
+            self._ready_at = time.time()
+            self.granted += 1
+            self.total_wait += waited
+        metrics.observe('ratelimit_wait_seconds', waited, {'limiter': self.name})
+        profiling.record('ratelimit_wait', waited)
+        return waited
+
+    async def acquire_async(self, priority: int = PRIORITY_INTERACTIVE, max_wait: Optional[float] = None) -> float:
+        """
+        acquire 的协程版本(ASGI 模式使用)
+
+        等待期间让出事件循环,不占用线程;协程按与同步模式相同的优先级排队,
+        只有队首去竞争令牌,出队时唤醒新的队首。排队上限与同步模式相同。
+        令牌桶会锁共享状态文件, 在线程池中调用, 不阻塞事件循环。
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        started = time.time()
+        entry = (-priority, next(self._sequence))
+        event = asyncio.Event()
+
+        with self._cond:
+            if len(self._async_waiters) >= self.max_queue:
+                self.rejected += 1
+                retry_after = self._estimate_wait(len(self._async_waiters) + 1, self._async_ready_at)
+                raise RateLimitExceeded("上游请求排队已满,请稍后重试", retry_after)
+            heapq.heappush(self._async_waiters, entry)
+            self._async_events[entry] = event
+            ahead = sum(1 for other in self._async_waiters if other < entry)
+            granted_before = self.granted
+
+        granted = False
+        try:
+            while True:
+                with self._cond:
+                    event.clear()
+                    head = self._async_waiters[0] == entry
+                    position = max(1, ahead - (self.granted - granted_before))
+                    ready_at = self._async_ready_at
+
+                if head:
+                    wait = await asyncio.to_thread(self.bucket.try_acquire)
+                    if wait == 0:
+                        granted = True
+                        break
+                    with self._cond:
+                        self._async_ready_at = time.time() + wait
+                else:
+                    wait = self._estimate_wait(position, ready_at)
+
+                elapsed = time.time() - started
+                if elapsed + wait > max_wait:
+                    with self._cond:
+                        self.rejected += 1
+                    raise RateLimitExceeded("上游请求过于频繁,请稍后重试", wait)
+
+                if head:
+                    await asyncio.sleep(wait)
+                else:
+                    try:
+                        await asyncio.wait_for(event.wait(), max_wait - elapsed)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            with self._cond:
+                if granted:
+                    self._async_ready_at = time.time()
+                self._async_waiters.remove(entry)
+                heapq.heapify(self._async_waiters)
+                del self._async_events[entry]
+                if self._async_waiters:
+                    self._async_events[self._async_waiters[0]].set()
+
+        waited = time.time() - started
+        with self._cond:
+            self.granted += 1
+            self.total_wait += waited
+        metrics.observe('ratelimit_wait_seconds', waited, {'limiter': self.name})
+        profiling.record('ratelimit_wait', waited)
+        return waited
+
+    def stats(self) -> dict:
+        """调度统计信息"""
+        with self._cond:
+            return {
+                'queued': len(self._waiters) + len(self._async_waiters),
+                'granted': self.granted,
+                'rejected': self.rejected,
+                'total_wait_seconds': round(self.total_wait, 3),
+            }
+
+
+def create_snapany_scheduler(min_interval: float = 3.0) -> UpstreamScheduler:
+    """根据环境变量创建 SnapAny 的调度器"""
+    rate = float(os.getenv('SNAPANY_RATE', 1.0 / min_interval))
+    burst = float(os.getenv('SNAPANY_BURST', 1))
+    state_path = os.getenv('SNAPANY_RATE_STATE', os.path.join(DEFAULT_STATE_DIR, 'snapany_rate.state'))
+    bucket = TokenBucket(rate, capacity=burst, state_path=state_path)
+    return UpstreamScheduler(
+        bucket,
+        max_queue=int(os.getenv('SNAPANY_MAX_QUEUE', 8)),
+        max_wait=float(os.getenv('SNAPANY_MAX_WAIT', 3)),
+        name='snapany',
+    )
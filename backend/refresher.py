@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+后台刷新
+- 过期缓存先返回旧数据,同时在后台续期(stale-while-revalidate)
+- 定期提前刷新请求最多的 top-N 条目,热门视频几乎不会走冷路径
+"""
+
+import heapq
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundRefresher:
+    """
+    后台刷新器
+
+    调用方通过 touch() 登记每次读取的缓存条目(键、刷新函数、过期时间),
+    过期条目通过 schedule() 立即安排续期。后台线程每隔 interval 秒检查请求次数最多的
+    top_n 个条目, 对 horizon 秒内即将过期的条目提前刷新。
+
+    参数:
+        workers: 刷新线程数
+        top_n: 提前刷新的热门条目数
+        interval: 检查间隔(秒)
+        horizon: 提前多久刷新(秒)
+        max_tracked: 最多记录的条目数(超出四分之一后批量裁剪)
+    """
+
+    def __init__(self, workers: Optional[int] = None, top_n: Optional[int] = None,
+                 interval: Optional[float] = None, horizon: Optional[float] = None,
+                 max_tracked: int = 2000):
+        self.workers = workers if workers is not None else int(os.getenv('REFRESH_WORKERS', 2))
+        self.top_n = top_n if top_n is not None else int(os.getenv('REFRESH_TOP_N', 20))
+        self.interval = interval if interval is not None else float(os.getenv('REFRESH_INTERVAL', 60))
+        self.horizon = horizon if horizon is not None else float(os.getenv('REFRESH_HORIZON', 900))
+        self.max_tracked = max_tracked
+        self._trim_slack = max(1, max_tracked // 4)
+
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._counts: Dict[str, float] = {}
+        self._targets: Dict[str, tuple] = {}
+
+        self._executor = None
+        self._thread = None
+        self._pid = None
+
+        # 统计
+        self.refreshed = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        """fork 之后在每个 worker 中各自启动线程"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='refresh')
+            self._pending = set()
+            if self.top_n > 0:
+                self._thread = threading.Thread(target=self._run, name='refresh-ahead', daemon=True)
+                self._thread.start()
+            self._pid = os.getpid()
+
+    def touch(self, key: str, refresh: Callable[[], object], expires_at: float):
+        """
+        登记一次缓存读取
+
+        参数:
+            key: 条目键
+            refresh: 强制刷新该条目的函数
+            expires_at: 条目当前的过期时间
+        """
+        self._ensure_started()
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self._targets[key] = (refresh, expires_at)
+            # 超出上限一定比例后才批量裁剪, 不在每次读取时扫描全部条目
+            if len(self._counts) > self.max_tracked + self._trim_slack:
+                self._trim()
+
+    def _trim(self):
+        """只保留请求次数最多的 max_tracked 个条目(调用方持有锁)"""
+        hottest = heapq.nlargest(self.max_tracked, self._counts.items(), key=lambda item: item[1])
+        self._counts = dict(hottest)
+        self._targets = {key: self._targets[key] for key in self._counts}
+
+    def schedule(self, key: str, refresh: Callable[[], object]) -> bool:
+        """
+        安排一次后台刷新, 同一个键同时只会刷新一次
+
+        返回:
+            是否新安排了刷新
+        """
+        self._ensure_started()
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+
+        self._executor.submit(self._refresh, key, refresh)
+        return True
+
+    def _refresh(self, key: str, refresh: Callable[[], object]):
+        try:
+            refresh()
+            with self._lock:
+                self.refreshed += 1
+                # 新的过期时间在下次 touch() 时更新, 在此之前不再提前刷新
+                if key in self._targets:
+                    self._targets[key] = (self._targets[key][0], float('inf'))
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.warning(f"后台刷新 {key} 失败: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh_ahead()
+            except Exception as e:
+                logger.warning(f"提前刷新失败: {e}")
+
+    def refresh_ahead(self) -> int:
+        """
+        提前刷新即将过期的热门条目
+
+        返回:
+            新安排的刷新数
+        """
+        now = time.time()
+        with self._lock:
+            hottest = sorted(self._counts, key=self._counts.get, reverse=True)[:self.top_n]
+            due = [(key, self._targets[key][0]) for key in hottest if self._targets[key][1] - now < self.horizon]
+            # 请求次数按周期衰减, 让热度反映近期访问
+            for key in list(self._counts):
+                self._counts[key] /= 2
+                if self._counts[key] < 0.1:
+                    self._counts.pop(key)
+                    self._targets.pop(key, None)
+
+        return sum(1 for key, refresh in due if self.schedule(key, refresh))
+
+    def stats(self) -> Dict:
+        """刷新统计信息"""
+        with self._lock:
+            return {
+                'tracked': len(self._counts),
+                'pending': len(self._pending),
+                'refreshed': self.refreshed,
+                'failed': self.failed,
+            }
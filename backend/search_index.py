@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+字幕全文搜索
+基于 SQLite FTS5(位置倒排索引)检索所有已缓存的字幕,支持短语查询,返回命中的视频和开始时间
+
+- 每条字幕与下一条拼成一个窗口建立索引, 跨两条字幕的短语也能命中
+- 建立索引在后台线程中进行, 不占用请求时间
+"""
+
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import profiling
+from cache import BoundedCache
+from transcript_index import TranscriptIndex
+from transcript_store import parse_translation_source
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEARCH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'search.db')
+
+# 与 FTS5 unicode61 分词器一致: 字母和数字为词, 其余字符为分隔符
+_TOKEN = re.compile(r'[^\W_]+')
+
+# 窗口 rowid = 文档 id * _ROWID_STRIDE + 字幕下标, 按文档删除时只需按 rowid 区间删除
+_ROWID_STRIDE = 1 << 20
+
+# 单次搜索最多返回的结果数
+MAX_SEARCH_RESULTS = 100
+
+# 命中窗口数超过该值时不再按相关度排序(bm25 需要遍历所有命中), 改为返回最新建立索引的结果
+MAX_RANKED_MATCHES = int(os.getenv('TRANSCRIPT_SEARCH_MAX_RANKED', 5000))
+
+
+def search_tokens(text: str) -> List[str]:
+    """分词(小写, 去掉变音符号), 与索引的分词规则一致"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _TOKEN.findall(stripped)
+
+
+def _contains_phrase(tokens: List[str], phrase: List[str]) -> bool:
+    n = len(phrase)
+    return any(tokens[i:i + n] == phrase for i in range(len(tokens) - n + 1))
+
+
+class TranscriptSearch:
+    """
+    字幕全文搜索索引
+
+    - documents: 已建立索引的字幕 (video_id, language_code, is_generated, translated_from) 及其内容摘要
+    - windows:   FTS5 表, 每行是第 i 条字幕与第 i + 1 条字幕拼成的窗口
+
+    参数:
+        path: 索引文件路径
+        max_documents: 最多索引的字幕数, 超出时淘汰最早建立索引的字幕
+        max_queue: 等待建立索引的队列长度, 队列已满时丢弃
+    """
+
+    SCHEMA_VERSION = 1
+
+    # 每写入多少个文档检查一次容量
+    EVICT_EVERY = 50
+
+    def __init__(self, path: Optional[str] = None, max_documents: Optional[int] = None,
+                 max_queue: Optional[int] = None):
+        self.path = path or os.getenv('TRANSCRIPT_SEARCH_PATH', DEFAULT_SEARCH_PATH)
+        self.max_documents = max_documents if max_documents is not None else int(os.getenv('TRANSCRIPT_SEARCH_MAX_DOCUMENTS', 50000))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('TRANSCRIPT_SEARCH_MAX_QUEUE', 256))
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+
+        # 最近提交过的字幕内容摘要, 重复提交时跳过
+        self._submitted = BoundedCache(max_entries=4096, sweep_interval=0, name='search-submitted')
+
+        # 统计
+        self.indexed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    # ------------------------------------------------------------------
+    # 连接管理
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=10000')
+        self._init_schema(conn)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @classmethod
+    def _init_schema(cls, conn: sqlite3.Connection):
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != cls.SCHEMA_VERSION:
+            conn.executescript("""
+                DROP TABLE IF EXISTS documents;
+                DROP TABLE IF EXISTS windows;
+            """)
+            conn.execute(f'PRAGMA user_version={cls.SCHEMA_VERSION}')
+
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                video_id TEXT NOT NULL,
+                language_code TEXT NOT NULL,
+                is_generated INTEGER NOT NULL,
+                translated_from TEXT NOT NULL DEFAULT '',
+                digest TEXT NOT NULL,
+                indexed_at REAL NOT NULL,
+                UNIQUE (video_id, language_code, is_generated, translated_from)
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_indexed ON documents(indexed_at);
+            CREATE VIRTUAL TABLE IF NOT EXISTS windows USING fts5(
+                text,
+                head UNINDEXED,
+                start UNINDEXED,
+                duration UNINDEXED,
+                tokenize='unicode61 remove_diacritics 2'
+            );
+        """)
+
+    # ------------------------------------------------------------------
+    # 建立索引
+    # ------------------------------------------------------------------
+
+    def _ensure_started(self):
+        """fork 之后在每个 worker 中各自启动索引线程"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            threading.Thread(target=self._run, name='search-indexer', daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, key: Tuple[str, str, bool, str], index: TranscriptIndex):
+        """
+        提交一条字幕到后台建立索引(内容未变化的字幕会跳过)
+
+        参数:
+            key: 字幕存储键 (video_id, language_code, is_generated, translated_from)
+        """
+        digest = index.digest()
+        if self._submitted.get(f"{key}:{digest}") is not None:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((key, index))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+        self._submitted.set(f"{key}:{digest}", True, float('inf'))
+
+    def _run(self):
+        while True:
+            key, index = self._queue.get()
+            try:
+                self.index_transcript(key, index)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.warning(f"建立字幕索引失败 {key}: {e}")
+
+    def index_transcript(self, key: Tuple[str, str, bool, str], index: TranscriptIndex) -> bool:
+        """
+        建立(或更新)一条字幕的索引
+
+        返回:
+            是否写入了索引(内容未变化时为 False)
+        """
+        video_id, language_code, is_generated, translated_from = key
+        digest = index.digest()
+        texts = [index.text(i) for i in range(len(index))]
+        conn = self._connect()
+
+        # 多个 worker 可能同时索引同一条字幕, 查询和写入放在同一个写事务中
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT id, digest FROM documents '
+                'WHERE video_id=? AND language_code=? AND is_generated=? AND translated_from=?',
+                (video_id, language_code, int(bool(is_generated)), translated_from or '')
+            ).fetchone()
+            if row is not None and row[1] == digest:
+                conn.execute('COMMIT')
+                return False
+
+            if row is not None:
+                doc_id = row[0]
+                self._delete_windows(conn, doc_id)
+                conn.execute('UPDATE documents SET digest=?, indexed_at=? WHERE id=?', (digest, time.time(), doc_id))
+            else:
+                doc_id = conn.execute(
+                    'INSERT INTO documents (video_id, language_code, is_generated, translated_from, digest, indexed_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (video_id, language_code, int(bool(is_generated)), translated_from or '', digest, time.time())
+                ).lastrowid
+
+            conn.executemany(
+                'INSERT INTO windows (rowid, text, head, start, duration) VALUES (?, ?, ?, ?, ?)',
+                (
+                    (doc_id * _ROWID_STRIDE + i,
+                     texts[i] + ' ' + texts[i + 1] if i + 1 < len(texts) else texts[i],
+                     texts[i], index.starts[i], index.durations[i])
+                    for i in range(min(len(texts), _ROWID_STRIDE))
+                )
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        with self._lock:
+            self.indexed += 1
+            should_evict = self.indexed % self.EVICT_EVERY == 0
+        if should_evict:
+            self.evict()
+        return True
+
+    @staticmethod
+    def _delete_windows(conn: sqlite3.Connection, doc_id: int):
+        conn.execute(
+            'DELETE FROM windows WHERE rowid >= ? AND rowid < ?',
+            (doc_id * _ROWID_STRIDE, (doc_id + 1) * _ROWID_STRIDE)
+        )
+
+    def evict(self):
+        """超过 max_documents 时删除最早建立索引的字幕"""
+        try:
+            conn = self._connect()
+            count = conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+            if count <= self.max_documents:
+                return
+            rows = conn.execute(
+                'SELECT id FROM documents ORDER BY indexed_at ASC LIMIT ?', (count - self.max_documents,)
+            ).fetchall()
+            conn.execute('BEGIN IMMEDIATE')
+            for (doc_id,) in rows:
+                self._delete_windows(conn, doc_id)
+                conn.execute('DELETE FROM documents WHERE id=?', (doc_id,))
+            conn.execute('COMMIT')
+            logger.info(f"字幕搜索索引淘汰 {len(rows)} 条字幕")
+        except sqlite3.Error as e:
+            logger.warning(f"字幕搜索索引淘汰失败: {e}")
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    @profiling.timed('search')
+    def search(self, query: str, limit: int = 20, video_id: Optional[str] = None,
+               language: Optional[str] = None) -> List[Dict]:
+        """
+        短语搜索
+
+        参数:
+            query: 查询短语, 如 "take it for granted"
+            limit: 最多返回的结果数
+            video_id / language: 只搜索指定视频 / 语言
+
+        返回:
+            按相关度排序的 [{video_id, language, is_generated, translated_from, cue, start, duration, text, score}]
+        """
+        phrase = search_tokens(query)
+        if not phrase:
+            return []
+        limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+
+        match = 'text : "' + ' '.join(phrase) + '"'
+        conn = self._connect()
+        matches = conn.execute('SELECT COUNT(*) FROM windows WHERE windows MATCH ?', (match,)).fetchone()[0]
+        if matches == 0:
+            return []
+
+        sql = (
+            'SELECT w.rowid, w.head, w.start, w.duration, {score} AS score, '
+            'd.video_id, d.language_code, d.is_generated, d.translated_from '
+            'FROM windows w JOIN documents d ON d.id = w.rowid / ? '
+            'WHERE windows MATCH ?'
+        )
+        params = [_ROWID_STRIDE, match]
+        if video_id:
+            sql += ' AND d.video_id = ?'
+            params.append(video_id)
+        if language:
+            sql += ' AND d.language_code = ?'
+            params.append(language)
+        if matches <= MAX_RANKED_MATCHES:
+            sql = sql.format(score='bm25(windows)') + ' ORDER BY score'
+        else:
+            sql = sql.format(score='0.0') + ' ORDER BY w.rowid DESC'
+        # 同一处短语会同时命中相邻的两个窗口, 多取一些用于去重
+        sql += ' LIMIT ?'
+        params.append(limit * 2 + 10)
+
+        rows = conn.execute(sql, params).fetchall()
+
+        results = []
+        for rowid, head, start, duration, score, vid, language_code, is_generated, translated_from in rows:
+            # 短语完全位于下一条字幕中时, 由下一条字幕的窗口报告
+            if not _contains_phrase(search_tokens(head), phrase):
+                following = conn.execute('SELECT head FROM windows WHERE rowid = ?', (rowid + 1,)).fetchone()
+                if following is not None and _contains_phrase(search_tokens(following[0]), phrase):
+                    continue
+            results.append({
+                'video_id': vid,
+                'language': language_code,
+                'is_generated': bool(is_generated),
+                'translated_from': parse_translation_source(translated_from)[0],
+                'cue': rowid % _ROWID_STRIDE,
+                'start': start,
+                'duration': duration,
+                'text': head,
+                'score': round(-score, 4),
+            })
+            if len(results) >= limit:
+                break
+        return results
+
+    def stats(self) -> Dict:
+        """索引统计信息"""
+        try:
+            documents = self._connect().execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+        except sqlite3.Error:
+            documents = 0
+        return {
+            'path': self.path,
+            'documents': documents,
+            'max_documents': self.max_documents,
+            'queued': self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0,
+            'indexed': self.indexed,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
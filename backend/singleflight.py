@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+并发请求合并 (single-flight)
+相同 key 的并发调用只执行一次上游请求,其余调用等待并共享同一个结果
+"""
+
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict
+
+import admission
+import profiling
+
+
+class _Call:
+    """一次正在进行的上游调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    并发请求合并器
+
+    key 约定为 "操作:规范化视频ID[:其他参数]",例如 "list_transcripts:dQw4w9WgXcQ"。
+    只在当前进程内合并,跨 worker 的重复请求由持久化缓存兜底。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._executed = defaultdict(int)
+        self._coalesced = defaultdict(int)
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        执行 fn,若相同 key 的调用正在进行则等待其结果
+
+        参数:
+            key: 合并键
+            fn: 实际执行的函数
+
+        返回:
+            fn 的返回值(异常同样会传递给所有等待者)
+        """
+        operation = key.split(':', 1)[0]
+        # 当前请求开始等待上游, 名额已满时在这里被拒绝
+        admission.enter_upstream()
+
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._coalesced[operation] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._executed[operation] += 1
+                leader = True
+
+        if not leader:
+            # 等待其他请求的上游调用
+            with profiling.phase('upstream_wait'):
+                call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def in_flight(self) -> int:
+        """当前正在进行的上游调用数"""
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self) -> Dict:
+        """按操作统计实际执行次数和被合并的请求数"""
+        with self._lock:
+            operations = set(self._executed) | set(self._coalesced)
+            return {
+                'in_flight': len(self._calls),
+                'operations': {
+                    op: {
+                        'executed': self._executed[op],
+                        'coalesced': self._coalesced[op],
+                    }
+                    for op in sorted(operations)
+                },
+            }
+
+
+class _LeaderCancelled(Exception):
+    """AsyncSingleFlight 中执行调用的协程被取消, 等待者需要重新发起"""
+
+
+class AsyncSingleFlight:
+    """
+    事件循环内的并发请求合并器
+
+    与 SingleFlight 约定相同,供 ASGI 模式的异步上游客户端使用
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._executed = defaultdict(int)
+        self._coalesced = defaultdict(int)
+
+    async def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """执行协程函数 fn,若相同 key 的调用正在进行则等待其结果"""
+        operation = key.split(':', 1)[0]
+        admission.enter_upstream()
+
+        future = self._calls.get(key)
+        while future is not None:
+            self._coalesced[operation] += 1
+            try:
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                # 发起调用的请求被取消(客户端断开), 由等待者之一重新执行
+                future = self._calls.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self._executed[operation] += 1
+        try:
+            result = await fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # 不能取消 future: 等待者会一起收到 CancelledError
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有等待者时避免 "Future exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._calls.pop(key, None)
+
+    def stats(self) -> Dict:
+        """按操作统计实际执行次数和被合并的请求数"""
+        operations = set(self._executed) | set(self._coalesced)
+        return {
+            'in_flight': len(self._calls),
+            'operations': {
+                op: {
+                    'executed': self._executed[op],
+                    'coalesced': self._coalesced[op],
+                }
+                for op in sorted(operations)
+            },
+        }
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+字幕格式渲染
+每条字幕只渲染一次 SRT / VTT / 时间戳 JSON,按内容摘要缓存渲染结果,
+相同字幕的后续请求直接复用
+
+时间戳接口另有按列的二进制格式(见 encode_timestamp_columns), 直接取自字幕索引的列数据
+"""
+
+import json
+import os
+import struct
+from typing import List, Optional
+
+from youtube_transcript_api.formatters import SRTFormatter, WebVTTFormatter
+
+import profiling
+from cache import BoundedCache
+from transcript_index import TranscriptIndex
+
+
+def dumps_compact(value) -> str:
+    """紧凑 JSON(保留非 ASCII 字符)"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+# 时间戳按列二进制格式的 Content-Type
+TIMESTAMP_COLUMNS_CONTENT_TYPE = 'application/vnd.littlesprout.timestamps'
+
+# 头部: 魔数, 版本, 保留, 字幕条数, 元数据字节数(含填充)
+_COLUMNS_MAGIC = b'LSTC'
+_COLUMNS_VERSION = 1
+_COLUMNS_HEADER = struct.Struct('<4sHHII')
+
+
+def encode_timestamp_columns(head: dict, index: TranscriptIndex, lo: int, hi: int) -> bytes:
+    """
+    时间戳字幕的按列二进制编码(小端), 依次为:
+
+    - 头部 16 字节: 魔数 "LSTC", 版本(uint16), 保留(uint16), 字幕条数 n(uint32), 元数据字节数 m(uint32)
+    - 元数据 m 字节: UTF-8 JSON(与 JSON 响应中除 timestamps 以外的字段相同), 用空格填充到 8 的倍数
+    - starts: n 个 float64
+    - durations: n 个 float64
+    - offsets: n + 1 个 uint32, 第 i 条字幕文本为 text[offsets[i]:offsets[i + 1]]
+    - text: 所有字幕文本的 UTF-8 编码
+
+    各列按自身宽度对齐, 客户端可以不复制直接按数组读取(如 Float64Array / Uint32Array)
+    """
+    meta = dumps_compact(head).encode('utf-8')
+    meta += b' ' * (-len(meta) % 8)
+    starts, durations, offsets, text = index.columns(lo, hi)
+    return b''.join([
+        _COLUMNS_HEADER.pack(_COLUMNS_MAGIC, _COLUMNS_VERSION, 0, hi - lo, len(meta)),
+        meta, starts, durations, offsets, text,
+    ])
+
+
+class RenderedTranscript:
+    """
+    一条字幕的各种渲染结果
+
+    - digest:     字幕内容摘要
+    - srt:        SRT 文本
+    - vtt:        WebVTT 文本
+    - timestamps: [{text, start, duration}] 的 JSON 文本
+    """
+
+    __slots__ = ('digest', 'srt', 'vtt', 'timestamps')
+
+    def __init__(self, digest: str, srt: str, vtt: str, timestamps: str):
+        self.digest = digest
+        self.srt = srt
+        self.vtt = vtt
+        self.timestamps = timestamps
+
+    @classmethod
+    @profiling.timed('format')
+    def render(cls, index: TranscriptIndex) -> 'RenderedTranscript':
+        segments = index.to_segments()
+        return cls(
+            index.digest(),
+            SRTFormatter().format_transcript(segments),
+            WebVTTFormatter().format_transcript(segments),
+            dumps_compact(segments),
+        )
+
+    def nbytes(self) -> int:
+        """渲染结果占用的近似字节数"""
+        return len(self.srt) + len(self.vtt) + len(self.timestamps)
+
+
+class RenderCache:
+    """
+    按字幕内容摘要缓存渲染结果(LRU, 按条目数和近似字节数限制大小)
+
+    参数:
+        max_entries: 最多缓存的字幕数
+        max_bytes: 近似字节数上限
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        self._cache = BoundedCache(
+            max_entries=max_entries if max_entries is not None else int(os.getenv('RENDER_CACHE_MAX_ENTRIES', 256)),
+            max_bytes=max_bytes if max_bytes is not None else int(os.getenv('RENDER_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+            sweep_interval=0,
+            name='render-cache',
+        )
+
+    def get(self, index: TranscriptIndex) -> RenderedTranscript:
+        """读取渲染结果, 没有时渲染并缓存"""
+        digest = index.digest()
+        rendered = self._cache.get(digest)
+        if rendered is None:
+            rendered = RenderedTranscript.render(index)
+            self._cache.set(digest, rendered, float('inf'), size=rendered.nbytes())
+        return rendered
+
+    def export(self, limit: int) -> List[List[str]]:
+        """最近使用的 limit 条渲染结果, [[digest, srt, vtt, timestamps], ...](从旧到新)"""
+        entries = [value for _, value, _, _ in self._cache.items()][-limit:] if limit > 0 else []
+        return [[r.digest, r.srt, r.vtt, r.timestamps] for r in entries]
+
+    def restore(self, entries: List[List[str]]) -> int:
+        """写入 export() 导出的渲染结果, 返回写入数"""
+        return self._cache.restore(
+            (digest, RenderedTranscript(digest, srt, vtt, timestamps), float('inf'), float('inf'))
+            for digest, srt, vtt, timestamps in entries
+        )
+
+    def stats(self):
+        return self._cache.stats()
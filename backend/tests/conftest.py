@@ -0,0 +1,28 @@
+"""
+测试公共配置
+后端模块以扁平方式导入(与 gunicorn 从 backend/ 启动时一致), 所有缓存、状态文件写入临时目录
+"""
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# 必须在导入任何后端模块之前设置: 部分配置在模块导入时读取
+_STATE_DIR = tempfile.mkdtemp(prefix='ytsub-tests-')
+for name, value in {
+    'TRANSCRIPT_STORE_PATH': os.path.join(_STATE_DIR, 'transcripts.db'),
+    'TRANSCRIPT_SEARCH_PATH': os.path.join(_STATE_DIR, 'search.db'),
+    'DICTIONARY_CACHE_PATH': os.path.join(_STATE_DIR, 'dictionary.db'),
+    'METRICS_DIR': os.path.join(_STATE_DIR, 'metrics'),
+    'PROFILE_DIR': os.path.join(_STATE_DIR, 'profiles'),
+    'SNAPANY_RATE_STATE': os.path.join(_STATE_DIR, 'snapany_rate.state'),
+    'UPSTREAM_ARCHIVE_PATH': os.path.join(_STATE_DIR, 'upstream_archive.db'),
+    'STREAM_CACHE_DIR': os.path.join(_STATE_DIR, 'stream'),
+    'CACHE_SNAPSHOT_PATH': '',
+    'UPSTREAM_HTTP_MODE': 'live',
+}.items():
+    os.environ.setdefault(name, value)
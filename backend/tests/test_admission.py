@@ -0,0 +1,182 @@
+import contextvars
+import json
+import threading
+
+import pytest
+
+import admission
+from admission import AdmissionController, Overloaded, parse_route_limits
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    controller = AdmissionController(max_inflight=2)
+    monkeypatch.setattr(admission, 'controller', controller)
+    return controller
+
+
+def test_parse_route_limits():
+    assert parse_route_limits('') == {}
+    assert parse_route_limits('/api/video-url/<video_id>=1, /api/define=2') == {
+        '/api/video-url/<video_id>': 1, '/api/define': 2}
+
+
+def test_ticket_takes_one_slot_until_end(controller):
+    handle = admission.begin('/api/a')
+    # 缓存命中: 没有进入上游, 不占用名额
+    assert controller.stats()['inflight'] == 0
+
+    admission.enter_upstream()
+    admission.enter_upstream()
+    assert controller.stats()['inflight'] == 1
+    assert controller.stats()['admitted'] == 1
+
+    admission.end(handle)
+    admission.end(handle)
+    assert controller.stats()['inflight'] == 0
+    assert '/api/a' in controller.stats()['retry_after']
+
+
+def test_enter_upstream_outside_request_is_a_no_op(controller):
+    controller.configure(1)
+    controller.acquire('/busy')
+    admission.enter_upstream()
+    assert controller.stats()['inflight'] == 1
+
+
+def test_global_limit_rejects_with_retry_after(controller):
+    controller.configure(1)
+    controller.acquire('/api/a')
+
+    handle = admission.begin('/api/b')
+    with pytest.raises(Overloaded) as excinfo:
+        admission.enter_upstream()
+    assert excinfo.value.retry_after == admission.DEFAULT_RETRY_AFTER
+    admission.end(handle)
+
+    stats = controller.stats()
+    assert (stats['inflight'], stats['rejected']) == (1, 1)
+
+
+def test_route_limit(controller):
+    controller.configure(10, {'/api/a': 1})
+    controller.acquire('/api/a')
+    with pytest.raises(Overloaded):
+        controller.acquire('/api/a')
+    controller.acquire('/api/b')
+    assert controller.stats()['inflight'] == 2
+
+
+def test_leave_upstream_releases_early(controller):
+    handle = admission.begin('/api/stream')
+    admission.enter_upstream()
+    admission.leave_upstream()
+    assert controller.stats()['inflight'] == 0
+    # 之后不再占用名额
+    admission.enter_upstream()
+    assert controller.stats()['inflight'] == 0
+    admission.end(handle)
+    assert controller.stats()['inflight'] == 0
+
+
+def test_retry_after_follows_recent_durations(controller):
+    controller.acquire('/api/a')
+    controller.release('/api/a', 10.0)
+    assert controller.retry_after('/api/a') == 10.0
+    controller.acquire('/api/a')
+    controller.release('/api/a', 0.0)
+    assert controller.retry_after('/api/a') == pytest.approx(8.0)
+    controller.acquire('/api/a')
+    controller.release('/api/a', 500.0)
+    assert controller.retry_after('/api/a') == 60.0
+
+
+def test_tickets_are_per_thread(controller):
+    handle = admission.begin('/api/a')
+    admission.enter_upstream()
+
+    def other():
+        # 其他线程不继承当前请求的名额
+        admission.enter_upstream()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    thread.join()
+    assert controller.stats()['inflight'] == 1
+    admission.end(handle)
+
+
+@pytest.fixture
+def busy_app(controller, monkeypatch):
+    """名额已被占满的应用, 需要访问上游的请求都会被拒绝"""
+    import app
+
+    def request(*args, **kwargs):
+        raise AssertionError('上游不应被调用')
+
+    monkeypatch.setattr(app.transcript_resolver.http, 'request', request)
+    controller.configure(1)
+    controller.acquire('/somewhere-else')
+    return app
+
+
+def test_endpoint_returns_503_with_retry_after(busy_app):
+    # 在 SingleFlight 访问上游前被准入控制拒绝
+    response = busy_app.app.test_client().get('/api/languages/admission01')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(int(admission.DEFAULT_RETRY_AFTER))
+    body = response.get_json()
+    assert body['success'] is False
+    assert body['retry_after'] == int(admission.DEFAULT_RETRY_AFTER)
+    assert body['video_id'] == 'admission01'
+
+
+def test_batch_items_are_admission_controlled(busy_app):
+    busy_app.transcript_store.put_catalog('admission02', [
+        {'code': 'en', 'name': 'English', 'is_generated': False, 'is_translatable': True}])
+
+    response = busy_app.app.test_client().post('/api/batch', json={
+        'video_ids': ['admission02', 'admission03'], 'ops': ['languages']})
+    lines = {line['video_id']: line for line in map(json.loads, response.get_data(as_text=True).splitlines())}
+
+    # 缓存命中不占用名额
+    assert lines['admission02']['status'] == 200
+    # 需要访问上游的项被拒绝
+    assert lines['admission03']['status'] == 503
+    assert lines['admission03']['result']['retry_after'] == int(admission.DEFAULT_RETRY_AFTER)
+    assert busy_app.admission.controller.stats()['inflight'] == 1
+
+
+def test_bilingual_secondary_track_is_admission_controlled(busy_app):
+    from transcript_index import TranscriptIndex
+
+    busy_app.transcript_store.put_catalog('admission04', [
+        {'code': 'en', 'name': 'English', 'is_generated': False, 'is_translatable': True},
+        {'code': 'zh-Hans', 'name': 'Chinese', 'is_generated': False, 'is_translatable': False}])
+    busy_app.transcript_store.put_transcript(
+        'admission04', 'en', False, TranscriptIndex.from_segments([{'text': 'hi', 'start': 0.0, 'duration': 1.0}]))
+
+    # 主语言命中缓存, 次语言在线程池中访问上游, 同样沿用请求的名额而被拒绝
+    response = busy_app.app.test_client().get('/api/bilingual/admission04?primary=en&secondary=zh-Hans')
+    assert response.status_code == 503
+    assert response.get_json()['video_id'] == 'admission04'
+    assert busy_app.admission.controller.stats()['inflight'] == 1
+
+
+def test_ticket_shared_across_threads_takes_one_slot(controller):
+    handle = admission.begin('/api/a')
+    start = threading.Barrier(8)
+
+    def enter():
+        start.wait()
+        admission.enter_upstream()
+
+    # 每个线程一份上下文副本, 持有同一张票
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(enter,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert controller.stats()['inflight'] == 1
+    admission.end(handle)
+    assert controller.stats()['inflight'] == 0
@@ -0,0 +1,71 @@
+import pytest
+from starlette.testclient import TestClient
+
+import admission
+import app
+import asgi
+from admission import AdmissionController
+from rate_limiter import RateLimitExceeded
+
+CATALOG = [{'code': 'en', 'name': 'English', 'is_generated': False, 'is_translatable': True}]
+
+
+@pytest.fixture(scope='module')
+def client():
+    # 进入上下文时执行 lifespan, 创建异步 SnapAny 客户端和播放代理;
+    # 退出时关闭阻塞线程池, 与生产环境一样每个进程只运行一次
+    with TestClient(asgi.app) as client:
+        yield client
+
+
+def test_native_route_serves_cached_languages(client):
+    app.transcript_store.put_catalog('asgi00001', CATALOG)
+
+    response = client.get('/api/languages/asgi00001', headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.json()['video_id'] == 'asgi00001'
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+    assert 'Server-Timing' in response.headers
+
+    # 与 Flask 模式相同的条件请求
+    etag = response.headers['ETag']
+    assert client.get('/api/languages/asgi00001', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_unmatched_paths_are_bridged_to_flask(client):
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert response.json()['status'] == 'ok'
+
+    # 原生路由不支持的方法同样交给 Flask 处理
+    assert client.delete('/api/search').status_code == 405
+
+
+def test_rate_limit_maps_to_429(client, monkeypatch):
+    async def extract_video_info(url):
+        raise RateLimitExceeded('上游请求过于频繁,请稍后重试', 2.2)
+
+    monkeypatch.setattr(asgi.async_iiilab_service, 'extract_video_info', extract_video_info)
+    response = client.get('/api/youtube-info/asgi00002')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '3'
+    assert response.json() == {'success': False, 'error': '上游请求过于频繁,请稍后重试', 'retry_after': 3,
+                               'video_id': 'asgi00002'}
+
+
+def test_overload_maps_to_503(client, monkeypatch):
+    controller = AdmissionController(max_inflight=1)
+    monkeypatch.setattr(admission, 'controller', controller)
+
+    def request(*args, **kwargs):
+        raise AssertionError('上游不应被调用')
+
+    monkeypatch.setattr(app.transcript_resolver.http, 'request', request)
+    controller.acquire('/somewhere-else')
+
+    # 准入名额随请求上下文进入线程池, 在访问上游前被拒绝
+    response = client.get('/api/languages/asgi00003')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(int(admission.DEFAULT_RETRY_AFTER))
+    assert response.json()['video_id'] == 'asgi00003'
+    assert controller.stats()['inflight'] == 1
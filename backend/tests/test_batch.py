@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+
+import pytest
+
+import admission
+import app
+from admission import AdmissionController
+from media_cache import MediaURLCache
+from rate_limiter import RateLimitExceeded, UpstreamScheduler
+from singleflight import SingleFlight
+
+CATALOG = [{'code': 'en', 'name': 'English', 'is_generated': False, 'is_translatable': True}]
+
+
+def _post(payload):
+    response = app.app.test_client().post('/api/batch', json=payload)
+    return response, [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """上游不可用, 只有已缓存的数据能返回"""
+    monkeypatch.setattr(admission, 'controller', AdmissionController(max_inflight=16))
+
+    def request(*args, **kwargs):
+        raise ConnectionError('上游不可用')
+
+    monkeypatch.setattr(app.transcript_resolver.http, 'request', request)
+
+
+def test_ndjson_framing(offline):
+    for video_id in ('batch00001', 'batch00002', 'batch00003'):
+        app.transcript_store.put_catalog(video_id, CATALOG)
+
+    response, lines = _post({'video_ids': ['batch00001', 'batch00002', 'batch00003'], 'ops': ['languages']})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['X-Accel-Buffering'] == 'no'
+    # 每项一行, 按完成顺序输出, 通过 index 对应请求
+    assert sorted(line['index'] for line in lines) == [0, 1, 2]
+    assert all(line['status'] == 200 and line['op'] == 'languages' for line in lines)
+    assert {line['video_id'] for line in lines} == {line['result']['video_id'] for line in lines}
+
+
+def test_item_failure_does_not_affect_other_items(offline):
+    app.transcript_store.put_catalog('batch00004', CATALOG)
+
+    response, lines = _post({'items': [
+        {'video_id': 'batch00004', 'op': 'languages'},
+        {'video_id': 'batch00005', 'op': 'languages'},
+    ]})
+    assert response.status_code == 200
+    lines = {line['index']: line for line in lines}
+    assert lines[0]['status'] == 200
+    assert lines[1]['status'] == 400
+    assert lines[1]['result']['success'] is False
+    assert lines[1]['result']['video_id'] == 'batch00005'
+
+
+@pytest.mark.parametrize('payload, error', [
+    ({}, '请求中没有需要处理的视频'),
+    ({'items': []}, '请求中没有需要处理的视频'),
+    ({'items': [{'op': 'languages'}]}, '每一项都必须包含 video_id'),
+    ({'items': [{'video_id': 'batch00006', 'op': 'delete'}]}, '不支持的操作: delete'),
+    ({'video_ids': [f'v{i}' for i in range(app.BATCH_MAX_ITEMS + 1)]}, f'单次最多处理 {app.BATCH_MAX_ITEMS} 项'),
+    # 展开后的项数同样受限
+    ({'video_ids': [f'v{i}' for i in range(app.BATCH_MAX_ITEMS // 2 + 1)], 'ops': ['languages', 'subtitles']},
+     f'单次最多处理 {app.BATCH_MAX_ITEMS} 项'),
+])
+def test_invalid_requests_are_rejected_as_a_whole(payload, error):
+    response = app.app.test_client().post('/api/batch', json=payload)
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'error': error}
+
+
+class PacedBucket:
+    """按默认配置声明每 3 秒一个令牌, 实际每 20 毫秒发放一个, 测试不必真的等待"""
+
+    rate = 1 / 3
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last = 0.0
+
+    def try_acquire(self) -> float:
+        with self.lock:
+            wait = self.last + 0.02 - time.time()
+            if wait > 0:
+                return wait
+            self.last = time.time()
+            return 0.0
+
+
+class SnapAnyResponse:
+    status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'text': 'title', 'medias': []}
+
+
+@pytest.fixture
+def snapany(offline, monkeypatch):
+    """使用默认排队配置(max_wait=3, max_queue=8)的 SnapAny 服务, 上游立即返回"""
+    service = app.iiilab_service
+    monkeypatch.setattr(service, 'scheduler', UpstreamScheduler(PacedBucket(), name='snapany-test'))
+    monkeypatch.setattr(service, 'cache', MediaURLCache())
+    monkeypatch.setattr(service, 'flight', SingleFlight())
+    monkeypatch.setattr(service, 'refresher', None)
+    monkeypatch.setattr(service.session, 'post', lambda *args, **kwargs: SnapAnyResponse())
+    return service
+
+
+def test_youtube_info_items_queue_for_the_rate_limiter(snapany):
+    video_ids = [f'batch{i:06d}' for i in range(app.BATCH_WORKERS * 2)]
+    response, lines = _post({'video_ids': video_ids, 'ops': ['youtube-info']})
+
+    # 批量任务按 BATCH_MAX_WAIT 排队等待令牌, 而不是按单个请求的 3 秒上限直接返回 429
+    assert [line['status'] for line in lines] == [200] * len(video_ids)
+    assert snapany.scheduler.stats()['granted'] == len(video_ids)
+    assert snapany.scheduler.stats()['rejected'] == 0
+
+
+def test_interactive_callers_still_fail_fast(snapany):
+    # 对照: 同样的并发量按交互请求的默认上限会被拒绝
+    results = []
+
+    def acquire():
+        try:
+            results.append(snapany.scheduler.acquire())
+        except RateLimitExceeded:
+            results.append('rejected')
+
+    threads = [threading.Thread(target=acquire) for _ in range(app.BATCH_WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert 'rejected' in results
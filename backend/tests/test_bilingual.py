@@ -0,0 +1,81 @@
+import bilingual
+from bilingual import AlignCache, align
+from transcript_index import TranscriptIndex
+
+
+def _index(*cues):
+    return TranscriptIndex.from_segments([
+        {'text': text, 'start': start, 'duration': duration} for start, duration, text in cues
+    ])
+
+
+def _secondary(cues):
+    return [cue['secondary'] for cue in cues]
+
+
+PRIMARY = _index((0, 2, 'a'), (2, 2, 'b'), (6, 2, 'c'))
+
+
+def test_one_to_one_alignment():
+    cues = align(PRIMARY, _index((0.1, 1.8, 'A'), (2.1, 1.8, 'B'), (6, 2, 'C')))
+    assert cues == [
+        {'start': 0.0, 'duration': 2.0, 'text': 'a', 'secondary': 'A'},
+        {'start': 2.0, 'duration': 2.0, 'text': 'b', 'secondary': 'B'},
+        {'start': 6.0, 'duration': 2.0, 'text': 'c', 'secondary': 'C'},
+    ]
+
+
+def test_secondary_cue_goes_to_largest_overlap():
+    # 1.5-3.5 与 a 重叠 0.5 秒, 与 b 重叠 1.5 秒
+    assert _secondary(align(PRIMARY, _index((1.5, 2, 'X')))) == ['', 'X', '']
+    # 0.5-2.5 与 a 重叠更多
+    assert _secondary(align(PRIMARY, _index((0.5, 2, 'X')))) == ['X', '', '']
+
+
+def test_many_secondary_cues_join_one_primary_cue():
+    cues = align(PRIMARY, _index((0, 0.5, 'A1'), (0.6, 0.5, 'A2'), (1.2, 0.7, 'A3'), (2, 2, 'B')))
+    assert _secondary(cues) == ['A1 A2 A3', 'B', '']
+    assert _secondary(align(PRIMARY, _index((0, 1, 'A1'), (1, 1, 'A2')), separator='\n')) == ['A1\nA2', '', '']
+
+
+def test_one_secondary_cue_spanning_several_primary_cues_is_not_duplicated():
+    assert _secondary(align(PRIMARY, _index((0, 8, 'ALL')))) == ['ALL', '', '']
+
+
+def test_cues_in_gaps_go_to_nearest_start():
+    # b 在 4 秒结束, c 在 6 秒开始: 4.2 离 b 的开始(2)更远, 离 c 的开始(6)更近
+    assert _secondary(align(PRIMARY, _index((4.2, 0.5, 'G')))) == ['', '', 'G']
+    assert _secondary(align(PRIMARY, _index((4.0, 0.1, 'G')))) == ['', '', 'G']
+    # 所有主语言字幕之后、之前
+    assert _secondary(align(PRIMARY, _index((20, 1, 'END')))) == ['', '', 'END']
+    assert _secondary(align(_index((5, 1, 'x'), (7, 1, 'y')), _index((0, 1, 'EARLY')))) == ['EARLY', '']
+
+
+def test_empty_tracks():
+    empty = TranscriptIndex.from_segments([])
+    assert _secondary(align(PRIMARY, empty)) == ['', '', '']
+    assert align(empty, PRIMARY) == []
+    assert align(empty, empty) == []
+
+
+def test_align_cache_reuses_result(monkeypatch):
+    calls = []
+    real_align = bilingual.align
+
+    def counting_align(primary, secondary):
+        calls.append(1)
+        return real_align(primary, secondary)
+
+    monkeypatch.setattr(bilingual, 'align', counting_align)
+    cache = AlignCache(max_entries=4, max_bytes=1024 * 1024)
+    secondary = _index((0, 2, 'A'))
+
+    first = cache.get(PRIMARY, secondary)
+    # 内容相同的另一份索引命中同一条缓存
+    again = cache.get(TranscriptIndex.from_bytes(PRIMARY.to_bytes()), _index((0, 2, 'A')))
+    assert again is first
+    assert len(calls) == 1
+
+    assert _secondary(cache.get(PRIMARY, _index((0, 2, 'Z')))) == ['Z', '', '']
+    assert len(calls) == 2
+    assert cache.stats()['hits'] == 1
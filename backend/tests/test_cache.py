@@ -0,0 +1,134 @@
+import threading
+import time
+
+from cache import BoundedCache, approximate_size
+
+
+def _cache(**kwargs):
+    options = {'max_entries': 3, 'max_bytes': 1024 * 1024, 'sweep_interval': 0}
+    options.update(kwargs)
+    return BoundedCache(**options)
+
+
+def test_evicts_least_recently_used_entry():
+    cache = _cache()
+    future = time.time() + 60
+    for key in ('a', 'b', 'c'):
+        cache.set(key, key, future)
+
+    # 读取 a 之后, b 成为最久未使用的条目
+    assert cache.get('a') == 'a'
+    cache.set('d', 'd', future)
+    assert [key for key, _, _, _ in cache.items()] == ['c', 'a', 'd']
+    assert cache.get('b') is None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_overwriting_moves_entry_to_newest():
+    cache = _cache()
+    future = time.time() + 60
+    for key in ('a', 'b', 'c'):
+        cache.set(key, key, future)
+    cache.set('a', 'A', future)
+    cache.set('d', 'd', future)
+    assert cache.get('a') == 'A'
+    assert cache.get('b') is None
+    assert len(cache) == 3
+
+
+def test_byte_limit_evicts_and_skips_oversized_values():
+    cache = _cache(max_entries=100, max_bytes=10)
+    future = time.time() + 60
+    cache.set('a', 'x', future, size=4)
+    cache.set('b', 'x', future, size=4)
+    cache.set('c', 'x', future, size=4)
+    assert [key for key, _, _, _ in cache.items()] == ['b', 'c']
+    assert cache.stats()['bytes'] == 8
+
+    # 超过上限的值不缓存, 也不会挤掉其他条目
+    cache.set('huge', 'x', future, size=11)
+    assert cache.get('huge') is None
+    assert len(cache) == 2
+
+
+def test_expired_entry_is_a_miss():
+    cache = _cache()
+    cache.set('k', 'v', time.time() + 0.05)
+    assert cache.get('k') == 'v'
+    time.sleep(0.06)
+    assert cache.get('k') is None
+    assert cache.get_entry('k') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expirations']) == (1, 2, 1)
+    assert len(cache) == 0
+
+
+def test_stale_window():
+    cache = _cache()
+    now = time.time()
+    cache.set('k', 'v', now - 1, stale_until=now + 60)
+
+    # get 不返回过期数据, get_entry 在 stale_until 之前返回并标记为 stale
+    assert cache.get('k') is None
+    entry = cache.get_entry('k')
+    assert entry['value'] == 'v'
+    assert entry['stale'] is True
+    assert 'k' not in cache
+    assert cache.stats()['stale_hits'] >= 1
+
+    cache.set('gone', 'v', now - 2, stale_until=now - 1)
+    assert cache.get_entry('gone') is None
+
+
+def test_sweep_removes_only_fully_expired_entries():
+    cache = _cache(max_entries=10)
+    now = time.time()
+    cache.set('fresh', 1, now + 60)
+    cache.set('stale', 2, now - 1, stale_until=now + 60)
+    cache.set('dead', 3, now - 2, stale_until=now - 1)
+    assert cache.sweep() == 1
+    assert sorted(key for key, _, _, _ in cache.items()) == ['fresh', 'stale']
+
+
+def test_pop_and_restore():
+    cache = _cache()
+    now = time.time()
+    cache.set('a', [1, 2], now + 60)
+    assert cache.pop('a') == [1, 2]
+    assert cache.pop('a') is None
+    assert cache.stats()['bytes'] == 0
+
+    restored = cache.restore([
+        ('x', 'x', now + 60, now + 60),
+        ('old', 'old', now - 10, now - 1),
+        ('y', 'y', now - 10, now + 60),
+    ])
+    assert restored == 2
+    assert cache.get('x') == 'x'
+    assert cache.get_entry('y')['stale'] is True
+
+
+def test_approximate_size():
+    assert approximate_size(b'abc') == 3
+    assert approximate_size('字') == 3
+    assert approximate_size({'a': 1}) == len('{"a": 1}')
+
+
+def test_concurrent_writers_keep_limits():
+    cache = _cache(max_entries=50, max_bytes=400)
+    future = time.time() + 60
+
+    def writer(prefix):
+        for i in range(500):
+            cache.set(f'{prefix}{i}', i, future, size=5)
+            cache.get(f'{prefix}{i // 2}')
+
+    threads = [threading.Thread(target=writer, args=(name,)) for name in 'abcd']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.stats()
+    assert stats['entries'] <= 50
+    assert stats['bytes'] == 5 * stats['entries'] <= 400
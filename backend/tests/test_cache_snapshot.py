@@ -0,0 +1,141 @@
+import gzip
+import threading
+import time
+
+import pytest
+
+from cache_snapshot import CacheSnapshot
+from media_cache import MediaURLCache
+from subtitle_formats import RenderCache
+from transcript_index import TranscriptIndex
+from transcript_store import TranscriptStore
+
+CATALOG = [{'code': 'en', 'name': 'English', 'is_generated': False, 'is_translatable': True}]
+
+
+def _url(seconds):
+    return f'https://rr1---sn-abc.googlevideo.com/videoplayback?itag=18&expire={int(time.time() + seconds)}'
+
+
+class Worker:
+    """一个进程的缓存(播放地址、字幕库、渲染结果)及其快照"""
+
+    def __init__(self, tmp_path, name, **kwargs):
+        self.media = MediaURLCache()
+        self.store = TranscriptStore(path=str(tmp_path / f'{name}.db'))
+        self.rendered = RenderCache()
+        self.warmed = []
+        options = {'path': str(tmp_path / 'snapshot.json.gz'), 'interval': 0}
+        options.update(kwargs)
+        self.snapshot = CacheSnapshot(self.media, self.store, self.rendered, warm=self.warmed.append, **options)
+
+    def add_video(self, video_id, text):
+        index = TranscriptIndex.from_segments([{'text': text, 'start': 0.0, 'duration': 1.5}])
+        self.store.put_transcript(video_id, 'en', False, index, language_name='English')
+        self.store.put_catalog(video_id, CATALOG)
+        self.media.set(f'video_{video_id}', {'video_url': _url(3 * 3600), 'title': text})
+        return self.rendered.get(index)
+
+
+def test_round_trip_into_fresh_stores(tmp_path):
+    source = Worker(tmp_path, 'source')
+    rendered = source.add_video('snap0000001', 'hello world')
+    assert source.snapshot.save() is True
+
+    target = Worker(tmp_path, 'target', warmup_top_n=5)
+    assert target.snapshot.restore() == {'media': 1, 'rendered': 1, 'transcripts': 1}
+
+    # 保留原有的过期时间
+    (key, value, expires_at, stale_until), = target.media.items()
+    (_, _, source_expires_at, source_stale_until), = source.media.items()
+    assert (key, value['title']) == ('video_snap0000001', 'hello world')
+    assert (expires_at, stale_until) == (source_expires_at, source_stale_until)
+
+    entry = target.store.get_transcript('snap0000001', 'en', False)
+    assert entry['index'].text(0) == 'hello world'
+    assert target.store.get_catalog('snap0000001')['languages'] == CATALOG
+    assert target.rendered.export(10) == [[rendered.digest, rendered.srt, rendered.vtt, rendered.timestamps]]
+    assert target.snapshot.warmup_targets() == ['snap0000001']
+
+
+def test_save_merges_with_snapshot_from_other_workers(tmp_path):
+    first = Worker(tmp_path, 'first')
+    first.add_video('snap0000002', 'from first')
+    first.media.set('shared', {'video_url': _url(3 * 3600), 'title': 'old'})
+    assert first.snapshot.save()
+
+    second = Worker(tmp_path, 'second')
+    second.add_video('snap0000003', 'from second')
+    second.media.set('shared', {'video_url': _url(3 * 3600), 'title': 'new'})
+    assert second.snapshot.save()
+
+    target = Worker(tmp_path, 'target')
+    restored = target.snapshot.restore()
+    assert restored['media'] == 3
+    titles = {key: value['title'] for key, value, _, _ in target.media.items()}
+    # 同一个键以后保存的进程为准
+    assert titles == {'video_snap0000002': 'from first', 'video_snap0000003': 'from second', 'shared': 'new'}
+    assert restored['rendered'] == 2
+    # 字幕只来自保存时所在进程的字幕库
+    assert restored['transcripts'] == 1
+    assert target.store.get_transcript('snap0000003', 'en', False) is not None
+
+
+def test_restore_does_not_overwrite_existing_entries(tmp_path):
+    source = Worker(tmp_path, 'source')
+    source.add_video('snap0000004', 'from snapshot')
+    source.snapshot.save()
+
+    target = Worker(tmp_path, 'target')
+    target.media.set('video_snap0000004', {'video_url': _url(3 * 3600), 'title': 'already cached'})
+    assert target.snapshot.restore()['media'] == 0
+    assert target.media.get('video_snap0000004')['title'] == 'already cached'
+
+
+@pytest.mark.parametrize('content', [
+    None,
+    b'not gzip at all',
+    gzip.compress(b'{"version": 2, "media": ['),
+    gzip.compress(b'{"version": 1, "media": []}'),
+])
+def test_missing_or_unreadable_snapshot_is_ignored(tmp_path, content):
+    worker = Worker(tmp_path, 'worker')
+    if content is not None:
+        (tmp_path / 'snapshot.json.gz').write_bytes(content)
+    assert worker.snapshot.restore() == {}
+    assert worker.snapshot.warmup_targets() == []
+
+    # 之后的保存直接覆盖损坏的文件
+    worker.add_video('snap0000005', 'fresh')
+    assert worker.snapshot.save()
+    assert Worker(tmp_path, 'target').snapshot.restore()['transcripts'] == 1
+
+
+def test_disabled_snapshot_does_nothing(tmp_path):
+    worker = Worker(tmp_path, 'worker', path='')
+    assert worker.snapshot.save() is False
+    assert worker.snapshot.restore() == {}
+
+
+def test_only_one_worker_warms_up_per_boot(tmp_path):
+    workers = [Worker(tmp_path, f'worker{i}', warmup_ids=['snap0000006']) for i in range(4)]
+    # 同一次启动(preload 后 fork)的 worker 共享启动标识
+    for worker in workers:
+        worker.snapshot._boot_id = 'boot-1'
+
+    threads = [threading.Thread(target=w.snapshot._warm_up, args=(w.snapshot.warmup_targets(),)) for w in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert sum(len(worker.warmed) for worker in workers) == 1
+
+    # 已经预热过的启动不再预热
+    workers[0].snapshot._warm_up(['snap0000006'])
+    assert sum(len(worker.warmed) for worker in workers) == 1
+
+    # 重启后重新预热
+    restarted = Worker(tmp_path, 'restarted', warmup_ids=['snap0000006'])
+    restarted.snapshot._boot_id = 'boot-2'
+    restarted.snapshot._warm_up(restarted.snapshot.warmup_targets())
+    assert restarted.warmed == ['snap0000006']
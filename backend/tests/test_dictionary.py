@@ -0,0 +1,165 @@
+import json
+import re
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from dictionary import DictionaryService
+
+
+class StubProvider:
+    """本地 OpenAI 兼容接口: 按提示词中的单词列表返回释义, 记录每次请求的单词"""
+
+    def __init__(self):
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.received = threading.Event()
+        # 不为 None 时原样作为回复的 message
+        self.message = None
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                prompt = body['messages'][0]['content']
+                words = re.findall(r'^- (.+)$', prompt, re.MULTILINE)
+                provider.calls.append(words)
+                provider.received.set()
+                provider.gate.wait(10)
+                content = json.dumps({'words': [
+                    {'word': word, 'phonetic': '', 'definitions': [], 'examples': [],
+                     'chineseTranslation': f'{word}-zh'}
+                    for word in words
+                ]})
+                message = provider.message or {'content': f'```json\n{content}\n```'}
+                data = json.dumps({'choices': [{'message': message}]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}/v1'
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def provider():
+    provider = StubProvider()
+    yield provider
+    provider.close()
+
+
+@pytest.fixture
+def service(provider, tmp_path):
+    return DictionaryService(base_url=provider.base_url, api_key='test', path=str(tmp_path / 'definitions.db'),
+                             timeout=5)
+
+
+def test_words_are_normalized_and_deduplicated(service, provider):
+    result = service.define(['Actually', 'actually,', ' granted! ', '...'])
+    assert sorted(result['definitions']) == ['actually', 'granted']
+    assert result['errors'] == {}
+    assert provider.calls == [['actually', 'granted']]
+
+
+def test_all_misses_go_out_in_one_upstream_call(service, provider):
+    words = [f'word{i}' for i in range(45)]
+    result = service.define(words)
+    assert len(result['definitions']) == 45
+    assert provider.calls == [words]
+    assert service.stats()['upstream_calls'] == 1
+
+
+def test_cached_words_are_not_requested_again(service, provider, tmp_path):
+    service.define(['apple', 'pear'])
+    result = service.define(['pear', 'plum'])
+    assert sorted(result['definitions']) == ['pear', 'plum']
+    assert provider.calls == [['apple', 'pear'], ['plum']]
+
+    # 持久化缓存由其他 worker(新实例)共享
+    other = DictionaryService(base_url=provider.base_url, api_key='test', path=str(tmp_path / 'definitions.db'))
+    assert other.define(['apple'])['definitions']['apple']['chineseTranslation'] == 'apple-zh'
+    assert len(provider.calls) == 2
+
+
+def test_concurrent_request_waits_for_the_word_already_in_flight(service, provider):
+    provider.gate.clear()
+    results = {}
+    first = threading.Thread(target=lambda: results.setdefault('first', service.define(['apple'])))
+    first.start()
+    assert provider.received.wait(5)
+
+    second = threading.Thread(target=lambda: results.setdefault('second', service.define(['apple', 'pear'])))
+    second.start()
+    deadline = time.time() + 5
+    while len(provider.calls) < 2 and time.time() < deadline:
+        time.sleep(0.005)
+    provider.gate.set()
+    first.join(5)
+    second.join(5)
+
+    assert sorted(sorted(call) for call in provider.calls) == [['apple'], ['pear']]
+    assert sorted(results['second']['definitions']) == ['apple', 'pear']
+    assert results['second']['errors'] == {}
+
+
+def test_waiter_timeout_fails_only_that_word(service, provider):
+    service.timeout = 0.05
+    stuck = Future()
+    service._pending['apple'] = stuck  # 另一个请求正在查询且迟迟不返回
+
+    result = service.define(['apple', 'pear'])
+    assert sorted(result['definitions']) == ['pear']
+    assert list(result['errors']) == ['apple']
+    assert provider.calls == [['pear']]
+
+
+def test_upstream_failure_is_reported_per_word(service, provider):
+    service.base_url = 'http://127.0.0.1:9/v1'
+    service.timeout = 1
+    result = service.define(['apple', 'pear'])
+    assert result['definitions'] == {}
+    assert sorted(result['errors']) == ['apple', 'pear']
+
+
+def test_null_content_is_reported_per_word(service, provider):
+    # OpenAI 兼容接口拒答或返回工具调用时 content 为 null
+    provider.message = {'role': 'assistant', 'content': None, 'refusal': 'no'}
+    result = service.define(['apple', 'pear'])
+    assert result['definitions'] == {}
+    assert sorted(result['errors']) == ['apple', 'pear']
+    assert service.stats()['upstream_failures'] == 1
+
+
+def test_define_endpoint(provider, monkeypatch):
+    import app
+    monkeypatch.setattr(app.dictionary_service, 'base_url', provider.base_url)
+    monkeypatch.setattr(app.dictionary_service, 'api_key', 'test')
+    client = app.app.test_client()
+
+    response = client.post('/api/define', json={'words': ['Endpoint', 'endpoint.', 'stub']})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['success'] is True
+    assert sorted(body['definitions']) == ['endpoint', 'stub']
+    assert provider.calls == [['endpoint', 'stub']]
+
+    response = client.get('/api/define?words=stub,endpoint')
+    assert response.get_json()['count'] == 2
+    assert len(provider.calls) == 1
+
+    assert client.post('/api/define', json={'words': []}).status_code == 400
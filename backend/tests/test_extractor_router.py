@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+from extractor_router import ExtractorBackend, ExtractorRouter, ExtractorsUnavailable
+from rate_limiter import RateLimitExceeded
+
+
+def _ok(name):
+    return lambda video_id: {'source': name, 'video_id': video_id}
+
+
+def _fail(video_id):
+    raise Exception('upstream error')
+
+
+def test_consecutive_failures_open_the_breaker():
+    backend = ExtractorBackend('a', _fail, consecutive_failures=3, cooldown=30)
+    for _ in range(2):
+        backend.record(0.1, False)
+    assert backend.state == ExtractorBackend.CLOSED
+    backend.record(0.1, False)
+    assert backend.state == ExtractorBackend.OPEN
+    assert not backend.available()
+    assert not backend.allow()
+    assert 29 < backend.retry_in() <= 30
+
+
+def test_error_rate_opens_the_breaker():
+    backend = ExtractorBackend('a', _fail, min_samples=4, error_threshold=0.5, consecutive_failures=10)
+    for ok in (True, False, True, False):
+        backend.record(0.1, ok)
+    assert backend.state == ExtractorBackend.OPEN
+
+
+def test_half_open_probe_closes_on_success():
+    backend = ExtractorBackend('a', _fail, consecutive_failures=1, cooldown=0.05)
+    backend.record(0.1, False)
+    assert not backend.allow()
+
+    time.sleep(0.06)
+    assert backend.allow()
+    assert backend.state == ExtractorBackend.HALF_OPEN
+    # 只放行一个试探请求
+    assert not backend.allow()
+
+    backend.record(0.1, True)
+    assert backend.state == ExtractorBackend.CLOSED
+    assert backend.cooldown == 0.05
+    assert backend.allow()
+
+
+def test_failed_probe_doubles_cooldown():
+    backend = ExtractorBackend('a', _fail, consecutive_failures=1, cooldown=0.05, max_cooldown=0.08)
+    backend.record(0.1, False)
+    time.sleep(0.06)
+    assert backend.allow()
+    backend.record(0.1, False)
+    assert backend.state == ExtractorBackend.OPEN
+    assert backend.cooldown == 0.08
+    assert backend.trips == 2
+
+
+def test_local_rate_limit_does_not_trip_the_breaker():
+    def limited(video_id):
+        raise RateLimitExceeded('local token bucket', 3)
+
+    snapany = ExtractorBackend('snapany', limited, consecutive_failures=3)
+    ytdlp = ExtractorBackend('yt_dlp', _ok('yt_dlp'))
+    router = ExtractorRouter([snapany, ytdlp], hedge_delay=5, min_hedge_delay=0, timeout=5, workers=2)
+
+    for _ in range(5):
+        assert router.extract('vid')['source'] == 'yt_dlp'
+    assert snapany.state == ExtractorBackend.CLOSED
+    assert snapany.stats()['samples'] == 0
+    assert router.stats()['failovers'] == 5
+
+
+def test_local_rate_limit_releases_half_open_probe():
+    calls = []
+
+    def limited(video_id):
+        calls.append(video_id)
+        raise RateLimitExceeded('local token bucket', 3)
+
+    backend = ExtractorBackend('snapany', limited, consecutive_failures=1, cooldown=0.05)
+    backend.record(0.1, False)
+    time.sleep(0.06)
+    router = ExtractorRouter([backend], hedge_delay=5, min_hedge_delay=0, timeout=5, workers=1)
+
+    with pytest.raises(Exception):
+        router.extract('vid')
+    assert backend.state == ExtractorBackend.HALF_OPEN
+    # 被本地拒绝的试探不占用试探名额
+    assert backend.allow()
+
+
+def test_hedge_fires_after_delay():
+    release = threading.Event()
+
+    def slow(video_id):
+        release.wait(5)
+        return {'source': 'slow'}
+
+    slow_backend = ExtractorBackend('slow', slow)
+    fast_backend = ExtractorBackend('fast', _ok('fast'))
+    router = ExtractorRouter([slow_backend, fast_backend], hedge_delay=0.1, min_hedge_delay=0,
+                             timeout=5, workers=2)
+
+    started = time.time()
+    result = router.extract('vid')
+    elapsed = time.time() - started
+    release.set()
+
+    assert result['source'] == 'fast'
+    assert 0.1 <= elapsed < 1
+    assert router.stats()['hedged'] == 1
+    assert fast_backend.wins == 1
+
+
+def test_no_hedge_when_primary_answers_in_time():
+    router = ExtractorRouter([ExtractorBackend('a', _ok('a')), ExtractorBackend('b', _ok('b'))],
+                             hedge_delay=1, min_hedge_delay=0, timeout=5, workers=2)
+    assert router.extract('vid')['source'] == 'a'
+    assert router.stats()['hedged'] == 0
+
+
+def test_all_backends_open_raises_unavailable():
+    backend = ExtractorBackend('a', _fail, consecutive_failures=1, cooldown=30)
+    backend.record(0.1, False)
+    router = ExtractorRouter([backend], hedge_delay=1, timeout=5, workers=1)
+    with pytest.raises(ExtractorsUnavailable) as excinfo:
+        router.extract('vid')
+    assert excinfo.value.retry_after >= 1
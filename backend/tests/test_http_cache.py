@@ -0,0 +1,141 @@
+import gzip
+import json
+
+import pytest
+
+from http_cache import Representation, accepts_gzip, etag_matches, make_etag, negotiate
+
+ETAG = '"abc123"'
+
+
+@pytest.mark.parametrize('if_none_match, expected', [
+    (None, False),
+    ('', False),
+    ('"abc123"', True),
+    ('"other"', False),
+    ('*', True),
+    ('"other", "abc123"', True),
+    ('W/"abc123"', True),
+    # 压缩版本的 ETag 与未压缩版本视为相同
+    ('"abc123-gzip"', True),
+    ('W/"abc123-gzip"', True),
+    ('"abc1234"', False),
+])
+def test_etag_matches(if_none_match, expected):
+    assert etag_matches(if_none_match, ETAG) is expected
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    (None, False),
+    ('', False),
+    ('gzip', True),
+    ('deflate, gzip;q=0.5', True),
+    ('GZIP', True),
+    ('x-gzip', True),
+    ('gzip;q=0', False),
+    ('gzip; q=0.0', False),
+    ('gzip;q=abc', False),
+    ('br', False),
+    ('*', True),
+    ('*;q=0', False),
+    # 明确拒绝 gzip 时通配符不生效
+    ('*, gzip;q=0', False),
+    ('gzip;q=0, *', False),
+    ('br, *;q=0.1', True),
+])
+def test_accepts_gzip(accept_encoding, expected):
+    assert accepts_gzip(accept_encoding) is expected
+
+
+@pytest.mark.parametrize('accept, expected', [
+    (None, 'application/json'),
+    ('*/*', 'application/json'),
+    ('application/x-columns', 'application/x-columns'),
+    ('application/json;q=0.5, application/x-columns', 'application/x-columns'),
+    ('application/x-columns;q=0.5, application/json', 'application/json'),
+    ('application/x-columns;q=0', 'application/json'),
+    ('text/html', 'application/json'),
+])
+def test_negotiate(accept, expected):
+    assert negotiate(accept, ['application/json', 'application/x-columns']) == expected
+
+
+def test_make_etag_depends_on_every_part():
+    assert make_etag('a', 'b') == make_etag('a', 'b')
+    assert make_etag('a', 'b') != make_etag('ab', '')
+    assert make_etag('a', 'b').startswith('"')
+
+
+def test_representation_renders_once_per_etag():
+    calls = []
+
+    def render():
+        calls.append(1)
+        return b'x' * 2000
+
+    etag = make_etag('render-once')
+    for _ in range(3):
+        status, body, headers = Representation(etag, 'text/plain', render).respond(accept_encoding='gzip')
+        assert status == 200
+        assert gzip.decompress(body) == b'x' * 2000
+    assert len(calls) == 1
+
+
+def test_small_bodies_are_not_compressed():
+    status, body, headers = Representation(make_etag('small'), 'text/plain', lambda: b'tiny').respond(
+        accept_encoding='gzip')
+    assert body == b'tiny'
+    assert 'Content-Encoding' not in headers
+
+
+@pytest.fixture
+def client():
+    import app
+    languages = [{'code': f'l{i}', 'name': f'Language {i}', 'is_generated': bool(i % 2), 'is_translatable': True}
+                 for i in range(60)]
+    app.transcript_store.put_catalog('etagvideo01', languages)
+    return app.app.test_client()
+
+
+def test_endpoint_gzip_body_matches_plain_body(client):
+    plain = client.get('/api/languages/etagvideo01')
+    assert plain.status_code == 200
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+    assert plain.headers['Cache-Control'] == 'no-cache'
+
+    compressed = client.get('/api/languages/etagvideo01', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert compressed.status_code == 200
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['Vary'] == 'Accept-Encoding'
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+    assert json.loads(gzip.decompress(compressed.get_data())) == plain.get_json()
+    assert len(plain.get_json()['languages']) == 60
+
+    refused = client.get('/api/languages/etagvideo01', headers={'Accept-Encoding': 'gzip;q=0'})
+    assert 'Content-Encoding' not in refused.headers
+    assert refused.get_data() == plain.get_data()
+
+
+def test_endpoint_revalidation_returns_304(client):
+    plain = client.get('/api/languages/etagvideo01')
+    compressed = client.get('/api/languages/etagvideo01', headers={'Accept-Encoding': 'gzip'})
+    etag, gzip_etag = plain.headers['ETag'], compressed.headers['ETag']
+
+    for if_none_match, expected_etag in [
+        (etag, etag),
+        (gzip_etag, gzip_etag),
+        (f'W/{etag}', etag),
+        (f'"stale", {gzip_etag}', gzip_etag),
+        ('*', etag),
+    ]:
+        response = client.get('/api/languages/etagvideo01',
+                              headers={'If-None-Match': if_none_match, 'Accept-Encoding': 'gzip'})
+        assert response.status_code == 304
+        assert response.get_data() == b''
+        assert response.headers['ETag'] == expected_etag
+        assert 'Content-Encoding' not in response.headers
+
+    response = client.get('/api/languages/etagvideo01', headers={'If-None-Match': '"stale"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == etag
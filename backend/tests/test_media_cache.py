@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from media_cache import MediaURLCache, collect_urls, earliest_expiry, url_expiry
+
+NOW = 1_700_000_000.0
+
+
+def _url(expire):
+    if isinstance(expire, float):
+        expire = int(expire)
+    return f'https://rr1---sn-abc.googlevideo.com/videoplayback?itag=18&expire={expire}&sig=x'
+
+
+@pytest.mark.parametrize('url, expected', [
+    (_url(1700003600), 1700003600.0),
+    ('https://rr1.googlevideo.com/videoplayback?itag=18', None),
+    (_url('abc'), None),
+    (_url(''), None),
+    (_url('-5'), None),
+    (_url('1.5e9'), None),
+    ('https://manifest.googlevideo.com/api/manifest/hls_playlist/expire/1700007200/ei/x/index.m3u8', 1700007200.0),
+    ('not a url', None),
+    ('http://[::1', None),
+])
+def test_url_expiry(url, expected):
+    assert url_expiry(url) == expected
+
+
+def test_earliest_expiry_over_nested_result():
+    result = {
+        'title': 'x',
+        'video_url': _url(1700009000),
+        'formats': [{'video_url': _url(1700005000), 'audio_url': None}, {'video_url': 'https://example.com/a'}],
+    }
+    assert sorted(collect_urls(result)) == sorted([_url(1700009000), _url(1700005000), 'https://example.com/a'])
+    assert earliest_expiry(collect_urls(result)) == 1700005000.0
+    assert earliest_expiry([]) is None
+
+
+@pytest.fixture
+def cache():
+    return MediaURLCache(default_ttl=600, safety_margin=1800, max_ttl=6 * 3600, stale_floor=600,
+                         max_entries=100, max_bytes=1024 * 1024, sweep_interval=0)
+
+
+def test_ttl_is_expire_minus_safety_margin(cache):
+    assert cache.expires_at({'url': _url(NOW + 3 * 3600)}, now=NOW) == NOW + 3 * 3600 - 1800
+    assert cache._lifetime({'url': _url(NOW + 3 * 3600)}, NOW) == (NOW + 3 * 3600 - 1800, NOW + 3 * 3600 - 600)
+
+
+def test_ttl_is_capped(cache):
+    assert cache.expires_at({'url': _url(NOW + 48 * 3600)}, now=NOW) == NOW + 6 * 3600
+
+
+@pytest.mark.parametrize('value', [{'url': 'https://example.com/video.mp4'}, {'url': _url('garbage')}, {}])
+def test_missing_or_garbage_expire_uses_default_ttl(cache, value):
+    assert cache._lifetime(value, NOW) == (NOW + 600, NOW + 600 + 1800 - 600)
+
+
+def test_already_expired_url_is_not_cached(cache):
+    now = time.time()
+    assert cache.set('expired', {'url': _url(now - 60)}) is False
+    assert cache.get('expired') is None
+
+
+def test_url_inside_safety_margin_is_not_cached_and_drops_old_entry(cache):
+    now = time.time()
+    assert cache.set('k', {'url': _url(now + 3600)}) is True
+    assert cache.get('k') is not None
+    # 只剩 20 分钟, 小于 30 分钟安全余量
+    assert cache.set('k', {'url': _url(now + 1200)}) is False
+    assert cache.get_entry('k') is None
+
+
+def test_stale_until_stops_before_url_expires(cache):
+    now = time.time()
+    cache.set('k', {'url': _url(now + 3 * 3600)})
+    entries = {key: (expires_at, stale_until) for key, _, expires_at, stale_until in cache.items()}
+    expires_at, stale_until = entries['k']
+    assert expires_at == pytest.approx(int(now + 3 * 3600) - 1800)
+    assert stale_until == pytest.approx(int(now + 3 * 3600) - 600)
+    assert stale_until > expires_at
@@ -0,0 +1,179 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from media_proxy import BlockCache, MediaProxy, RangeNotSatisfiable, StreamTarget, parse_range, split_blocks
+
+DATA = bytes(range(256)) * 40  # 10240 字节
+
+
+class RangeUpstream:
+    """本地媒体上游: 支持单个 Range 区间, status 不为 206 时直接返回该状态码"""
+
+    def __init__(self):
+        self.status = 206
+        self.requests = []
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                header = self.headers.get('Range')
+                upstream.requests.append(header)
+                if upstream.status != 206:
+                    self.send_response(upstream.status)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                start, end = parse_range(header, len(DATA))
+                body = DATA[start:end + 1]
+                self.send_response(206)
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/videoplayback?itag=18&clen={len(DATA)}&mime=video%2Fmp4'
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def upstream():
+    upstream = RangeUpstream()
+    yield upstream
+    upstream.close()
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('', None),
+    ('items=0-1', None),
+    ('bytes=abc-', None),
+    ('bytes=0-', (0, 99)),
+    ('bytes=10-19', (10, 19)),
+    ('bytes=90-500', (90, 99)),
+    ('bytes=-10', (90, 99)),
+    ('bytes=-500', (0, 99)),
+    ('bytes=5-9, 20-29', (5, 9)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=100-', 'bytes=20-10', 'bytes=-0'])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(RangeNotSatisfiable) as excinfo:
+        parse_range(header, 100)
+    assert excinfo.value.size == 100
+
+
+def test_split_blocks():
+    assert list(split_blocks(0, 9, 10)) == [(0, 0, 10)]
+    assert list(split_blocks(5, 24, 10)) == [(0, 5, 10), (1, 0, 10), (2, 0, 5)]
+    assert list(split_blocks(13, 13, 10)) == [(1, 3, 4)]
+
+
+def test_response_head_200_206_and_416():
+    target = StreamTarget('http://example.invalid/v', 'vid:18:100', 100, 'video/mp4')
+
+    status, headers, start, end = MediaProxy.response_head(target, None)
+    assert (status, start, end) == (200, 0, 99)
+    assert headers['Content-Length'] == '100'
+    assert headers['Accept-Ranges'] == 'bytes'
+
+    status, headers, start, end = MediaProxy.response_head(target, 'bytes=10-')
+    assert (status, start, end) == (206, 10, 99)
+    assert headers['Content-Length'] == '90'
+    assert headers['Content-Range'] == 'bytes 10-99/100'
+
+    with pytest.raises(RangeNotSatisfiable):
+        MediaProxy.response_head(target, 'bytes=100-')
+
+
+def test_stream_range_through_disk_cache(upstream, tmp_path):
+    cache = BlockCache(str(tmp_path), 1024 * 1024)
+    proxy = MediaProxy(lambda video_id, fmt, force: upstream.url, cache=cache, block_size=4096)
+
+    status, headers, body = proxy.open('vid', 'best', 'bytes=1000-9000')
+    assert status == 206
+    assert b''.join(body) == DATA[1000:9001]
+    assert len(upstream.requests) == 3
+
+    # 第二次完全从磁盘缓存读取
+    status, headers, body = proxy.open('vid', 'best', 'bytes=5000-5099')
+    assert b''.join(body) == DATA[5000:5100]
+    assert len(upstream.requests) == 3
+    assert cache.hits == 1
+
+
+def test_evicted_block_can_still_be_read(upstream, tmp_path):
+    cache = BlockCache(str(tmp_path), 1024 * 1024)
+    proxy = MediaProxy(lambda video_id, fmt, force: upstream.url, cache=cache, block_size=4096)
+    b''.join(proxy.open('vid', 'best', 'bytes=0-4095')[2])
+
+    target = proxy.target('vid', 'best')
+    f = proxy._cached_block(target, 0)
+    os.remove(cache.path(target.key, 0))
+    assert b''.join(proxy._read_cached(f, 0, 4096)) == DATA[:4096]
+
+
+def test_truncated_block_is_fetched_again(upstream, tmp_path):
+    cache = BlockCache(str(tmp_path), 1024 * 1024)
+    proxy = MediaProxy(lambda video_id, fmt, force: upstream.url, cache=cache, block_size=4096)
+    b''.join(proxy.open('vid', 'best', 'bytes=0-4095')[2])
+    path = cache.path(proxy.target('vid', 'best').key, 0)
+    with open(path, 'r+b') as f:
+        f.truncate(100)
+
+    status, headers, body = proxy.open('vid', 'best', 'bytes=0-4095')
+    assert b''.join(body) == DATA[:4096]
+    assert len(upstream.requests) == 2
+    assert os.path.getsize(path) == 4096
+
+
+def test_truncated_block_is_a_miss_even_if_remove_fails(upstream, tmp_path, monkeypatch):
+    cache = BlockCache(str(tmp_path), 1024 * 1024)
+    proxy = MediaProxy(lambda video_id, fmt, force: upstream.url, cache=cache, block_size=4096)
+    b''.join(proxy.open('vid', 'best', 'bytes=0-4095')[2])
+    path = cache.path(proxy.target('vid', 'best').key, 0)
+    with open(path, 'r+b') as f:
+        f.truncate(100)
+
+    def remove(path):
+        raise PermissionError(path)
+
+    monkeypatch.setattr(os, 'remove', remove)
+    assert cache.get(proxy.target('vid', 'best').key, 0, 4096) is None
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    # 不会从已关闭的文件读取, 而是回源
+    status, headers, body = proxy.open('vid', 'best', 'bytes=0-4095')
+    assert b''.join(body) == DATA[:4096]
+    assert len(upstream.requests) == 2
+
+
+def test_reresolve_failure_mid_stream_ends_response(upstream):
+    calls = []
+
+    def resolve(video_id, fmt, force):
+        calls.append(force)
+        if force:
+            raise ValueError('no formats')
+        return upstream.url
+
+    proxy = MediaProxy(resolve, block_size=4096)
+    status, headers, body = proxy.open('vid', 'best', 'bytes=0-')
+    upstream.status = 403
+    assert b''.join(body) == b''
+    assert calls == [False, True]
+    assert proxy.stats()['active'] == 0
@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+
+import metrics
+
+LIVE_PIDS = {101, 102}
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    monkeypatch.setattr(metrics, '_registry', metrics._Registry())
+    monkeypatch.setattr(metrics, '_pid_alive', lambda pid: pid in LIVE_PIDS)
+    return tmp_path
+
+
+def _write_worker(directory, pid, requests, in_flight, latencies):
+    registry = metrics._Registry()
+    registry._flusher_pid = os.getpid()  # 不启动写入线程
+    registry.inc('cache_requests_total', {'cache': 'media', 'result': 'hit'}, requests)
+    registry.inc('cache_requests_total', {'cache': 'media', 'result': 'miss'}, 1)
+    registry.add_gauge('http_requests_in_flight', {'route': '/api/subtitles'}, in_flight)
+    for latency in latencies:
+        registry.observe('http_request_duration_seconds', latency, {'route': '/api/subtitles'})
+    with open(directory / f'{pid}.json', 'w') as f:
+        json.dump(registry.snapshot(), f)
+
+
+def _series(output):
+    return dict(line.rsplit(' ', 1) for line in output.splitlines() if not line.startswith('#'))
+
+
+def test_render_sums_live_worker_files(metrics_dir):
+    _write_worker(metrics_dir, 101, requests=3, in_flight=2, latencies=[0.004, 0.3])
+    _write_worker(metrics_dir, 102, requests=5, in_flight=1, latencies=[0.3, 7.0])
+    # 已退出且未归档的进程不计入
+    _write_worker(metrics_dir, 103, requests=100, in_flight=9, latencies=[1.0])
+
+    output = metrics.render()
+    series = _series(output)
+
+    assert series['ytsub_cache_requests_total{cache="media",result="hit"}'] == '8'
+    assert series['ytsub_cache_requests_total{cache="media",result="miss"}'] == '2'
+    assert series['ytsub_cache_hit_ratio{cache="media"}'] == repr(8 / 10)
+    assert series['ytsub_http_requests_in_flight{route="/api/subtitles"}'] == '3'
+
+    histogram = 'ytsub_http_request_duration_seconds'
+    assert series[f'{histogram}_bucket{{route="/api/subtitles",le="0.005"}}'] == '1'
+    assert series[f'{histogram}_bucket{{route="/api/subtitles",le="0.5"}}'] == '3'
+    assert series[f'{histogram}_bucket{{route="/api/subtitles",le="+Inf"}}'] == '4'
+    assert series[f'{histogram}_count{{route="/api/subtitles"}}'] == '4'
+    assert float(series[f'{histogram}_sum{{route="/api/subtitles"}}']) == pytest.approx(7.604)
+
+    assert '# TYPE ytsub_cache_requests_total counter' in output
+    assert '# TYPE ytsub_http_request_duration_seconds histogram' in output
+
+
+def test_exited_worker_is_archived_without_gauges(metrics_dir, monkeypatch):
+    _write_worker(metrics_dir, 101, requests=3, in_flight=2, latencies=[0.3])
+    _write_worker(metrics_dir, 102, requests=5, in_flight=1, latencies=[0.3])
+
+    metrics.mark_process_dead(101)
+    monkeypatch.setattr(metrics, '_pid_alive', lambda pid: pid == 102)
+
+    assert not (metrics_dir / '101.json').exists()
+    series = _series(metrics.render())
+    # 计数器和直方图保留, 已退出进程的 gauge 不再计入
+    assert series['ytsub_cache_requests_total{cache="media",result="hit"}'] == '8'
+    assert series['ytsub_http_request_duration_seconds_count{route="/api/subtitles"}'] == '2'
+    assert series['ytsub_http_requests_in_flight{route="/api/subtitles"}'] == '1'
+
+    # 同一个进程的重复通知不会重复计入
+    metrics.mark_process_dead(101)
+    assert _series(metrics.render())['ytsub_cache_requests_total{cache="media",result="hit"}'] == '8'
+
+
+def test_reset_directory_discards_previous_run(metrics_dir):
+    _write_worker(metrics_dir, 101, requests=3, in_flight=2, latencies=[0.3])
+    metrics.mark_process_dead(101)
+    metrics.reset_directory()
+    assert 'ytsub_cache_requests_total' not in metrics.render()
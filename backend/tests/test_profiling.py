@@ -0,0 +1,129 @@
+import contextvars
+import os
+import re
+import threading
+import time
+
+import pytest
+
+import profiling
+
+
+def _phases(header):
+    return {name: float(dur) for name, dur in re.findall(r'(\w+);dur=([\d.]+)', header)}
+
+
+def test_nested_phases_count_only_their_own_time():
+    handle = profiling.begin('/api/test')
+    with profiling.phase('format'):
+        time.sleep(0.01)
+        with profiling.phase('cache'):
+            time.sleep(0.04)
+    profiling.record('ratelimit_wait', 0.5)
+    profiling.record('ratelimit_wait', 0.25)
+    timing = profiling.current()
+    headers = profiling.finish(handle)
+
+    assert timing.phases['cache'] == pytest.approx(0.04, abs=0.015)
+    assert timing.phases['format'] == pytest.approx(0.01, abs=0.015)
+    assert timing.phases['ratelimit_wait'] == 0.75
+    # 按耗时从大到小排列, 最后是总耗时
+    phases = _phases(headers['Server-Timing'])
+    assert list(phases) == ['ratelimit_wait', 'cache', 'format', 'total']
+    assert phases['total'] >= 50
+    assert profiling.current() is None
+
+
+def test_recording_outside_a_request_is_a_no_op():
+    assert profiling.current() is None
+    with profiling.phase('cache'):
+        profiling.record('ratelimit_wait', 1.0)
+    assert profiling.timed('format')(lambda x: x * 2)(21) == 42
+    assert profiling.finish(None) == {}
+
+
+def test_finish_only_takes_effect_once():
+    handle = profiling.begin('/api/test')
+    assert 'Server-Timing' in profiling.finish(handle)
+    assert profiling.finish(handle) == {}
+
+
+def test_server_timing_header_on_flask_response():
+    import app
+    app.transcript_store.put_catalog('profile0001', [
+        {'code': 'en', 'name': 'English', 'is_generated': False, 'is_translatable': True}])
+
+    response = app.app.test_client().get('/api/languages/profile0001')
+    assert response.status_code == 200
+    phases = _phases(response.headers['Server-Timing'])
+    assert 'cache' in phases
+    assert 'total' in phases
+
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+@pytest.fixture
+def profile_token(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', 'secret')
+    monkeypatch.setattr(profiling, 'PROFILE_INTERVAL', 0.001)
+    monkeypatch.setenv('PROFILE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_profile_header_samples_and_dumps_folded_stacks(profile_token):
+    handle = profiling.begin('/api/video-url/<video_id>', 'secret')
+    timing = handle[0]
+    assert timing.profile and timing.force
+    _busy(0.1)
+    headers = profiling.finish(handle)
+
+    # 采样线程已停止采集这个请求
+    assert timing not in profiling._sampler._active
+    assert timing.samples > 0
+    name = headers['X-Profile']
+    assert name.endswith('.folded') and '-api_video_url_video_id-' in name
+    lines = (profile_token / name).read_text().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert '_busy (test_profiling.py' in stack
+
+
+def test_wrong_token_does_not_profile(profile_token):
+    handle = profiling.begin('/api/test', 'guess')
+    assert handle[0].profile is False
+    assert 'X-Profile' not in profiling.finish(handle)
+    assert os.listdir(profile_token) == []
+
+
+def test_attach_samples_worker_threads(profile_token):
+    handle = profiling.begin('/api/test', 'secret')
+    timing = handle[0]
+    context = contextvars.copy_context()
+
+    def work():
+        with profiling.attach():
+            assert len(timing.threads) == 2
+            _busy(0.05)
+        assert len(timing.threads) == 1
+
+    thread = threading.Thread(target=context.run, args=(work,))
+    thread.start()
+    thread.join(5)
+    headers = profiling.finish(handle)
+    folded = (profile_token / headers['X-Profile']).read_text()
+    assert 'work (test_profiling.py' in folded
+
+
+def test_old_profiles_are_pruned(profile_token, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_MAX_FILES', 2)
+    for i in range(4):
+        path = profile_token / f'{i}.folded'
+        path.write_text('main 1\n')
+        os.utime(path, (i, i))
+    profiling._prune(str(profile_token))
+    assert sorted(os.listdir(profile_token)) == ['2.folded', '3.folded']
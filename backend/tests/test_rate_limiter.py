@@ -0,0 +1,246 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from rate_limiter import (
+    PRIORITY_BACKGROUND, PRIORITY_BATCH, PRIORITY_INTERACTIVE,
+    RateLimitExceeded, TokenBucket, UpstreamScheduler,
+)
+
+
+class ManualBucket:
+    """手动发放令牌的桶: 没有令牌时返回很短的等待时间"""
+
+    rate = 1.0
+
+    def __init__(self):
+        self.permits = 0
+        self.granted_to = []
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        with self.lock:
+            if self.permits > 0:
+                self.permits -= 1
+                self.granted_to.append(threading.current_thread().name)
+                return 0.0
+        return 0.01
+
+
+def _acquire_in_child(state_path, results):
+    results.put(TokenBucket(1.0, capacity=1.0, state_path=state_path).try_acquire())
+
+
+def test_token_bucket_is_shared_through_state_file(tmp_path):
+    state_path = str(tmp_path / 'bucket.state')
+    first = TokenBucket(0.5, capacity=1.0, state_path=state_path)
+    second = TokenBucket(0.5, capacity=1.0, state_path=state_path)
+
+    assert first.try_acquire() == 0
+    wait = second.try_acquire()
+    assert 1.5 < wait <= 2.0
+
+
+def test_token_bucket_is_shared_across_processes(tmp_path):
+    state_path = str(tmp_path / 'bucket.state')
+    assert TokenBucket(1.0, capacity=1.0, state_path=state_path).try_acquire() == 0
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    child = context.Process(target=_acquire_in_child, args=(state_path, results))
+    child.start()
+    child.join(10)
+    assert results.get(timeout=1) > 0
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(100.0, capacity=2.0)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() > 0
+    time.sleep(0.05)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+
+
+def test_waiters_are_granted_in_priority_order():
+    bucket = ManualBucket()
+    scheduler = UpstreamScheduler(bucket, max_queue=8, max_wait=10)
+
+    threads = []
+    for name, priority in [('background', PRIORITY_BACKGROUND), ('batch', PRIORITY_BATCH),
+                           ('interactive', PRIORITY_INTERACTIVE)]:
+        thread = threading.Thread(target=scheduler.acquire, args=(priority,), name=name)
+        thread.start()
+        threads.append(thread)
+        # 按到达顺序入队
+        deadline = time.time() + 2
+        while scheduler.stats()['queued'] < len(threads) and time.time() < deadline:
+            time.sleep(0.005)
+    assert scheduler.stats()['queued'] == 3
+
+    with bucket.lock:
+        bucket.permits = 3
+    for thread in threads:
+        thread.join(5)
+    assert bucket.granted_to == ['interactive', 'batch', 'background']
+    assert scheduler.stats()['granted'] == 3
+
+
+def test_full_queue_fails_fast_with_retry_after():
+    bucket = ManualBucket()
+    scheduler = UpstreamScheduler(bucket, max_queue=1, max_wait=10)
+    waiter = threading.Thread(target=scheduler.acquire)
+    waiter.start()
+    while scheduler.stats()['queued'] < 1:
+        time.sleep(0.005)
+
+    started = time.time()
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        scheduler.acquire()
+    assert time.time() - started < 0.5
+    assert excinfo.value.retry_after > 0
+    assert scheduler.stats()['rejected'] == 1
+
+    with bucket.lock:
+        bucket.permits = 1
+    waiter.join(5)
+    assert scheduler.stats()['queued'] == 0
+
+
+def test_expected_wait_beyond_max_wait_fails_fast():
+    bucket = TokenBucket(0.1, capacity=1.0)
+    scheduler = UpstreamScheduler(bucket, max_queue=8, max_wait=1)
+    scheduler.acquire()
+
+    started = time.time()
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        scheduler.acquire()
+    assert time.time() - started < 0.5
+    assert 9 < excinfo.value.retry_after <= 10
+    assert scheduler.stats()['queued'] == 0
+
+
+def test_non_head_waiter_fails_fast_on_estimated_position():
+    bucket = ManualBucket()
+    scheduler = UpstreamScheduler(bucket, max_queue=8, max_wait=10)
+    threads = []
+    for _ in range(2):
+        threads.append(threading.Thread(target=scheduler.acquire))
+        threads[-1].start()
+        while scheduler.stats()['queued'] < len(threads):
+            time.sleep(0.005)
+
+    # 队首很快拿到令牌, 但中间还隔着一个请求, 按每秒 1 个令牌估算至少需要 1 秒
+    started = time.time()
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        scheduler.acquire(max_wait=0.5)
+    assert time.time() - started < 0.3
+    assert 1.0 <= excinfo.value.retry_after < 1.1
+
+    with bucket.lock:
+        bucket.permits = 2
+    for thread in threads:
+        thread.join(5)
+    assert scheduler.stats()['granted'] == 2
+
+
+def test_default_settings_queue_waiters_in_priority_order():
+    # 默认的 SnapAny 配置: 每 3 秒一个令牌, 最多等待 3 秒
+    bucket = ManualBucket()
+    bucket.rate = 1 / 3
+    scheduler = UpstreamScheduler(bucket)
+    results = {}
+
+    def acquire(name, priority):
+        try:
+            scheduler.acquire(priority)
+            results[name] = 'granted'
+        except RateLimitExceeded:
+            results[name] = 'rejected'
+
+    threads = []
+    for name, priority in [('background', PRIORITY_BACKGROUND), ('interactive', PRIORITY_INTERACTIVE),
+                           ('batch', PRIORITY_BATCH)]:
+        thread = threading.Thread(target=acquire, args=(name, priority), name=name)
+        thread.start()
+        threads.append(thread)
+        deadline = time.time() + 2
+        while scheduler.stats()['queued'] < len(threads) and time.time() < deadline:
+            time.sleep(0.005)
+    # 队首的令牌马上就到, 后面的请求排队等待而不是直接被拒绝
+    assert scheduler.stats()['queued'] == 3
+    assert scheduler.stats()['rejected'] == 0
+
+    with bucket.lock:
+        bucket.permits = 3
+    for thread in threads:
+        thread.join(5)
+    assert results == {'interactive': 'granted', 'batch': 'granted', 'background': 'granted'}
+    assert bucket.granted_to == ['interactive', 'batch', 'background']
+
+
+def test_bucket_error_does_not_leave_waiter_at_head():
+    bucket = ManualBucket()
+    scheduler = UpstreamScheduler(bucket, max_queue=8, max_wait=1)
+
+    def broken():
+        raise OSError('state file unavailable')
+
+    bucket.try_acquire, working = broken, bucket.try_acquire
+    with pytest.raises(OSError):
+        scheduler.acquire()
+    assert scheduler.stats()['queued'] == 0
+
+    bucket.try_acquire = working
+    bucket.permits = 1
+    started = time.time()
+    scheduler.acquire()
+    assert time.time() - started < 0.5
+    assert scheduler.stats()['granted'] == 1
+
+
+def test_async_waiters_are_granted_in_priority_order():
+    bucket = ManualBucket()
+    scheduler = UpstreamScheduler(bucket, max_queue=8, max_wait=10)
+    order = []
+
+    async def waiter(name, priority):
+        await scheduler.acquire_async(priority)
+        order.append(name)
+
+    async def main():
+        tasks = []
+        for name, priority in [('background', PRIORITY_BACKGROUND), ('batch', PRIORITY_BATCH),
+                               ('interactive', PRIORITY_INTERACTIVE)]:
+            tasks.append(asyncio.create_task(waiter(name, priority)))
+            await asyncio.sleep(0.02)
+        assert scheduler.stats()['queued'] == 3
+        with bucket.lock:
+            bucket.permits = 3
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+
+    asyncio.run(main())
+    assert order == ['interactive', 'batch', 'background']
+    assert scheduler.stats()['queued'] == 0
+    assert scheduler.stats()['granted'] == 3
+
+
+def test_async_full_queue_fails_fast():
+    bucket = ManualBucket()
+    scheduler = UpstreamScheduler(bucket, max_queue=1, max_wait=10)
+
+    async def main():
+        first = asyncio.create_task(scheduler.acquire_async())
+        await asyncio.sleep(0.02)
+        with pytest.raises(RateLimitExceeded):
+            await scheduler.acquire_async()
+        with bucket.lock:
+            bucket.permits = 1
+        await asyncio.wait_for(first, 5)
+
+    asyncio.run(main())
+    assert scheduler.stats()['queued'] == 0
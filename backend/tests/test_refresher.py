@@ -0,0 +1,91 @@
+import threading
+import time
+
+from media_cache import MediaURLCache
+from refresher import BackgroundRefresher
+from singleflight import SingleFlight
+from youtube_iiilab import IIILabYouTubeService
+
+VIDEO_URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+def test_schedule_runs_one_refresh_per_key():
+    refresher = BackgroundRefresher(workers=2, top_n=0)
+    release = threading.Event()
+    calls = []
+
+    def refresh():
+        calls.append(1)
+        release.wait(5)
+
+    assert refresher.schedule('k', refresh) is True
+    assert refresher.schedule('k', refresh) is False
+    release.set()
+    assert _wait_until(lambda: refresher.stats()['refreshed'] == 1)
+    assert calls == [1]
+    # 上一次刷新结束后可以再次安排
+    assert refresher.schedule('k', refresh) is True
+
+
+def test_touch_trims_to_hottest_keys():
+    refresher = BackgroundRefresher(workers=1, top_n=0, max_tracked=8)
+    for _ in range(3):
+        for hot in range(8):
+            refresher.touch(f'hot{hot}', lambda: None, time.time() + 3600)
+    for cold in range(50):
+        refresher.touch(f'cold{cold}', lambda: None, time.time() + 3600)
+
+    assert refresher.stats()['tracked'] <= 8 + 2
+    assert all(f'hot{hot}' in refresher._counts for hot in range(8))
+    assert set(refresher._targets) == set(refresher._counts)
+
+
+def test_refresh_ahead_schedules_hot_entries_close_to_expiry():
+    refresher = BackgroundRefresher(workers=1, top_n=1, interval=3600, horizon=60)
+    refreshed = []
+    refresher.touch('soon', lambda: refreshed.append('soon'), time.time() + 10)
+    refresher.touch('soon', lambda: refreshed.append('soon'), time.time() + 10)
+    refresher.touch('later', lambda: refreshed.append('later'), time.time() + 10)
+
+    assert refresher.refresh_ahead() == 1
+    assert _wait_until(lambda: refreshed == ['soon'])
+
+
+def test_stale_entry_is_served_immediately_and_refreshed_once_in_background():
+    cache = MediaURLCache(default_ttl=600, safety_margin=0, stale_floor=0)
+    refresher = BackgroundRefresher(workers=2, top_n=0)
+    service = IIILabYouTubeService(flight=SingleFlight(), cache=cache, refresher=refresher)
+
+    now = time.time()
+    stale = {'video_id': 'dQw4w9WgXcQ', 'title': 'old'}
+    cache.restore([('video_dQw4w9WgXcQ', stale, now - 5, now + 600)])
+
+    release = threading.Event()
+    upstream_calls = []
+
+    def extract_uncached(youtube_url, cache_key, priority):
+        upstream_calls.append(priority)
+        release.wait(5)
+        fresh = {'video_id': 'dQw4w9WgXcQ', 'title': 'new'}
+        cache.set(cache_key, fresh)
+        return fresh
+
+    service._extract_uncached = extract_uncached
+
+    started = time.perf_counter()
+    results = [service.extract_video_info(VIDEO_URL) for _ in range(5)]
+    assert time.perf_counter() - started < 0.5
+    assert all(result['title'] == 'old' for result in results)
+
+    assert _wait_until(lambda: len(upstream_calls) == 1)
+    release.set()
+    assert _wait_until(lambda: refresher.stats()['refreshed'] == 1)
+    assert len(upstream_calls) == 1
+    assert service.extract_video_info(VIDEO_URL)['title'] == 'new'
@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+import search_index
+from search_index import TranscriptSearch
+from transcript_index import TranscriptIndex
+
+
+def _index(texts):
+    return TranscriptIndex.from_segments(
+        [{'text': text, 'start': i * 2.0, 'duration': 2.0} for i, text in enumerate(texts)]
+    )
+
+
+KEY_A = ('videoAAAAAA', 'en', False, '')
+KEY_B = ('videoBBBBBB', 'en', True, '')
+
+TRANSCRIPT_A = _index([
+    'welcome back to the channel',
+    'today we never take it',           # 短语从这里开始, 跨到下一条字幕
+    'for granted that the weather is nice and the sun keeps shining all day long',
+    'thanks for watching',
+])
+TRANSCRIPT_B = _index([
+    'intro music',
+    'take it for granted take it for granted',
+    'outro',
+])
+
+
+@pytest.fixture
+def search(tmp_path):
+    search = TranscriptSearch(path=str(tmp_path / 'search.db'))
+    search.submit(KEY_A, TRANSCRIPT_A)
+    search.submit(KEY_B, TRANSCRIPT_B)
+    deadline = time.time() + 5
+    while search.indexed < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert search.indexed == 2
+    return search
+
+
+def test_background_indexing_and_ranked_hits(search):
+    results = search.search('Take it for GRANTED')
+
+    assert [(r['video_id'], r['cue']) for r in results] == [('videoBBBBBB', 1), ('videoAAAAAA', 1)]
+    assert results[0]['score'] >= results[1]['score']
+
+    crossing = results[1]
+    assert crossing['text'] == 'today we never take it'
+    assert crossing['start'] == TRANSCRIPT_A.starts[1]
+    assert crossing['duration'] == TRANSCRIPT_A.durations[1]
+    assert crossing['is_generated'] is False
+
+
+def test_phrase_inside_next_cue_is_reported_once_by_that_cue(search):
+    results = search.search('thanks for watching')
+    assert [(r['video_id'], r['cue']) for r in results] == [('videoAAAAAA', 3)]
+
+    results = search.search('sun keeps shining')
+    assert [(r['video_id'], r['cue']) for r in results] == [('videoAAAAAA', 2)]
+
+
+def test_filters_and_empty_queries(search):
+    assert [r['video_id'] for r in search.search('take it for granted', video_id='videoAAAAAA')] == ['videoAAAAAA']
+    assert search.search('take it for granted', language='zh-Hans') == []
+    assert search.search('???') == []
+    assert search.search('not in any transcript') == []
+
+
+def test_rowids_encode_document_and_cue(search):
+    conn = search._connect()
+    rowids = [row[0] for row in conn.execute('SELECT rowid FROM windows ORDER BY rowid')]
+    doc_ids = [row[0] for row in conn.execute('SELECT id FROM documents ORDER BY id')]
+    expected = [doc_id * search_index._ROWID_STRIDE + cue
+                for doc_id, index in zip(doc_ids, (TRANSCRIPT_A, TRANSCRIPT_B)) for cue in range(len(index))]
+    assert rowids == expected
+
+
+def test_reindex_skips_unchanged_and_replaces_changed(search):
+    assert search.index_transcript(KEY_A, TRANSCRIPT_A) is False
+    assert search.index_transcript(KEY_A, _index(['something else entirely'])) is True
+    assert [r['video_id'] for r in search.search('take it for granted')] == ['videoBBBBBB']
+    assert search.stats()['documents'] == 2
+
+
+def test_too_many_matches_fall_back_to_newest_first(search, monkeypatch):
+    # 最后建立索引、但相关度最低的字幕
+    search.index_transcript(('videoCCCCCC', 'en', False, ''), _index([
+        'a very long sentence where we also happen to take it for granted among many other filler words here',
+    ]))
+    ranked = search.search('take it for granted')
+    assert ranked[0]['video_id'] == 'videoBBBBBB'
+
+    monkeypatch.setattr(search_index, 'MAX_RANKED_MATCHES', 1)
+    results = search.search('take it for granted')
+    # 不再计算 bm25, 最新建立索引的字幕在前
+    assert [r['video_id'] for r in results] == ['videoCCCCCC', 'videoBBBBBB', 'videoAAAAAA']
+    assert all(r['score'] == 0 for r in results)
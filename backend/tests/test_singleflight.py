@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+def _run_concurrently(flight, key, fn, callers):
+    """并发调用 flight.do, 返回每个调用者的 (结果, 异常)"""
+    results = [None] * callers
+
+    def call(i):
+        try:
+            results[i] = (flight.do(key, fn), None)
+        except Exception as e:
+            results[i] = (None, e)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'value': 42}
+
+    threads, results = _run_concurrently(flight, 'op:vid', fetch, 5)
+    assert _wait_until(lambda: flight.stats()['operations'].get('op', {}).get('coalesced') == 4)
+    assert flight.in_flight() == 1
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert all(result == {'value': 42} and error is None for result, error in results)
+    # 所有调用者拿到同一个对象
+    assert len({id(result) for result, _ in results}) == 1
+    assert flight.stats() == {'in_flight': 0, 'operations': {'op': {'executed': 1, 'coalesced': 4}}}
+
+
+def test_exception_reaches_every_waiter_and_key_is_released():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fetch():
+        release.wait(5)
+        raise ValueError('upstream failed')
+
+    threads, results = _run_concurrently(flight, 'op:vid', fetch, 3)
+    assert _wait_until(lambda: flight.stats()['operations'].get('op', {}).get('coalesced') == 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(isinstance(error, ValueError) for _, error in results)
+    assert flight.in_flight() == 0
+
+    # 失败后同一个 key 重新执行
+    assert flight.do('op:vid', lambda: 'retried') == 'retried'
+    assert flight.stats()['operations']['op']['executed'] == 2
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do('op:a', lambda: 'a') == 'a'
+    assert flight.do('op:b', lambda: 'b') == 'b'
+    assert flight.stats()['operations']['op'] == {'executed': 2, 'coalesced': 0}
+
+
+def test_async_concurrent_callers_share_one_call():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return {'value': value}
+
+    async def main():
+        return await asyncio.gather(*(flight.do('op:vid', fetch, 7) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert calls == [7]
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {'in_flight': 0, 'operations': {'op': {'executed': 1, 'coalesced': 4}}}
+
+
+def test_async_exception_reaches_every_waiter_and_key_is_released():
+    flight = AsyncSingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        raise ValueError('upstream failed')
+
+    async def ok():
+        return 'retried'
+
+    async def main():
+        results = await asyncio.gather(*(flight.do('op:vid', fetch) for _ in range(3)), return_exceptions=True)
+        assert flight.stats()['in_flight'] == 0
+        return results, await flight.do('op:vid', ok)
+
+    results, retried = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert retried == 'retried'
+    assert flight.stats()['operations']['op'] == {'executed': 2, 'coalesced': 2}
+
+
+def test_async_leader_failure_without_waiters_is_raised():
+    flight = AsyncSingleFlight()
+
+    async def fetch():
+        raise KeyError('missing')
+
+    with pytest.raises(KeyError):
+        asyncio.run(flight.do('op:vid', fetch))
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_async_leader_cancellation_does_not_cancel_followers():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {'value': len(calls)}
+
+    async def main():
+        leader = asyncio.create_task(flight.do('op:vid', fetch))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(flight.do('op:vid', fetch)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        # 发起请求的客户端断开
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.wait_for(asyncio.gather(*followers), 5)
+
+    results = asyncio.run(main())
+    # 一个等待者重新执行, 另一个仍然合并到它的调用上
+    assert calls == [1, 1]
+    assert results == [{'value': 2}, {'value': 2}]
+    assert results[0] is results[1]
+    assert flight.stats()['in_flight'] == 0
+    assert flight.stats()['operations']['op']['executed'] == 2
@@ -0,0 +1,98 @@
+import json
+import struct
+
+import pytest
+
+from subtitle_formats import TIMESTAMP_COLUMNS_CONTENT_TYPE, encode_timestamp_columns
+from transcript_index import TranscriptIndex
+
+SEGMENTS = [
+    {'text': f'line {i} — 字幕 {"é" * (i % 3)}', 'start': i * 1.5, 'duration': 1.25}
+    for i in range(12)
+]
+
+LANGUAGES = [{'code': 'en', 'name': 'English', 'is_generated': False, 'is_translatable': True}]
+
+
+def decode_timestamp_columns(data: bytes):
+    """按 encode_timestamp_columns 的格式解码为 (元数据, [{text, start, duration}])"""
+    magic, version, _, count, meta_size = struct.unpack_from('<4sHHII', data, 0)
+    assert (magic, version) == (b'LSTC', 1)
+    position = 16
+    meta = json.loads(data[position:position + meta_size])
+    position += meta_size
+    # 各列按自身宽度对齐
+    assert position % 8 == 0
+    starts = struct.unpack_from(f'<{count}d', data, position)
+    position += 8 * count
+    durations = struct.unpack_from(f'<{count}d', data, position)
+    position += 8 * count
+    offsets = struct.unpack_from(f'<{count + 1}I', data, position)
+    position += 4 * (count + 1)
+    text = data[position:]
+    assert len(text) == offsets[-1]
+    rows = [{'text': text[offsets[i]:offsets[i + 1]].decode('utf-8'), 'start': starts[i], 'duration': durations[i]}
+            for i in range(count)]
+    return meta, rows
+
+
+@pytest.mark.parametrize('lo, hi', [(0, 12), (3, 7), (5, 5)])
+def test_columns_decode_to_the_same_rows(lo, hi):
+    index = TranscriptIndex.from_segments(SEGMENTS)
+    head = {'success': True, 'video_id': 'vid', 'count': hi - lo}
+    meta, rows = decode_timestamp_columns(encode_timestamp_columns(head, index, lo, hi))
+    assert meta == head
+    assert rows == index.to_segments(lo, hi) == SEGMENTS[lo:hi]
+
+
+class FakeTranscript:
+    language_code = 'en'
+    language = 'English'
+    is_generated = False
+
+    def fetch(self):
+        return SEGMENTS
+
+
+class FakeTranscriptList:
+    def find_manually_created_transcript(self, codes):
+        return FakeTranscript()
+
+    def find_generated_transcript(self, codes):
+        return FakeTranscript()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    import app
+
+    def transcript_list(video_id, force=False):
+        app.transcript_store.put_catalog(video_id, LANGUAGES)
+        return FakeTranscriptList(), LANGUAGES
+
+    monkeypatch.setattr(app.transcript_resolver, 'transcript_list', transcript_list)
+    return app.app.test_client()
+
+
+def test_timestamps_default_to_json_without_accept(client):
+    for headers in ({}, {'Accept': '*/*'}, {'Accept': 'text/html'}):
+        response = client.get('/api/video-timestamps/colsvideo01?languages=en', headers=headers)
+        assert response.status_code == 200
+        assert response.mimetype == 'application/json'
+        assert response.headers['Vary'] == 'Accept, Accept-Encoding'
+        assert response.get_json()['timestamps'] == SEGMENTS
+
+
+@pytest.mark.parametrize('query', ['', '&from=3&to=9', '&around=6&count=4'])
+def test_timestamps_columns_match_json_rows(client, query):
+    url = f'/api/video-timestamps/colsvideo01?languages=en{query}'
+    rows = client.get(url).get_json()
+    columns = client.get(url, headers={'Accept': f'{TIMESTAMP_COLUMNS_CONTENT_TYPE}, application/json;q=0.5'})
+    assert columns.status_code == 200
+    assert columns.headers['Content-Type'] == TIMESTAMP_COLUMNS_CONTENT_TYPE
+    assert columns.headers['ETag'] != client.get(url).headers['ETag']
+
+    meta, decoded = decode_timestamp_columns(columns.get_data())
+    timestamps = rows.pop('timestamps')
+    assert meta == rows
+    assert decoded == timestamps
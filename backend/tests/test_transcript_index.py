@@ -0,0 +1,89 @@
+import pytest
+
+from transcript_index import TranscriptIndex
+
+
+def _index(*cues):
+    return TranscriptIndex.from_segments([
+        {'text': f'cue{i}', 'start': start, 'duration': duration} for i, (start, duration) in enumerate(cues)
+    ])
+
+
+# 0-2, 2-4, 4-6, 6-8, 8-10
+EVEN = _index((0, 2), (2, 2), (4, 2), (6, 2), (8, 2))
+
+
+@pytest.mark.parametrize('start, end, expected', [
+    (0, 10, (0, 5)),
+    # 跨越窗口起点和终点的字幕都算重叠
+    (3, 7, (1, 4)),
+    # 区间左闭右开: 恰好在 start 结束、恰好在 end 开始的字幕不算
+    (4, 6, (2, 3)),
+    (4.5, 5, (2, 3)),
+    (-5, 0.1, (0, 1)),
+    (9.9, 20, (4, 5)),
+    (10, 20, (5, 5)),
+    (-5, 0, (0, 0)),
+])
+def test_window_boundaries(start, end, expected):
+    assert EVEN.window(start, end) == expected
+
+
+def test_window_on_empty_transcript():
+    empty = TranscriptIndex.from_segments([])
+    assert len(empty) == 0
+    assert empty.window(0, 100) == (0, 0)
+    assert empty.around(5, 3) == (0, 0)
+    assert empty.to_segments() == []
+
+
+def test_window_finds_long_cue_that_started_earlier():
+    # 第一条字幕持续 10 秒, 覆盖后面几条短字幕
+    index = _index((0, 10), (1, 1), (6, 2), (12, 1))
+    lo, hi = index.window(5, 7)
+    assert (lo, hi) == (0, 3)
+    # 结果是连续区间: 所有重叠的字幕都在其中, 夹在中间的不重叠短字幕也会返回
+    overlapping = {i for i in range(len(index))
+                   if index.starts[i] < 7 and index.starts[i] + index.durations[i] > 5}
+    assert overlapping <= set(range(lo, hi))
+
+    assert index.window(10.5, 11) == (3, 3)
+    assert index.window(10.5, 12.5) == (3, 4)
+
+
+def test_window_with_identical_start_times():
+    index = _index((1, 1), (1, 3), (1, 0.5), (5, 1))
+    assert index.window(1.8, 2) == (0, 3)
+    assert index.window(3.5, 5) == (1, 3)
+    assert index.window(4.5, 5) == (3, 3)
+
+
+@pytest.mark.parametrize('position, count, expected', [
+    # 当前字幕居中
+    (5, 3, (1, 4)),
+    (5, 1, (2, 3)),
+    # 第一条之前和第一条
+    (-1, 3, (0, 3)),
+    (0, 3, (0, 3)),
+    # 最后一条和之后
+    (9, 3, (2, 5)),
+    (100, 2, (3, 5)),
+    # count 超过总条数或为 0
+    (5, 20, (0, 5)),
+    (5, 0, (2, 2)),
+])
+def test_around(position, count, expected):
+    assert EVEN.around(position, count) == expected
+
+
+def test_segments_and_columns_round_trip():
+    index = _index((3, 1), (0, 2), (1.5, 0.5))
+    assert [segment['text'] for segment in index.to_segments()] == ['cue1', 'cue2', 'cue0']
+
+    restored = TranscriptIndex.from_bytes(index.to_bytes())
+    assert restored.to_segments() == index.to_segments()
+    assert restored.digest() == index.digest()
+
+    starts, durations, offsets, blob = index.columns(1, 3)
+    assert blob == b'cue2cue0'
+    assert len(starts) == 16 and len(durations) == 16 and len(offsets) == 12
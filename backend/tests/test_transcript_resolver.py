@@ -0,0 +1,143 @@
+import pytest
+
+from refresher import BackgroundRefresher
+from singleflight import SingleFlight
+from transcript_resolver import TranscriptPlan, TranscriptResolver, language_variants, resolve_plan
+from transcript_store import TranscriptStore
+
+LANGUAGES = [
+    {'code': 'en', 'name': 'English', 'is_generated': False, 'is_translatable': True},
+    {'code': 'en', 'name': 'English (auto-generated)', 'is_generated': True, 'is_translatable': True},
+]
+
+
+class FakeTranscript:
+    def __init__(self, language_code, is_generated, text, language=None):
+        self.language_code = language_code
+        self.language = language or language_code
+        self.is_generated = is_generated
+        self.text = text
+
+    def translate(self, target):
+        return FakeTranscript(target, True, f'{target} from {self.text}')
+
+    def fetch(self):
+        return [{'text': self.text, 'start': 0.0, 'duration': 1.0}]
+
+
+class FakeTranscriptList:
+    def __init__(self):
+        self.manual = FakeTranscript('en', False, 'manual')
+        self.generated = FakeTranscript('en', True, 'generated')
+
+    def find_manually_created_transcript(self, codes):
+        return self.manual
+
+    def find_generated_transcript(self, codes):
+        return self.generated
+
+
+def _serve(resolver, languages):
+    """用假的字幕列表代替 list_transcripts(与真实实现一样写入字幕目录)"""
+    def transcript_list(video_id, force=False):
+        resolver.store.put_catalog(video_id, languages)
+        return FakeTranscriptList(), languages
+    resolver.transcript_list = transcript_list
+
+
+@pytest.fixture
+def resolver(tmp_path):
+    resolver = TranscriptResolver(TranscriptStore(path=str(tmp_path / 'transcripts.db')), SingleFlight(),
+                                  BackgroundRefresher(workers=1, top_n=0), speculative_targets=[])
+    _serve(resolver, LANGUAGES)
+    return resolver
+
+
+@pytest.mark.parametrize('source_generated', [False, True])
+def test_translation_plan_store_key_round_trip(source_generated):
+    plan = TranscriptPlan('en', source_generated, 'zh-Hans')
+    language_code, is_generated, translated_from = plan.store_key
+    assert (language_code, is_generated) == ('zh-Hans', True)
+    assert TranscriptPlan.from_store_key(language_code, is_generated, translated_from) == plan
+
+
+def test_translations_of_manual_and_generated_sources_are_stored_separately(resolver):
+    manual = resolver.translation('vid', 'en', 'zh-Hans')
+    generated = resolver.translation('vid', 'en', 'zh-Hans', source_generated=True)
+    assert manual['index'].text(0) == 'zh-Hans from manual'
+    assert generated['index'].text(0) == 'zh-Hans from generated'
+
+    # 两者都从存储中读取, 互不覆盖
+    resolver.transcript_list = None
+    assert resolver.translation('vid', 'en', 'zh-Hans')['index'].text(0) == 'zh-Hans from manual'
+    assert resolver.translation('vid', 'en', 'zh-Hans', source_generated=True)['index'].text(0) == \
+        'zh-Hans from generated'
+
+
+def test_load_translation_plan_keeps_source_track(resolver):
+    languages = [item for item in LANGUAGES if item['is_generated']]
+    _serve(resolver, languages)
+    assert resolve_plan(languages, ['zh-Hans']) == TranscriptPlan('en', True, 'zh-Hans')
+
+    entry, _ = resolver.load('vid', ['zh-Hans'])
+    assert entry['index'].text(0) == 'zh-Hans from generated'
+
+    # 第二次请求经由存储的别名和字幕返回
+    resolver.transcript_list = None
+    entry, _ = resolver.load('vid', ['zh-Hans'])
+    assert entry['index'].text(0) == 'zh-Hans from generated'
+    alias = resolver.store.get_alias('vid', resolver._request_key(['zh-Hans']))
+    assert TranscriptPlan.from_store_key(*alias['key'][1:]) == TranscriptPlan('en', True, 'zh-Hans')
+
+
+def _language(code, generated=False, translatable=True):
+    return {'code': code, 'name': code, 'is_generated': generated, 'is_translatable': translatable}
+
+
+def test_language_variants_put_the_requested_language_first():
+    assert language_variants('en') == ['en', 'en-US', 'en-GB']
+    assert language_variants('en-GB') == ['en-GB', 'en', 'en-US']
+    assert language_variants('zh-Hant')[:2] == ['zh-Hant', 'zh-Hans']
+    assert language_variants('fr') == ['fr']
+
+
+@pytest.mark.parametrize('languages, requested, expected', [
+    # 请求的语言本身优先于其他变体, 同一语言人工字幕优先
+    ([_language('en-GB'), _language('en', True)], ['en'], TranscriptPlan('en', True)),
+    ([_language('en-US'), _language('en-GB')], ['en-GB'], TranscriptPlan('en-GB', False)),
+    # 行为变化(/api/subtitles): 只有变体时直接使用变体, 不再把它机器翻译为请求的语言
+    ([_language('en-GB')], ['en'], TranscriptPlan('en-GB', False)),
+    ([_language('en-US', True), _language('de')], ['en'], TranscriptPlan('en-US', True)),
+    ([_language('zh-Hans'), _language('zh-TW')], ['zh-TW'], TranscriptPlan('zh-TW', False)),
+    ([_language('zh-TW')], ['zh-Hans'], TranscriptPlan('zh-TW', False)),
+    # 其他语言不扩展变体: 翻译为请求的语言
+    ([_language('fr-CA'), _language('en')], ['fr'], TranscriptPlan('en', False, 'fr')),
+    # 多个请求语言按顺序查找
+    ([_language('de'), _language('en-GB')], ['ja', 'en'], TranscriptPlan('en-GB', False)),
+])
+def test_resolve_plan_variants(languages, requested, expected):
+    assert resolve_plan(languages, requested) == expected
+
+
+def test_subtitles_endpoint_serves_variant_track_for_en(monkeypatch):
+    import app
+
+    class GBList:
+        def find_manually_created_transcript(self, codes):
+            assert codes == ['en-GB']
+            return FakeTranscript('en-GB', False, 'british', language='English (United Kingdom)')
+
+        def find_generated_transcript(self, codes):
+            raise AssertionError('不应查找自动字幕')
+
+    languages = [_language('en-GB')]
+
+    def transcript_list(video_id, force=False):
+        app.transcript_store.put_catalog(video_id, languages)
+        return GBList(), languages
+
+    monkeypatch.setattr(app.transcript_resolver, 'transcript_list', transcript_list)
+    body = app.app.test_client().get('/api/subtitles/variantvid1?lang=en').get_json()
+    assert body['success'] is True
+    assert body['language'] == 'en-GB'
+    assert 'british' in body['subtitle_srt']
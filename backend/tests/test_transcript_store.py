@@ -0,0 +1,100 @@
+import sqlite3
+import time
+
+import pytest
+
+from transcript_index import TranscriptIndex
+from transcript_store import TranscriptStore
+
+SEGMENTS = [
+    {'text': 'hello', 'start': 0.0, 'duration': 1.5},
+    {'text': '世界', 'start': 1.5, 'duration': 2.0},
+]
+
+
+@pytest.fixture
+def make_store(tmp_path):
+    def make(**kwargs):
+        kwargs.setdefault('path', str(tmp_path / 'transcripts.db'))
+        return TranscriptStore(**kwargs)
+    return make
+
+
+def _index(text='hello'):
+    return TranscriptIndex.from_segments([dict(SEGMENTS[0], text=text), SEGMENTS[1]])
+
+
+def test_put_get_round_trip(make_store):
+    store = make_store()
+    store.put_transcript('vid', 'en', True, _index(), language_name='English')
+
+    # 新实例没有进程内副本, 从 SQLite 读取并解压
+    entry = make_store().get_transcript('vid', 'en', True)
+    assert entry['language_name'] == 'English'
+    assert entry['is_generated'] is True
+    assert entry['stale'] is False
+    assert entry['index'].to_segments() == SEGMENTS
+
+    assert make_store().get_transcript('vid', 'en', False) is None
+    assert make_store().get_transcript('vid', 'zh-Hans', True) is None
+
+
+def test_translated_from_is_part_of_key(make_store):
+    store = make_store()
+    store.put_transcript('vid', 'zh-Hans', True, _index('a'), translated_from='en')
+    store.put_transcript('vid', 'zh-Hans', True, _index('b'), translated_from='ja')
+
+    fresh = make_store()
+    assert fresh.get_transcript('vid', 'zh-Hans', True, 'en')['index'].text(0) == 'a'
+    assert fresh.get_transcript('vid', 'zh-Hans', True, 'ja')['index'].text(0) == 'b'
+
+
+def test_expired_entry_is_readable_only_within_stale_ttl(make_store):
+    store = make_store(stale_ttl=60)
+    store.put_transcript('fresh', 'en', False, _index())
+    store.put_transcript('stale', 'en', False, _index(), ttl=-10)
+    store.put_transcript('gone', 'en', False, _index(), ttl=-120)
+
+    for reader in (store, make_store(stale_ttl=60)):  # 进程内副本与 SQLite 两条路径
+        assert reader.get_transcript('fresh', 'en', False)['stale'] is False
+        assert reader.get_transcript('stale', 'en', False) is None
+        assert reader.get_transcript('stale', 'en', False, allow_stale=True)['stale'] is True
+        assert reader.get_transcript('gone', 'en', False, allow_stale=True) is None
+
+
+def test_evict_drops_expired_rows_and_least_recently_used(make_store):
+    store = make_store(max_entries=2, stale_ttl=60)
+    store.put_transcript('expired', 'en', False, _index(), ttl=-120)
+    for video_id in ('a', 'b', 'c'):
+        store.put_transcript(video_id, 'en', False, _index())
+        time.sleep(0.01)
+
+    store.evict()
+
+    remaining = {row[0] for row in sqlite3.connect(store.path).execute('SELECT video_id FROM transcripts')}
+    assert remaining == {'b', 'c'}
+
+
+def test_evict_runs_every_n_writes(make_store, monkeypatch):
+    store = make_store()
+    calls = []
+    monkeypatch.setattr(store, 'evict', lambda: calls.append(1))
+    for i in range(TranscriptStore.EVICT_EVERY * 2 + 1):
+        store.put_transcript(f'v{i}', 'en', False, _index())
+    assert len(calls) == 2
+
+
+def test_schema_version_change_resets_tables(make_store):
+    store = make_store()
+    store.put_transcript('vid', 'en', False, _index())
+    store.put_catalog('vid', [{'code': 'en', 'name': 'English'}])
+
+    conn = sqlite3.connect(store.path)
+    conn.execute(f'PRAGMA user_version={TranscriptStore.SCHEMA_VERSION - 1}')
+    conn.close()
+
+    fresh = make_store()
+    assert fresh.get_transcript('vid', 'en', False) is None
+    assert fresh.get_catalog('vid') is None
+    version = sqlite3.connect(store.path).execute('PRAGMA user_version').fetchone()[0]
+    assert version == TranscriptStore.SCHEMA_VERSION
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import upstream_http
+from upstream_http import ArchiveAdapter, UpstreamArchive
+
+
+class StubUpstream:
+    """本地上游: 返回请求路径和计数, status 可在测试中修改"""
+
+    def __init__(self):
+        self.status = 200
+        self.calls = 0
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                upstream.calls += 1
+                data = json.dumps({'path': self.path, 'call': upstream.calls}).encode()
+                self.send_response(upstream.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('Set-Cookie', 'session=secret')
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def upstream():
+    upstream = StubUpstream()
+    yield upstream
+    upstream.close()
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return UpstreamArchive(path=os.path.join(tmp_path, 'archive.db'), max_bytes=10 * 1024 * 1024, max_age=0)
+
+
+def _session(mode, archive):
+    session = requests.Session()
+    adapter = ArchiveAdapter(mode=mode, archive=archive)
+    session.mount('http://', adapter)
+    return session
+
+
+def test_request_key_ignores_volatile_headers_and_query_order():
+    a, url = upstream_http.request_key('get', 'HTTPS://Example.com:443/p?b=2&a=1#frag',
+                                       CaseInsensitiveDict({'G-Timestamp': '1', 'Accept-Language': 'en'}), None)
+    b, _ = upstream_http.request_key('GET', 'https://example.com/p?a=1&b=2',
+                                     CaseInsensitiveDict({'G-Timestamp': '2', 'accept-language': 'en'}), b'')
+    assert a == b
+    assert url == 'https://example.com/p?a=1&b=2'
+
+    c, _ = upstream_http.request_key('GET', 'https://example.com/p?a=1&b=2', {'accept-language': 'zh'}, None)
+    assert c != a
+
+
+def test_request_key_normalizes_json_bodies():
+    a, _ = upstream_http.request_key('POST', 'https://example.com/', {}, '{"b": 1, "a": 2}')
+    b, _ = upstream_http.request_key('POST', 'https://example.com/', {}, b'{"a":2,"b":1}')
+    assert a == b
+
+
+def test_record_then_replay_offline(upstream, archive):
+    recorded = _session('record', archive).get(f'{upstream.base_url}/video?id=1')
+    assert recorded.json()['call'] == 1
+    assert archive.stats()['entries'] == 1
+
+    upstream.close()
+    replayed = _session('replay', archive).get(f'{upstream.base_url}/video?id=1')
+    assert replayed.status_code == 200
+    assert replayed.json() == {'path': '/video?id=1', 'call': 1}
+    # 只保留白名单中的响应头
+    assert 'set-cookie' not in replayed.headers
+    assert replayed.headers['content-type'] == 'application/json'
+    assert archive.replayed == 1
+
+
+def test_replay_miss_is_a_connection_error(archive):
+    with pytest.raises(requests.exceptions.ConnectionError):
+        _session('replay', archive).get('http://127.0.0.1:9/missing')
+    assert archive.misses == 1
+
+
+def test_fallback_serves_archive_on_server_error(upstream, archive):
+    session = _session('fallback', archive)
+    assert session.get(f'{upstream.base_url}/info').json()['call'] == 1
+
+    upstream.status = 503
+    response = session.get(f'{upstream.base_url}/info')
+    assert response.status_code == 200
+    assert response.json()['call'] == 1
+    assert archive.fallbacks == 1
+
+    # 429 / 5xx 不写入归档, 也不覆盖已有的成功响应
+    upstream.status = 200
+    assert _session('replay', archive).get(f'{upstream.base_url}/info').json()['call'] == 1
+
+
+def test_rate_limited_responses_are_not_recorded(upstream, archive):
+    upstream.status = 429
+    assert _session('record', archive).get(f'{upstream.base_url}/busy').status_code == 429
+    assert archive.stats()['entries'] == 0
+
+
+def test_max_age_hides_old_entries(upstream, archive):
+    _session('record', archive).get(f'{upstream.base_url}/old')
+    archive.max_age = 1e-9
+    with pytest.raises(requests.exceptions.ConnectionError):
+        _session('replay', archive).get(f'{upstream.base_url}/old')
+
+
+def test_async_transport_shares_archive_with_sync_adapter(upstream, archive):
+    url = f'{upstream.base_url}/async?id=1'
+
+    async def fetch(mode):
+        transport = upstream_http.create_async_transport(mode=mode, archive=archive)
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.get(url)
+
+    recorded = asyncio.run(fetch('record'))
+    assert recorded.json()['call'] == 1
+
+    upstream.close()
+    replayed = asyncio.run(fetch('replay'))
+    assert replayed.json() == recorded.json()
+    assert _session('replay', archive).get(url).json() == recorded.json()
+
+    url = f'{upstream.base_url}/missing'
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(fetch('replay'))
+    assert archive.misses == 1
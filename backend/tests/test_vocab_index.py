@@ -0,0 +1,83 @@
+import pytest
+
+from transcript_index import TranscriptIndex
+from vocab_index import VocabIndex, lemmatize, tokenize
+
+
+@pytest.mark.parametrize('word, vocabulary, expected', [
+    # -ies / -ied -> -y
+    ('studies', {'study'}, 'study'),
+    ('studied', {'study'}, 'study'),
+    ('ties', {'tie'}, 'tie'),
+    # -es / -s, 但不拆 -ss
+    ('boxes', {'box'}, 'box'),
+    ('passes', {'pass'}, 'pass'),
+    ('cats', {'cat'}, 'cat'),
+    ('glass', {'glas'}, 'glass'),
+    # -ing / -ed, 含双写辅音和补 e
+    ('running', {'run'}, 'run'),
+    ('stopped', {'stop'}, 'stop'),
+    ('making', {'make'}, 'make'),
+    ('hoped', {'hope'}, 'hope'),
+    ('walked', {'walk'}, 'walk'),
+    # 太短的词不按后缀拆
+    ('bed', {'b'}, 'bed'),
+    ('sing', {'s'}, 'sing'),
+    # 推测的原形不在词表中时保持原样
+    ('news', None, 'news'),
+    ('running', None, 'running'),
+    ('studies', {'stud'}, 'studies'),
+    # 不规则变化直接查表
+    ('ran', None, 'run'),
+    ('children', None, 'child'),
+    ('was', {'wa'}, 'be'),
+])
+def test_lemmatize(word, vocabulary, expected):
+    assert lemmatize(word, vocabulary) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("Don't stop", ["don't", 'stop']),
+    # 弯引号规范化, 所有格 's 去掉
+    ('John’s car', ['john', 'car']),
+    ('route 66, k2!', ['route', 'k']),
+    ('Café  naïve', ['café', 'naïve']),
+    ('', []),
+])
+def test_tokenize(text, expected):
+    assert tokenize(text) == expected
+
+
+def _vocab(*texts):
+    index = TranscriptIndex.from_segments([
+        {'text': text, 'start': float(i), 'duration': 1.0} for i, text in enumerate(texts)
+    ])
+    return VocabIndex.build(index)
+
+
+def test_build_merges_forms_and_records_cues():
+    vocab = _vocab('I run every day', 'She was running fast', 'He ran; they run', 'Running!')
+    count, forms, cues = vocab.words['run']
+    assert count == 5
+    assert forms == ['run', 'running', 'ran']
+    # 同一条字幕只记录一次
+    assert list(cues) == [0, 1, 2, 3]
+
+    assert vocab.lookup('RUNS')[:2] == ('run', 5)
+    assert vocab.lookup('ran')[0] == 'run'
+    assert vocab.lookup('missing') is None
+    assert vocab.lookup('123') is None
+
+
+def test_ranking_ties_break_alphabetically():
+    vocab = _vocab('beta alpha gamma', 'gamma beta delta', 'alpha')
+    ranked = [(lemma, count) for lemma, count, _, _ in vocab.ranked()]
+    assert ranked == [('alpha', 2), ('beta', 2), ('gamma', 2), ('delta', 1)]
+
+
+def test_round_trip():
+    vocab = _vocab('studies studied', 'boxes')
+    restored = VocabIndex.from_bytes(vocab.to_bytes())
+    assert restored.digest == vocab.digest
+    assert restored.tokens == vocab.tokens == 3
+    assert restored.ranked() == vocab.ranked()
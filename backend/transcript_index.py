@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+字幕紧凑索引
+按列存储字幕: 开始时间数组、时长数组、UTF-8 文本块及其偏移量数组,
+支持按时间窗口二分查找,避免为长视频的每条字幕创建字典
+"""
+
+import hashlib
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Tuple
+
+# 序列化格式: 魔数, 版本, 字幕条数, 文本块字节数, 后接 starts / durations / offsets / blob
+_MAGIC = b'LSTI'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHII')
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+class TranscriptIndex:
+    """
+    字幕紧凑索引
+
+    - starts:    开始时间(秒), float64, 升序
+    - durations: 时长(秒), float64
+    - offsets:   第 i 条字幕文本位于 blob[offsets[i]:offsets[i + 1]], uint32
+    - blob:      所有字幕文本的 UTF-8 编码
+    """
+
+    __slots__ = ('starts', 'durations', 'offsets', 'blob', 'max_duration', '_digest')
+
+    def __init__(self, starts: array, durations: array, offsets: array, blob: bytes):
+        self.starts = starts
+        self.durations = durations
+        self.offsets = offsets
+        self.blob = blob
+        self.max_duration = max(durations) if durations else 0.0
+        self._digest = None
+
+    @classmethod
+    def from_segments(cls, segments: List[Dict]) -> 'TranscriptIndex':
+        """从 youtube_transcript_api 返回的 [{text, start, duration}] 构建索引"""
+        ordered = sorted(segments, key=lambda item: item['start'])
+
+        starts = array('d')
+        durations = array('d')
+        offsets = array('I', [0])
+        parts = []
+        position = 0
+        for item in ordered:
+            encoded = item['text'].encode('utf-8')
+            starts.append(float(item['start']))
+            durations.append(float(item['duration']))
+            parts.append(encoded)
+            position += len(encoded)
+            offsets.append(position)
+
+        return cls(starts, durations, offsets, b''.join(parts))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def text(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def segment(self, i: int) -> Dict:
+        return {'text': self.text(i), 'start': self.starts[i], 'duration': self.durations[i]}
+
+    def to_segments(self, lo: int = 0, hi: int = None) -> List[Dict]:
+        """转换为 [{text, start, duration}] 列表"""
+        hi = len(self) if hi is None else hi
+        return [self.segment(i) for i in range(lo, hi)]
+
+    def columns(self, lo: int = 0, hi: int = None) -> Tuple[bytes, bytes, bytes, bytes]:
+        """
+        [lo, hi) 区间的小端列数据
+
+        返回:
+            (starts float64, durations float64, offsets uint32(共 hi - lo + 1 个, 从 0 开始), UTF-8 文本块)
+        """
+        hi = len(self) if hi is None else hi
+        base, end = self.offsets[lo], self.offsets[hi]
+        offsets = self.offsets[lo:hi + 1]
+        if base:
+            offsets = array('I', [offset - base for offset in offsets])
+        return (
+            _little_endian(self.starts[lo:hi]),
+            _little_endian(self.durations[lo:hi]),
+            _little_endian(offsets),
+            self.blob[base:end],
+        )
+
+    def window(self, start: float, end: float) -> Tuple[int, int]:
+        """
+        查找与 [start, end) 时间区间重叠的字幕
+
+        返回:
+            (lo, hi) 下标区间; 包含所有重叠的字幕, 长字幕覆盖区间时夹在中间的不重叠短字幕也在其中
+        """
+        hi = bisect_left(self.starts, end)
+        # 只有开始时间晚于 start - max_duration 的字幕才可能覆盖到 start
+        lo = bisect_left(self.starts, start - self.max_duration, 0, hi)
+        while lo < hi and self.starts[lo] + self.durations[lo] <= start:
+            lo += 1
+        return lo, hi
+
+    def around(self, position: float, count: int) -> Tuple[int, int]:
+        """
+        查找播放位置附近的 count 条字幕(当前字幕居中)
+
+        返回:
+            (lo, hi) 下标区间
+        """
+        total = len(self)
+        count = max(0, min(count, total))
+        current = max(0, bisect_right(self.starts, position) - 1)
+        lo = max(0, min(current - count // 2, total - count))
+        return lo, lo + count
+
+    def nbytes(self) -> int:
+        """索引占用的近似字节数"""
+        return (len(self.blob) + self.starts.itemsize * len(self.starts) * 2
+                + self.offsets.itemsize * len(self.offsets))
+
+    def digest(self) -> str:
+        """字幕内容的摘要(内容相同则摘要相同), 首次调用后缓存"""
+        if self._digest is None:
+            self._digest = hashlib.blake2b(self.to_bytes(), digest_size=16).hexdigest()
+        return self._digest
+
+    def to_bytes(self) -> bytes:
+        """序列化为小端字节串"""
+        return b''.join([
+            _HEADER.pack(_MAGIC, _VERSION, len(self), len(self.blob)),
+            _little_endian(self.starts),
+            _little_endian(self.durations),
+            _little_endian(self.offsets),
+            self.blob,
+        ])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'TranscriptIndex':
+        """从 to_bytes 的结果恢复索引"""
+        magic, version, count, blob_size = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("无法识别的字幕索引格式")
+
+        position = _HEADER.size
+        starts = _from_little_endian('d', data[position:position + 8 * count])
+        position += 8 * count
+        durations = _from_little_endian('d', data[position:position + 8 * count])
+        position += 8 * count
+        offsets = _from_little_endian('I', data[position:position + 4 * (count + 1)])
+        position += 4 * (count + 1)
+        blob = bytes(data[position:position + blob_size])
+        return cls(starts, durations, offsets, blob)
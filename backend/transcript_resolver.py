@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+字幕语言解析
+根据视频的字幕目录,把请求的语言列表解析为具体的字幕或翻译(解析计划),
+字幕目录和解析计划都会缓存,/api/subtitles、/api/video-timestamps、/api/languages 共用
+"""
+
+import logging
+import os
+import time
+from functools import partial
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from youtube_transcript_api import NotTranslatable, TranslationLanguageNotAvailable
+# list_transcripts 每次新建 Session, 直接使用 TranscriptListFetcher 以便请求经过上游 HTTP 层并复用连接
+from youtube_transcript_api._transcripts import TranscriptListFetcher
+
+import metrics
+import upstream_http
+from cache import BoundedCache
+from transcript_index import TranscriptIndex
+from transcript_store import parse_translation_source, translation_source
+
+logger = logging.getLogger(__name__)
+
+# 语言变体: 请求其中任意一种时按顺序尝试
+ZH_VARIANTS = ['zh-Hans', 'zh-Hant', 'zh', 'zh-CN', 'zh-TW', 'zh-HK', 'zh-SG']
+EN_VARIANTS = ['en', 'en-US', 'en-GB']
+
+
+def language_variants(lang: str) -> List[str]:
+    """请求的语言及其变体, 请求的语言本身优先"""
+    if lang.startswith('zh'):
+        variants = ZH_VARIANTS
+    elif lang.startswith('en'):
+        variants = EN_VARIANTS
+    else:
+        variants = []
+    return [lang] + [v for v in variants if v != lang]
+
+
+def describe_languages(transcript_list) -> List[Dict]:
+    """将字幕列表转换为可序列化的语言信息(字幕目录)"""
+    return [
+        {
+            'code': t.language_code,
+            'name': t.language,
+            'is_generated': t.is_generated,
+            'is_translatable': t.is_translatable
+        }
+        for t in transcript_list
+    ]
+
+
+class TranscriptPlan(NamedTuple):
+    """
+    解析计划: 使用哪条字幕, 是否需要翻译
+
+    - language_code / is_generated: 源字幕
+    - translate_to: 翻译目标语言, 不翻译时为空字符串
+
+    翻译字幕的 is_generated 恒为 True(与 youtube_transcript_api 一致), 存储中按源语言及源字幕是否自动生成区分翻译
+    """
+    language_code: str
+    is_generated: bool
+    translate_to: str = ''
+
+    @property
+    def store_key(self) -> Tuple[str, bool, str]:
+        """对应的字幕存储键 (language_code, is_generated, translated_from)"""
+        if self.translate_to:
+            return self.translate_to, True, translation_source(self.language_code, self.is_generated)
+        return self.language_code, self.is_generated, ''
+
+    @classmethod
+    def from_store_key(cls, language_code: str, is_generated: bool, translated_from: str) -> 'TranscriptPlan':
+        if translated_from:
+            source_code, source_generated = parse_translation_source(translated_from)
+            return cls(source_code, source_generated, language_code)
+        return cls(language_code, is_generated)
+
+
+def _find(languages: List[Dict], codes: List[str]) -> Optional[Dict]:
+    """与 TranscriptList.find_transcript 相同的查找顺序: 按语言优先级, 人工字幕优先"""
+    for code in codes:
+        for generated in (False, True):
+            for item in languages:
+                if item['code'] == code and item['is_generated'] == generated:
+                    return item
+    return None
+
+
+def resolve_plan(languages: List[Dict], requested: List[str]) -> TranscriptPlan:
+    """
+    根据字幕目录解析请求的语言
+
+    1. 按顺序查找请求的语言(含变体)
+    2. 都没有时翻译为第一个请求的语言, 优先以英文字幕为源
+    3. 无法翻译时使用第一个可用字幕
+    """
+    for lang in requested:
+        found = _find(languages, language_variants(lang))
+        if found is not None:
+            return TranscriptPlan(found['code'], found['is_generated'])
+
+    if not languages:
+        raise Exception("该视频没有可用的字幕")
+
+    target = requested[0] if requested else ''
+    source = _find(languages, EN_VARIANTS)
+    if source is None or not source['is_translatable']:
+        source = next((item for item in languages if item['is_translatable']), None)
+    if target and source is not None:
+        return TranscriptPlan(source['code'], source['is_generated'], target)
+
+    first = languages[0]
+    return TranscriptPlan(first['code'], first['is_generated'])
+
+
+class TranscriptResolver:
+    """
+    字幕解析与获取
+
+    - 字幕目录保存在 TranscriptStore 中(所有 worker 共享), 上游字幕列表对象在进程内短期缓存,
+      同一视频的多个接口只请求一次 list_transcripts
+    - 解析计划以别名形式保存在 TranscriptStore 中, 相同语言请求不再重复解析
+    - 过期的数据先返回, 同时在后台续期
+
+    参数:
+        store: TranscriptStore
+        flight: SingleFlight, 合并并发的上游请求
+        refresher: BackgroundRefresher
+        list_ttl: 上游字幕列表对象在进程内的缓存时间(秒)
+        speculative_targets: 预先翻译的目标语言, 为空时不预先翻译
+        search_index: TranscriptSearch, 返回的字幕会提交到后台建立搜索索引
+    """
+
+    # 同一字幕的预先翻译在该时间(秒)内只安排一次
+    SPECULATION_INTERVAL = 3600
+
+    def __init__(self, store, flight, refresher, list_ttl: Optional[float] = None,
+                 speculative_targets: Optional[List[str]] = None, search_index=None):
+        self.store = store
+        self.search_index = search_index
+        self.flight = flight
+        self.refresher = refresher
+        # 字幕列表和字幕内容的请求共用(字幕对象保留该 Session, fetch 时继续使用)
+        self.http = upstream_http.create_session()
+        self.list_ttl = list_ttl if list_ttl is not None else float(os.getenv('TRANSCRIPT_LIST_TTL', 600))
+        if speculative_targets is None:
+            speculative_targets = os.getenv('SPECULATIVE_TRANSLATIONS', '').split(',')
+        self.speculative_targets = [t.strip() for t in speculative_targets if t.strip()]
+        self._lists = BoundedCache(
+            max_entries=int(os.getenv('TRANSCRIPT_LIST_CACHE_ENTRIES', 64)),
+            sweep_interval=self.list_ttl,
+            name='transcript-lists',
+        )
+        self._speculated = BoundedCache(max_entries=4096, sweep_interval=self.SPECULATION_INTERVAL,
+                                        name='speculated-translations')
+
+    # ------------------------------------------------------------------
+    # 字幕目录
+    # ------------------------------------------------------------------
+
+    def transcript_list(self, video_id: str, force: bool = False):
+        """
+        获取上游字幕列表对象, 并缓存字幕目录
+
+        返回:
+            (transcript_list, languages) 元组
+        """
+        if not force:
+            cached = self._lists.get(video_id)
+            if cached is not None:
+                return cached
+
+        def load():
+            with metrics.upstream('list_transcripts'):
+                transcript_list = TranscriptListFetcher(self.http).fetch(video_id)
+            languages = describe_languages(transcript_list)
+            self.store.put_catalog(video_id, languages)
+            result = (transcript_list, languages)
+            self._lists.set(video_id, result, time.time() + self.list_ttl)
+            return result
+
+        return self.flight.do(f"list_transcripts:{video_id}", load)
+
+    def catalog(self, video_id: str) -> List[Dict]:
+        """获取字幕目录(可用语言列表)"""
+        catalog = self.store.get_catalog(video_id, allow_stale=True)
+        if catalog is None:
+            return self.transcript_list(video_id)[1]
+
+        refresh_key = f"list_transcripts:{video_id}"
+        refresh = partial(self.transcript_list, video_id, force=True)
+        self.refresher.touch(refresh_key, refresh, catalog['expires_at'])
+        if catalog['stale']:
+            self.refresher.schedule(refresh_key, refresh)
+        return catalog['languages']
+
+    # ------------------------------------------------------------------
+    # 解析计划
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _request_key(requested: List[str]) -> str:
+        return f"plan:{','.join(requested)}"
+
+    def _remember_plan(self, video_id: str, requested: List[str], plan: TranscriptPlan):
+        self.store.put_alias(video_id, self._request_key(requested), *plan.store_key)
+
+    def plan(self, video_id: str, requested: List[str], catalog: Dict) -> Tuple[TranscriptPlan, float, bool]:
+        """
+        读取或解析计划
+
+        参数:
+            catalog: TranscriptStore.get_catalog 的结果
+
+        返回:
+            (plan, expires_at, stale) 元组
+        """
+        alias = self.store.get_alias(video_id, self._request_key(requested), allow_stale=True)
+        if alias is not None:
+            return TranscriptPlan.from_store_key(*alias['key'][1:]), alias['expires_at'], alias['stale']
+
+        plan = resolve_plan(catalog['languages'], requested)
+        self._remember_plan(video_id, requested, plan)
+        return plan, catalog['expires_at'], catalog['stale']
+
+    # ------------------------------------------------------------------
+    # 字幕数据
+    # ------------------------------------------------------------------
+
+    def _open(self, video_id: str, transcript_list, plan: TranscriptPlan, languages: List[Dict]):
+        """
+        按计划取得上游字幕对象, 翻译不可用时退回第一个可用字幕
+
+        返回:
+            (transcript, plan) 元组
+        """
+        find = transcript_list.find_generated_transcript if plan.is_generated \
+            else transcript_list.find_manually_created_transcript
+        source = find([plan.language_code])
+        if not plan.translate_to:
+            return source, plan
+
+        try:
+            return source.translate(plan.translate_to), plan
+        except (NotTranslatable, TranslationLanguageNotAvailable) as e:
+            logger.info(f"视频 {video_id} 无法翻译为 {plan.translate_to}: {type(e).__name__}")
+            first = languages[0]
+            fallback = TranscriptPlan(first['code'], first['is_generated'])
+            return self._open(video_id, transcript_list, fallback, languages)
+
+    def fetch(self, video_id: str, transcript, translated_from: str = '', force: bool = False) -> TranscriptIndex:
+        """
+        获取字幕数据, 优先读取持久化存储
+
+        参数:
+            force: 忽略存储, 重新从 YouTube 获取
+        """
+        if not force:
+            cached = self.store.get_transcript(
+                video_id, transcript.language_code, transcript.is_generated, translated_from
+            )
+            if cached is not None:
+                return cached['index']
+
+        def load():
+            # 翻译字幕在 fetch 时才由 YouTube 翻译
+            with metrics.upstream('translate' if translated_from else 'fetch'):
+                segments = transcript.fetch()
+            index = TranscriptIndex.from_segments(segments)
+            self.store.put_transcript(
+                video_id, transcript.language_code, transcript.is_generated, index,
+                language_name=transcript.language, translated_from=translated_from
+            )
+            return index
+
+        flight_key = f"fetch:{video_id}:{transcript.language_code}:{int(transcript.is_generated)}:{translated_from}"
+        return self.flight.do(flight_key, load)
+
+    def load(self, video_id: str, requested: List[str], force: bool = False) -> Tuple[Dict, List[Dict]]:
+        """
+        按请求的语言获取字幕
+
+        字幕目录、解析计划和字幕都已存储时直接返回(已过期的旧数据同样返回, 并在后台续期),
+        否则从 YouTube 获取字幕列表, 按计划获取字幕数据
+
+        返回:
+            (entry, languages) 元组, entry 包含 language_code / language_name / is_generated /
+            translated_from / index
+        """
+        if not force:
+            catalog = self.store.get_catalog(video_id, allow_stale=True)
+            if catalog is not None:
+                plan, plan_expires_at, plan_stale = self.plan(video_id, requested, catalog)
+                entry = self.store.get_transcript(video_id, *plan.store_key, allow_stale=True)
+                if entry is not None:
+                    refresh_key = f"transcript:{video_id}:{self._request_key(requested)}"
+                    refresh = partial(self.load, video_id, requested, force=True)
+                    expires_at = min(plan_expires_at, catalog['expires_at'], entry['expires_at'])
+                    self.refresher.touch(refresh_key, refresh, expires_at)
+                    if plan_stale or catalog['stale'] or entry['stale']:
+                        self.refresher.schedule(refresh_key, refresh)
+                    self._after_load(video_id, entry, catalog['languages'])
+                    return entry, catalog['languages']
+
+        transcript_list, languages = self.transcript_list(video_id, force=force)
+        if not languages:
+            raise Exception("该视频没有可用的字幕")
+        transcript, plan = self._open(video_id, transcript_list, resolve_plan(languages, requested), languages)
+        logger.info(f"视频 {video_id} 请求 {requested} 使用字幕: {plan}")
+
+        translated_from = plan.store_key[2]
+        index = self.fetch(video_id, transcript, translated_from, force=force)
+        self._remember_plan(video_id, requested, plan)
+
+        entry = {
+            'language_code': transcript.language_code,
+            'language_name': transcript.language,
+            'is_generated': transcript.is_generated,
+            'translated_from': translated_from,
+            'index': index,
+        }
+        self._after_load(video_id, entry, languages)
+        return entry, languages
+
+    def _after_load(self, video_id: str, entry: Dict, languages: List[Dict]):
+        """返回字幕后的后台任务: 建立搜索索引, 预先翻译"""
+        if self.search_index is not None:
+            key = (video_id, entry['language_code'], entry['is_generated'], entry['translated_from'])
+            self.search_index.submit(key, entry['index'])
+        self._speculate(video_id, entry, languages)
+
+    # ------------------------------------------------------------------
+    # 翻译
+    # ------------------------------------------------------------------
+
+    def translation(self, video_id: str, source_code: str, target: str, source_generated: bool = False,
+                    force: bool = False) -> Dict:
+        """
+        获取翻译字幕, 按 (video_id, 源语言, 源字幕是否自动生成, 目标语言) 存储
+
+        返回:
+            包含 language_code / language_name / is_generated / translated_from / index 的字典
+        """
+        translated_from = translation_source(source_code, source_generated)
+        if not force:
+            cached = self.store.get_transcript(video_id, target, True, translated_from)
+            if cached is not None:
+                return cached
+
+        transcript_list, _ = self.transcript_list(video_id)
+        find = transcript_list.find_generated_transcript if source_generated \
+            else transcript_list.find_manually_created_transcript
+        transcript = find([source_code]).translate(target)
+        index = self.fetch(video_id, transcript, translated_from, force=force)
+        if self.search_index is not None:
+            self.search_index.submit((video_id, target, True, translated_from), index)
+        return {
+            'language_code': transcript.language_code,
+            'language_name': transcript.language,
+            'is_generated': transcript.is_generated,
+            'translated_from': translated_from,
+            'index': index,
+        }
+
+    def _speculate(self, video_id: str, entry: Dict, languages: List[Dict]):
+        """返回原文字幕后, 在后台预先翻译为 speculative_targets 中的语言"""
+        if not self.speculative_targets or entry['translated_from']:
+            return
+
+        source_code = entry['language_code']
+        for target in self.speculative_targets:
+            # 只有请求该语言时会翻译当前字幕, 才值得预先翻译
+            plan = resolve_plan(languages, [target])
+            if (plan.translate_to != target or plan.language_code != source_code
+                    or plan.is_generated != entry['is_generated']):
+                continue
+
+            translated_from = translation_source(source_code, plan.is_generated)
+            key = f"translate:{video_id}:{translated_from}:{target}"
+            if self._speculated.get(key) is not None:
+                continue
+            self._speculated.set(key, True, time.time() + self.SPECULATION_INTERVAL)
+            self.refresher.schedule(key, partial(self.translation, video_id, source_code, target, plan.is_generated))
+
+    def stats(self) -> Dict:
+        """进程内字幕列表缓存统计信息"""
+        return self._lists.stats()
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""
+字幕持久化存储
+基于 SQLite 的跨 worker 字幕缓存,所有 gunicorn worker 和重启后的进程共享同一个文件
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import profiling
+from transcript_index import TranscriptIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'transcripts.db')
+
+# 字幕唯一键: (video_id, language_code, is_generated, translated_from)
+TranscriptKey = Tuple[str, str, bool, str]
+
+# 翻译字幕的 translated_from 为源语言代码, 源字幕为自动生成时加上该后缀,
+# 同一语言的人工字幕和自动字幕翻译出的结果分开存储
+GENERATED_SOURCE_SUFFIX = ':auto'
+
+
+def translation_source(language_code: str, is_generated: bool) -> str:
+    """翻译字幕的 translated_from 存储值"""
+    return f'{language_code}{GENERATED_SOURCE_SUFFIX}' if is_generated else language_code
+
+
+def parse_translation_source(translated_from: str) -> Tuple[str, bool]:
+    """translated_from 存储值 -> (源语言代码, 源字幕是否自动生成)"""
+    if translated_from.endswith(GENERATED_SOURCE_SUFFIX):
+        return translated_from[:-len(GENERATED_SOURCE_SUFFIX)], True
+    return translated_from, False
+
+
+class TranscriptStore:
+    """
+    SQLite 字幕存储
+
+    - transcripts: 已获取的字幕(TranscriptIndex 紧凑格式),按 (video_id, language_code, is_generated, translated_from) 存储
+    - catalogs:    视频的可用字幕语言列表
+    - aliases:     请求参数 -> 实际命中字幕键的映射,重复请求无需再次调用 list_transcripts
+
+    由字幕派生的词汇索引与字幕存储在同一行,字幕更新或淘汰时一起失效。
+
+    每条记录都有过期时间,过期后在 stale_ttl 内仍可作为旧数据读取(stale-while-revalidate),
+    超过容量上限时按最近访问时间淘汰。
+    最近读取的字幕索引在进程内保留少量副本,避免重复解压。
+    """
+
+    # 表结构版本,格式变化时丢弃旧缓存
+    SCHEMA_VERSION = 4
+
+    # 访问时间的刷新间隔,避免每次读取都触发写操作
+    TOUCH_INTERVAL = 60.0
+
+    # 每写入多少次检查一次容量
+    EVICT_EVERY = 20
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None,
+                 catalog_ttl: Optional[float] = None, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None, stale_ttl: Optional[float] = None):
+        self.path = path or os.getenv('TRANSCRIPT_STORE_PATH', DEFAULT_STORE_PATH)
+        self.ttl = ttl if ttl is not None else float(os.getenv('TRANSCRIPT_TTL', 7 * 24 * 3600))
+        self.catalog_ttl = catalog_ttl if catalog_ttl is not None else float(os.getenv('TRANSCRIPT_CATALOG_TTL', 24 * 3600))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv('TRANSCRIPT_STORE_MAX_ENTRIES', 5000))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv('TRANSCRIPT_STORE_MAX_BYTES', 200 * 1024 * 1024))
+        self.stale_ttl = stale_ttl if stale_ttl is not None else float(os.getenv('TRANSCRIPT_STALE_TTL', 24 * 3600))
+
+        # 每个线程(以及 fork 后的每个进程)使用独立连接
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+        # 进程内的热点字幕索引
+        self.hot_entries = int(os.getenv('TRANSCRIPT_HOT_ENTRIES', 32))
+        self._hot = OrderedDict()
+        self._hot_lock = threading.Lock()
+
+        # 字幕读取统计(stale 计入 stale_hits)
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    # ------------------------------------------------------------------
+    # 连接管理
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=10000')
+        self._init_schema(conn)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @classmethod
+    def _init_schema(cls, conn: sqlite3.Connection):
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != cls.SCHEMA_VERSION:
+            conn.executescript("""
+                DROP TABLE IF EXISTS transcripts;
+                DROP TABLE IF EXISTS catalogs;
+                DROP TABLE IF EXISTS aliases;
+            """)
+            conn.execute(f'PRAGMA user_version={cls.SCHEMA_VERSION}')
+
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS transcripts (
+                video_id TEXT NOT NULL,
+                language_code TEXT NOT NULL,
+                is_generated INTEGER NOT NULL,
+                translated_from TEXT NOT NULL DEFAULT '',
+                language_name TEXT NOT NULL DEFAULT '',
+                data BLOB NOT NULL,
+                vocab BLOB,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (video_id, language_code, is_generated, translated_from)
+            );
+            CREATE INDEX IF NOT EXISTS idx_transcripts_access ON transcripts(last_access);
+            CREATE TABLE IF NOT EXISTS catalogs (
+                video_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS aliases (
+                video_id TEXT NOT NULL,
+                request_key TEXT NOT NULL,
+                language_code TEXT NOT NULL,
+                is_generated INTEGER NOT NULL,
+                translated_from TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (video_id, request_key)
+            );
+        """)
+
+    # ------------------------------------------------------------------
+    # 字幕数据
+    # ------------------------------------------------------------------
+
+    def _readable(self, expires_at: float, now: float, allow_stale: bool) -> bool:
+        if expires_at > now:
+            return True
+        return allow_stale and expires_at + self.stale_ttl > now
+
+    @profiling.timed('cache')
+    def get_transcript(self, video_id: str, language_code: str, is_generated: bool,
+                       translated_from: str = '', allow_stale: bool = False) -> Optional[Dict]:
+        """
+        读取字幕
+
+        参数:
+            allow_stale: 是否返回已过期但仍在 stale_ttl 内的字幕
+
+        返回:
+            包含 language_code / language_name / is_generated / translated_from / index /
+            expires_at / stale 的字典, 不存在或已过期时返回 None
+        """
+        key = (video_id, language_code, bool(is_generated), translated_from or '')
+        now = time.time()
+
+        with self._hot_lock:
+            hot = self._hot.get(key)
+            if hot is not None and self._readable(hot['expires_at'], now, allow_stale):
+                self._hot.move_to_end(key)
+                if hot['expires_at'] <= now:
+                    self.stale_hits += 1
+                else:
+                    self.hits += 1
+                return dict(hot['entry'], expires_at=hot['expires_at'], stale=hot['expires_at'] <= now)
+
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT language_name, data, expires_at, last_access FROM transcripts '
+                'WHERE video_id=? AND language_code=? AND is_generated=? AND translated_from=?',
+                (video_id, language_code, int(bool(is_generated)), translated_from or '')
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取字幕缓存失败: {e}")
+            self._count(None)
+            return None
+
+        if row is None:
+            self._count(None)
+            return None
+
+        language_name, data, expires_at, last_access = row
+        if not self._readable(expires_at, now, allow_stale):
+            self._count(None)
+            return None
+
+        if now - last_access > self.TOUCH_INTERVAL:
+            try:
+                conn.execute(
+                    'UPDATE transcripts SET last_access=? '
+                    'WHERE video_id=? AND language_code=? AND is_generated=? AND translated_from=?',
+                    (now, video_id, language_code, int(bool(is_generated)), translated_from or '')
+                )
+            except sqlite3.Error:
+                pass
+
+        entry = {
+            'language_code': language_code,
+            'language_name': language_name,
+            'is_generated': bool(is_generated),
+            'translated_from': translated_from or '',
+            'index': TranscriptIndex.from_bytes(zlib.decompress(data)),
+        }
+        self._remember_hot(key, entry, expires_at)
+        self._count(expires_at <= now)
+        return dict(entry, expires_at=expires_at, stale=expires_at <= now)
+
+    def _count(self, stale: Optional[bool]):
+        """记录一次字幕读取, stale 为 None 表示未命中"""
+        with self._hot_lock:
+            if stale is None:
+                self.misses += 1
+            elif stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+
+    def put_transcript(self, video_id: str, language_code: str, is_generated: bool,
+                       index: TranscriptIndex, language_name: str = '', translated_from: str = '',
+                       ttl: Optional[float] = None):
+        """写入字幕"""
+        data = zlib.compress(index.to_bytes())
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.ttl)
+
+        try:
+            self._connect().execute(
+                'INSERT OR REPLACE INTO transcripts '
+                '(video_id, language_code, is_generated, translated_from, language_name, data, size, '
+                ' created_at, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (video_id, language_code, int(bool(is_generated)), translated_from or '', language_name or '',
+                 data, len(data), now, expires_at, now)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"写入字幕缓存失败: {e}")
+            return
+
+        key = (video_id, language_code, bool(is_generated), translated_from or '')
+        self._remember_hot(key, {
+            'language_code': language_code,
+            'language_name': language_name or '',
+            'is_generated': bool(is_generated),
+            'translated_from': translated_from or '',
+            'index': index,
+        }, expires_at)
+        self._maybe_evict()
+
+    def _remember_hot(self, key: Tuple, entry: Dict, expires_at: float):
+        if self.hot_entries <= 0:
+            return
+        with self._hot_lock:
+            self._hot[key] = {'entry': entry, 'expires_at': expires_at}
+            self._hot.move_to_end(key)
+            while len(self._hot) > self.hot_entries:
+                self._hot.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # 词汇索引
+    # ------------------------------------------------------------------
+
+    @profiling.timed('cache')
+    def get_vocab(self, key: TranscriptKey) -> Optional[bytes]:
+        """读取与字幕一起存储的词汇索引(VocabIndex.to_bytes 格式), 没有时返回 None"""
+        video_id, language_code, is_generated, translated_from = key
+        try:
+            row = self._connect().execute(
+                'SELECT vocab FROM transcripts '
+                'WHERE video_id=? AND language_code=? AND is_generated=? AND translated_from=?',
+                (video_id, language_code, int(bool(is_generated)), translated_from or '')
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取词汇索引失败: {e}")
+            return None
+        return row[0] if row is not None else None
+
+    def put_vocab(self, key: TranscriptKey, data: bytes):
+        """把词汇索引写入对应字幕所在的行(字幕不存在时忽略)"""
+        video_id, language_code, is_generated, translated_from = key
+        try:
+            self._connect().execute(
+                'UPDATE transcripts SET vocab=?, size=length(data) + ? '
+                'WHERE video_id=? AND language_code=? AND is_generated=? AND translated_from=?',
+                (data, len(data), video_id, language_code, int(bool(is_generated)), translated_from or '')
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"写入词汇索引失败: {e}")
+
+    # ------------------------------------------------------------------
+    # 语言列表
+    # ------------------------------------------------------------------
+
+    @profiling.timed('cache')
+    def get_catalog(self, video_id: str, allow_stale: bool = False) -> Optional[Dict]:
+        """
+        读取视频的可用字幕语言列表
+
+        返回:
+            {'languages': [...], 'expires_at': ..., 'stale': bool}, 不存在或已过期时返回 None
+        """
+        try:
+            row = self._connect().execute(
+                'SELECT data, expires_at FROM catalogs WHERE video_id=?', (video_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取语言列表缓存失败: {e}")
+            return None
+
+        now = time.time()
+        if row is None or not self._readable(row[1], now, allow_stale):
+            return None
+        return {'languages': json.loads(row[0]), 'expires_at': row[1], 'stale': row[1] <= now}
+
+    def put_catalog(self, video_id: str, languages: List[Dict], ttl: Optional[float] = None):
+        """写入视频的可用字幕语言列表"""
+        expires_at = time.time() + (ttl if ttl is not None else self.catalog_ttl)
+        try:
+            self._connect().execute(
+                'INSERT OR REPLACE INTO catalogs (video_id, data, expires_at) VALUES (?, ?, ?)',
+                (video_id, json.dumps(languages, ensure_ascii=False), expires_at)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"写入语言列表缓存失败: {e}")
+
+    # ------------------------------------------------------------------
+    # 请求别名
+    # ------------------------------------------------------------------
+
+    @profiling.timed('cache')
+    def get_alias(self, video_id: str, request_key: str, allow_stale: bool = False) -> Optional[Dict]:
+        """
+        读取请求参数对应的字幕键
+
+        返回:
+            {'key': TranscriptKey, 'expires_at': ..., 'stale': bool}, 不存在或已过期时返回 None
+        """
+        try:
+            row = self._connect().execute(
+                'SELECT language_code, is_generated, translated_from, expires_at FROM aliases '
+                'WHERE video_id=? AND request_key=?', (video_id, request_key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取请求别名失败: {e}")
+            return None
+
+        now = time.time()
+        if row is None or not self._readable(row[3], now, allow_stale):
+            return None
+        return {'key': (video_id, row[0], bool(row[1]), row[2]), 'expires_at': row[3], 'stale': row[3] <= now}
+
+    def put_alias(self, video_id: str, request_key: str, language_code: str, is_generated: bool,
+                  translated_from: str = ''):
+        """记录请求参数对应的字幕键,有效期与语言列表一致"""
+        expires_at = time.time() + self.catalog_ttl
+        try:
+            self._connect().execute(
+                'INSERT OR REPLACE INTO aliases '
+                '(video_id, request_key, language_code, is_generated, translated_from, expires_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (video_id, request_key, language_code, int(bool(is_generated)), translated_from or '', expires_at)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"写入请求别名失败: {e}")
+
+    # ------------------------------------------------------------------
+    # 快照
+    # ------------------------------------------------------------------
+
+    def export_recent(self, limit: int) -> Dict:
+        """
+        导出最近访问的 limit 条未过期字幕, 以及这些视频的语言列表和请求别名(见 cache_snapshot.py)
+
+        返回:
+            {'transcripts': [...], 'catalogs': [...], 'aliases': [...]}, 字幕按最近访问时间从新到旧排列,
+            data 为压缩后的原始数据
+        """
+        now = time.time()
+        conn = self._connect()
+        transcripts = conn.execute(
+            'SELECT video_id, language_code, is_generated, translated_from, language_name, data, expires_at '
+            'FROM transcripts WHERE expires_at > ? ORDER BY last_access DESC LIMIT ?', (now, max(0, limit))
+        ).fetchall()
+
+        video_ids = list(dict.fromkeys(row[0] for row in transcripts))
+        catalogs, aliases = [], []
+        # SQLite 单条语句的参数个数有限, 分批查询
+        for start in range(0, len(video_ids), 500):
+            batch = video_ids[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            catalogs += conn.execute(
+                f'SELECT video_id, data, expires_at FROM catalogs '
+                f'WHERE expires_at > ? AND video_id IN ({placeholders})', (now, *batch)
+            ).fetchall()
+            aliases += conn.execute(
+                f'SELECT video_id, request_key, language_code, is_generated, translated_from, expires_at '
+                f'FROM aliases WHERE expires_at > ? AND video_id IN ({placeholders})', (now, *batch)
+            ).fetchall()
+
+        return {
+            'transcripts': [list(row) for row in transcripts],
+            'catalogs': [list(row) for row in catalogs],
+            'aliases': [list(row) for row in aliases],
+        }
+
+    def import_rows(self, rows: Dict) -> int:
+        """
+        写入 export_recent() 导出的记录(保留原有的过期时间), 跳过已过期的记录, 已有的记录不覆盖
+
+        返回:
+            写入的字幕数
+        """
+        now = time.time()
+        transcripts = [row for row in rows.get('transcripts', []) if row[6] > now]
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            before = conn.total_changes
+            conn.executemany(
+                'INSERT OR IGNORE INTO transcripts '
+                '(video_id, language_code, is_generated, translated_from, language_name, data, size, '
+                ' created_at, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                # 导出顺序为从新到旧, 最近访问时间依次递减以保持原有顺序
+                [(v, lang, int(bool(gen)), tf, name, data, len(data), now, exp, now - i * 1e-3)
+                 for i, (v, lang, gen, tf, name, data, exp) in enumerate(transcripts)]
+            )
+            restored = conn.total_changes - before
+            conn.executemany(
+                'INSERT OR IGNORE INTO catalogs (video_id, data, expires_at) VALUES (?, ?, ?)',
+                [row for row in rows.get('catalogs', []) if row[2] > now]
+            )
+            conn.executemany(
+                'INSERT OR IGNORE INTO aliases '
+                '(video_id, request_key, language_code, is_generated, translated_from, expires_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [row for row in rows.get('aliases', []) if row[5] > now]
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return restored
+
+    # ------------------------------------------------------------------
+    # 淘汰
+    # ------------------------------------------------------------------
+
+    def _maybe_evict(self):
+        with self._writes_lock:
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY != 0:
+                return
+        self.evict()
+
+    def evict(self):
+        """删除超过 stale_ttl 的过期记录,并按最近访问时间淘汰超出容量的字幕"""
+        cutoff = time.time() - self.stale_ttl
+        try:
+            conn = self._connect()
+            conn.execute('DELETE FROM transcripts WHERE expires_at <= ?', (cutoff,))
+            conn.execute('DELETE FROM catalogs WHERE expires_at <= ?', (cutoff,))
+            conn.execute('DELETE FROM aliases WHERE expires_at <= ?', (cutoff,))
+
+            count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM transcripts').fetchone()
+            if count <= self.max_entries and total <= self.max_bytes:
+                return
+
+            evicted = 0
+            rows = conn.execute(
+                'SELECT video_id, language_code, is_generated, translated_from, size '
+                'FROM transcripts ORDER BY last_access ASC'
+            ).fetchall()
+            for video_id, language_code, is_generated, translated_from, size in rows:
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                conn.execute(
+                    'DELETE FROM transcripts '
+                    'WHERE video_id=? AND language_code=? AND is_generated=? AND translated_from=?',
+                    (video_id, language_code, is_generated, translated_from)
+                )
+                count -= 1
+                total -= size
+                evicted += 1
+
+            logger.info(f"字幕缓存淘汰 {evicted} 条记录")
+        except sqlite3.Error as e:
+            logger.warning(f"字幕缓存淘汰失败: {e}")
+
+    def stats(self) -> Dict:
+        """存储统计信息"""
+        try:
+            count, total = self._connect().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM transcripts'
+            ).fetchone()
+        except sqlite3.Error:
+            count, total = 0, 0
+        return {
+            'path': self.path,
+            'entries': count,
+            'bytes': total,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hot_entries': len(self._hot),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+上游 HTTP 层
+SnapAny、YouTube 字幕和释义接口的 HTTP 请求都经过这一层, 按 UPSTREAM_HTTP_MODE 工作:
+
+- live(默认): 直接请求上游
+- record: 请求上游, 并把规范化后的请求和响应写入归档
+- replay: 只从归档返回, 未归档的请求按连接失败处理(离线运行、可重复的性能测试)
+- fallback: 请求上游并记录; 连接失败、超时、429 或 5xx 时改用归档中的响应
+
+归档是一个 SQLite 文件(UPSTREAM_ARCHIVE_PATH), 以规范化请求的哈希为键, 响应体 zlib 压缩。
+签名、时间戳和认证等每次都不同的请求头不参与匹配, 也不写入归档。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from http.client import responses as HTTP_REASONS
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MODES = ('live', 'record', 'replay', 'fallback')
+
+DEFAULT_ARCHIVE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'upstream.db')
+
+# 参与匹配的请求头(其余请求头如 G-Timestamp / G-Footer / Authorization 不影响响应内容)
+MATCH_HEADERS = ('accept-language',)
+
+# 写入归档的响应头
+KEEP_HEADERS = ('content-type', 'cache-control', 'expires', 'last-modified', 'etag')
+
+
+def get_mode() -> str:
+    mode = os.getenv('UPSTREAM_HTTP_MODE', 'live').lower()
+    if mode not in MODES:
+        logger.warning(f"未知的 UPSTREAM_HTTP_MODE={mode}, 使用 live")
+        return 'live'
+    return mode
+
+
+def canonical_url(url: str) -> str:
+    """协议和主机名小写, 去掉默认端口和片段, 查询参数排序"""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f'{host}:{parts.port}'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+def canonical_body(body) -> bytes:
+    """JSON 请求体按键排序后重新序列化, 其他请求体原样使用"""
+    if body is None:
+        return b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if not isinstance(body, (bytes, bytearray)):
+        # 生成器等流式请求体无法规范化, 不参与匹配
+        return b''
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return bytes(body)
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def request_key(method: str, url: str, headers, body) -> Tuple[str, str]:
+    """
+    规范化请求
+
+    返回:
+        (键, 规范化 URL) 元组
+    """
+    url = canonical_url(url)
+    digest = hashlib.sha256()
+    digest.update(f'{method.upper()} {url}\n'.encode('utf-8'))
+    for name in MATCH_HEADERS:
+        digest.update(f'{name}:{headers.get(name, "")}\n'.encode('utf-8'))
+    digest.update(canonical_body(body))
+    return digest.hexdigest(), url
+
+
+def recordable(status: int) -> bool:
+    """成功和确定的"不存在"才写入归档, 限流和服务端错误不写"""
+    return status < 400 or status in (404, 410)
+
+
+def upstream_failed(status: int) -> bool:
+    """fallback 模式下改用归档的状态码"""
+    return status == 429 or status >= 500
+
+
+def _keep_headers(headers) -> Dict[str, str]:
+    return {name: headers[name] for name in KEEP_HEADERS if name in headers}
+
+
+class UpstreamArchive:
+    """
+    SQLite 请求/响应归档
+
+    超过容量上限时按记录时间淘汰最旧的条目; max_age 大于 0 时, 更早记录的条目不再用于回放。
+    """
+
+    SCHEMA_VERSION = 1
+
+    # 每写入多少次检查一次容量
+    EVICT_EVERY = 50
+
+    def __init__(self, path: Optional[str] = None, max_bytes: Optional[int] = None,
+                 max_age: Optional[float] = None):
+        self.path = path or os.getenv('UPSTREAM_ARCHIVE_PATH', DEFAULT_ARCHIVE_PATH)
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv('UPSTREAM_ARCHIVE_MAX_BYTES', 500 * 1024 * 1024))
+        self.max_age = max_age if max_age is not None else float(os.getenv('UPSTREAM_ARCHIVE_MAX_AGE', 0))
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        # 统计
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    # ------------------------------------------------------------------
+    # 连接管理
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=10000')
+        self._init_schema(conn)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @classmethod
+    def _init_schema(cls, conn: sqlite3.Connection):
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != cls.SCHEMA_VERSION:
+            conn.execute('DROP TABLE IF EXISTS exchanges')
+            conn.execute(f'PRAGMA user_version={cls.SCHEMA_VERSION}')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS exchanges (
+                key TEXT PRIMARY KEY,
+                method TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                recorded_at REAL NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_exchanges_recorded ON exchanges(recorded_at)')
+
+    # ------------------------------------------------------------------
+    # 读写
+    # ------------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[Dict]:
+        try:
+            row = self._connect().execute(
+                'SELECT status, headers, body, recorded_at FROM exchanges WHERE key = ?', (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取上游归档失败: {e}")
+            return None
+        if row is None or (self.max_age > 0 and time.time() - row[3] > self.max_age):
+            return None
+        return {'status': row[0], 'headers': json.loads(row[1]), 'body': zlib.decompress(row[2])}
+
+    def put(self, key: str, method: str, url: str, status: int, headers: Dict[str, str], body: bytes):
+        data = zlib.compress(body, 6)
+        try:
+            self._connect().execute(
+                'INSERT OR REPLACE INTO exchanges (key, method, url, status, headers, body, size, recorded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, method.upper(), url, status, json.dumps(headers), data, len(data), time.time())
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"写入上游归档失败: {e}")
+            return
+        self.count('recorded')
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+        if evict:
+            self._evict()
+
+    def _evict(self):
+        """超过容量上限时删除最旧的条目"""
+        conn = self._connect()
+        try:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM exchanges').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            removed = 0
+            for key, size in conn.execute('SELECT key, size FROM exchanges ORDER BY recorded_at').fetchall():
+                if total <= self.max_bytes * 0.9:
+                    break
+                conn.execute('DELETE FROM exchanges WHERE key = ?', (key,))
+                total -= size
+                removed += 1
+            logger.info(f"上游归档超过容量上限, 已删除 {removed} 条最旧的记录")
+        except sqlite3.Error as e:
+            logger.warning(f"清理上游归档失败: {e}")
+
+    def count(self, result: str):
+        with self._lock:
+            if result == 'recorded':
+                self.recorded += 1
+            elif result == 'replayed':
+                self.replayed += 1
+            elif result == 'miss':
+                self.misses += 1
+            elif result == 'fallback':
+                self.fallbacks += 1
+        metrics.inc('upstream_archive_total', {'result': result})
+
+    def entries(self, limit: int = 100) -> List[Dict]:
+        rows = self._connect().execute(
+            'SELECT method, url, status, size, recorded_at FROM exchanges ORDER BY recorded_at DESC LIMIT ?',
+            (limit,)
+        ).fetchall()
+        return [{'method': r[0], 'url': r[1], 'status': r[2], 'size': r[3], 'recorded_at': r[4]} for r in rows]
+
+    def stats(self) -> Dict:
+        try:
+            entries, size = self._connect().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM exchanges'
+            ).fetchone()
+        except sqlite3.Error:
+            entries, size = 0, 0
+        with self._lock:
+            return {
+                'mode': get_mode(),
+                'entries': entries,
+                'bytes': size,
+                'recorded': self.recorded,
+                'replayed': self.replayed,
+                'misses': self.misses,
+                'fallbacks': self.fallbacks,
+            }
+
+
+_archive: Optional[UpstreamArchive] = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> UpstreamArchive:
+    """进程内共享的归档(首次使用时打开)"""
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = UpstreamArchive()
+    return _archive
+
+
+def stats() -> Dict:
+    if get_mode() == 'live' and _archive is None:
+        return {'mode': 'live'}
+    return get_archive().stats()
+
+
+# ----------------------------------------------------------------------
+# requests
+# ----------------------------------------------------------------------
+
+class ArchiveAdapter(HTTPAdapter):
+    """按 UPSTREAM_HTTP_MODE 记录或回放的 requests 传输层"""
+
+    def __init__(self, mode: Optional[str] = None, archive: Optional[UpstreamArchive] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.mode = mode or get_mode()
+        self._archive = archive
+
+    @property
+    def archive(self) -> UpstreamArchive:
+        return self._archive or get_archive()
+
+    def send(self, request, **kwargs):
+        if self.mode == 'live':
+            return super().send(request, **kwargs)
+
+        key, url = request_key(request.method, request.url, request.headers, request.body)
+        if self.mode == 'replay':
+            stored = self.archive.get(key)
+            if stored is None:
+                self.archive.count('miss')
+                raise requests.exceptions.ConnectionError(f"上游归档中没有该请求: {request.method} {url}",
+                                                          request=request)
+            self.archive.count('replayed')
+            return self._replay(request, stored)
+
+        try:
+            response = super().send(request, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            stored = self.archive.get(key) if self.mode == 'fallback' else None
+            if stored is None:
+                raise
+            logger.warning(f"上游请求失败, 使用归档: {request.method} {url}")
+            self.archive.count('fallback')
+            return self._replay(request, stored)
+
+        if self.mode == 'fallback' and upstream_failed(response.status_code):
+            stored = self.archive.get(key)
+            if stored is not None:
+                logger.warning(f"上游返回 {response.status_code}, 使用归档: {request.method} {url}")
+                self.archive.count('fallback')
+                response.close()
+                return self._replay(request, stored)
+
+        if recordable(response.status_code):
+            self.archive.put(key, request.method, url, response.status_code,
+                             _keep_headers(response.headers), response.content)
+        return response
+
+    def _replay(self, request, stored: Dict) -> requests.Response:
+        response = requests.Response()
+        response.status_code = stored['status']
+        response.reason = HTTP_REASONS.get(stored['status'], '')
+        response.headers = CaseInsensitiveDict(stored['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = stored['body']
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+
+def create_session(pool_maxsize: int = 20) -> requests.Session:
+    """经过上游 HTTP 层的 requests.Session(带连接池)"""
+    session = requests.Session()
+    adapter = ArchiveAdapter(pool_connections=10, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# ----------------------------------------------------------------------
+# httpx
+# ----------------------------------------------------------------------
+
+def create_async_transport(mode: Optional[str] = None, archive: Optional[UpstreamArchive] = None, **kwargs):
+    """
+    经过上游 HTTP 层的 httpx 异步传输层
+
+    参数:
+        mode / archive: 与 ArchiveAdapter 相同, 默认按 UPSTREAM_HTTP_MODE 使用进程内共享的归档
+        kwargs: 传给 httpx.AsyncHTTPTransport(如 limits)
+    """
+    import httpx
+
+    class AsyncArchiveTransport(httpx.AsyncBaseTransport):
+        def __init__(self, mode: str, archive: Optional[UpstreamArchive]):
+            self.mode = mode
+            self._archive = archive
+            self._transport = httpx.AsyncHTTPTransport(**kwargs)
+
+        async def handle_async_request(self, request):
+            if self.mode == 'live':
+                return await self._transport.handle_async_request(request)
+
+            archive = self._archive or get_archive()
+            key, url = request_key(request.method, str(request.url), request.headers, await request.aread())
+            if self.mode == 'replay':
+                stored = await asyncio.to_thread(archive.get, key)
+                if stored is None:
+                    archive.count('miss')
+                    raise httpx.ConnectError(f"上游归档中没有该请求: {request.method} {url}", request=request)
+                archive.count('replayed')
+                return self._replay(request, stored)
+
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TransportError:
+                stored = await asyncio.to_thread(archive.get, key) if self.mode == 'fallback' else None
+                if stored is None:
+                    raise
+                logger.warning(f"上游请求失败, 使用归档: {request.method} {url}")
+                archive.count('fallback')
+                return self._replay(request, stored)
+
+            if self.mode == 'fallback' and upstream_failed(response.status_code):
+                stored = await asyncio.to_thread(archive.get, key)
+                if stored is not None:
+                    logger.warning(f"上游返回 {response.status_code}, 使用归档: {request.method} {url}")
+                    archive.count('fallback')
+                    await response.aclose()
+                    return self._replay(request, stored)
+
+            if not recordable(response.status_code):
+                return response
+
+            # 读取(并解压)响应体后写入归档, 返回的响应不再带 Content-Encoding
+            body = await response.aread()
+            await asyncio.to_thread(archive.put, key, request.method, url, response.status_code,
+                                    _keep_headers(response.headers), body)
+            headers = [(name, value) for name, value in response.headers.items()
+                       if name.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')]
+            return httpx.Response(response.status_code, headers=headers, content=body, request=request,
+                                  extensions=response.extensions)
+
+        @staticmethod
+        def _replay(request, stored: Dict):
+            return httpx.Response(stored['status'], headers=stored['headers'], content=stored['body'],
+                                  request=request)
+
+        async def aclose(self):
+            await self._transport.aclose()
+
+    return AsyncArchiveTransport(mode or get_mode(), archive)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='查看上游归档')
+    parser.add_argument('--path', help='归档文件(默认 UPSTREAM_ARCHIVE_PATH)')
+    parser.add_argument('--limit', type=int, default=50, help='列出的最近条目数')
+    args = parser.parse_args()
+
+    archive = UpstreamArchive(path=args.path)
+    summary = archive.stats()
+    print(f"{archive.path}: {summary['entries']} 条, {summary['bytes'] / 1024:.1f} KiB")
+    for entry in archive.entries(args.limit):
+        recorded = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['recorded_at']))
+        print(f"{recorded}  {entry['status']}  {entry['size']:>8}  {entry['method']} {entry['url']}")
+
+
+if __name__ == '__main__':
+    main()
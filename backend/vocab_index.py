@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+字幕词汇索引
+把一条字幕分词一次,建立 词元 -> 字幕下标 的倒排索引并统计词频,
+"跳到每次出现的位置" 和 "本视频单词表" 只需查表,无需在设备上重新扫描全部字幕
+"""
+
+import json
+import os
+import re
+import zlib
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import profiling
+from cache import BoundedCache
+from transcript_index import TranscriptIndex
+
+# 单词: 字母序列, 允许中间带撇号(don't / it's)
+_WORD = re.compile(r"[^\W\d_]+(?:['’][^\W\d_]+)*")
+
+# 常见不规则变化
+IRREGULAR = {
+    'am': 'be', 'is': 'be', 'are': 'be', 'was': 'be', 'were': 'be', 'been': 'be', 'being': 'be',
+    'has': 'have', 'had': 'have', 'having': 'have',
+    'does': 'do', 'did': 'do', 'done': 'do', 'doing': 'do',
+    'went': 'go', 'gone': 'go', 'goes': 'go',
+    'said': 'say', 'says': 'say', 'made': 'make', 'got': 'get', 'gotten': 'get',
+    'took': 'take', 'taken': 'take', 'came': 'come', 'saw': 'see', 'seen': 'see',
+    'knew': 'know', 'known': 'know', 'thought': 'think', 'told': 'tell', 'found': 'find',
+    'gave': 'give', 'given': 'give', 'felt': 'feel', 'left': 'leave', 'kept': 'keep',
+    'began': 'begin', 'begun': 'begin', 'brought': 'bring', 'bought': 'buy', 'wrote': 'write',
+    'written': 'write', 'ran': 'run', 'ate': 'eat', 'eaten': 'eat', 'spoke': 'speak',
+    'spoken': 'speak', 'children': 'child', 'men': 'man', 'women': 'woman', 'people': 'person',
+    'feet': 'foot', 'teeth': 'tooth', 'mice': 'mouse', 'better': 'good', 'best': 'good',
+    'worse': 'bad', 'worst': 'bad',
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """分词并规范化(小写, 去掉所有格 's)"""
+    words = []
+    for match in _WORD.finditer(text):
+        word = match.group(0).lower().replace('’', "'")
+        if word.endswith("'s"):
+            word = word[:-2]
+        if word:
+            words.append(word)
+    return words
+
+
+def _candidates(word: str) -> Iterable[str]:
+    """按后缀规则推测的原形, 越可靠的越靠前"""
+    if word.endswith('ies') and len(word) > 4:
+        yield word[:-3] + 'y'
+    if word.endswith('ied') and len(word) > 4:
+        yield word[:-3] + 'y'
+    if word.endswith('es') and len(word) > 3:
+        yield word[:-2]
+    if word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+        yield word[:-1]
+    for suffix in ('ing', 'ed'):
+        if word.endswith(suffix) and len(word) > len(suffix) + 2:
+            stem = word[:-len(suffix)]
+            yield stem
+            yield stem + 'e'
+            # running -> run, stopped -> stop
+            if len(stem) > 2 and stem[-1] == stem[-2]:
+                yield stem[:-1]
+
+
+def lemmatize(word: str, vocabulary: Optional[set] = None) -> str:
+    """
+    规范化词元
+
+    不规则变化查表; 规则变化只有推测的原形也出现在 vocabulary 中时才合并,
+    避免在没有词典的情况下把 "news" 变成 "new"
+    """
+    if word in IRREGULAR:
+        return IRREGULAR[word]
+    if vocabulary:
+        for candidate in _candidates(word):
+            if candidate in vocabulary:
+                return candidate
+    return word
+
+
+class VocabIndex:
+    """
+    一条字幕的词汇倒排索引
+
+    - digest: 对应字幕内容的摘要
+    - tokens: 单词总数
+    - words:  词元 -> (出现次数, 出现过的词形, 出现的字幕下标 array('I'))
+    """
+
+    __slots__ = ('digest', 'tokens', 'words', '_form_lemmas')
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, digest: str, tokens: int, words: Dict[str, Tuple[int, List[str], array]]):
+        self.digest = digest
+        self.tokens = tokens
+        self.words = words
+        self._form_lemmas = None
+
+    @classmethod
+    @profiling.timed('format')
+    def build(cls, index: TranscriptIndex) -> 'VocabIndex':
+        """分词并建立倒排索引"""
+        cue_tokens = [tokenize(index.text(i)) for i in range(len(index))]
+        vocabulary = {word for tokens in cue_tokens for word in tokens}
+        # 不规则变化的原形也可以作为规则变化的合并目标(ran -> run, 于是 running -> run)
+        vocabulary |= {IRREGULAR[word] for word in vocabulary if word in IRREGULAR}
+        lemmas = {word: lemmatize(word, vocabulary) for word in vocabulary}
+
+        words: Dict[str, Tuple[int, List[str], array]] = {}
+        total = 0
+        for cue, tokens in enumerate(cue_tokens):
+            for word in tokens:
+                total += 1
+                lemma = lemmas[word]
+                entry = words.get(lemma)
+                if entry is None:
+                    entry = words[lemma] = [0, [], array('I')]
+                entry[0] += 1
+                if word not in entry[1]:
+                    entry[1].append(word)
+                if not entry[2] or entry[2][-1] != cue:
+                    entry[2].append(cue)
+
+        return cls(index.digest(), total, {k: (v[0], v[1], v[2]) for k, v in words.items()})
+
+    def lookup(self, word: str) -> Optional[Tuple[str, int, List[str], array]]:
+        """
+        查找单词(任意词形)
+
+        返回:
+            (词元, 出现次数, 词形, 字幕下标), 未出现时返回 None
+        """
+        tokens = tokenize(word)
+        if not tokens:
+            return None
+        if self._form_lemmas is None:
+            self._form_lemmas = {form: lemma for lemma, (_, forms, _) in self.words.items() for form in forms}
+
+        token = tokens[0]
+        lemma = self._form_lemmas.get(token) or IRREGULAR.get(token, token)
+        if lemma not in self.words:
+            lemma = lemmatize(token, self.words.keys())
+        if lemma not in self.words:
+            return None
+        count, forms, cues = self.words[lemma]
+        return lemma, count, forms, cues
+
+    def ranked(self) -> List[Tuple[str, int, List[str], array]]:
+        """按出现次数从高到低排列的 (词元, 出现次数, 词形, 字幕下标)"""
+        items = [(lemma, count, forms, cues) for lemma, (count, forms, cues) in self.words.items()]
+        items.sort(key=lambda item: (-item[1], item[0]))
+        return items
+
+    def nbytes(self) -> int:
+        """近似字节数"""
+        return sum(len(lemma) + 16 * len(forms) + 4 * len(cues) + 64
+                   for lemma, (_, forms, cues) in self.words.items())
+
+    def to_bytes(self) -> bytes:
+        """序列化(zlib 压缩的 JSON)"""
+        data = {
+            'v': self.FORMAT_VERSION,
+            'digest': self.digest,
+            'tokens': self.tokens,
+            'words': {lemma: [count, forms, cues.tolist()] for lemma, (count, forms, cues) in self.words.items()},
+        }
+        return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'VocabIndex':
+        """从 to_bytes 的结果恢复索引"""
+        decoded = json.loads(zlib.decompress(data))
+        if decoded.get('v') != cls.FORMAT_VERSION:
+            raise ValueError("无法识别的词汇索引格式")
+        words = {lemma: (count, forms, array('I', cues)) for lemma, (count, forms, cues) in decoded['words'].items()}
+        return cls(decoded['digest'], decoded['tokens'], words)
+
+
+class VocabCache:
+    """
+    词汇索引缓存: 进程内按字幕内容摘要缓存, 同时与字幕一起保存在 TranscriptStore 中
+
+    参数:
+        store: TranscriptStore
+        max_entries: 每个 worker 在内存中缓存的索引数
+    """
+
+    def __init__(self, store, max_entries: Optional[int] = None):
+        self.store = store
+        self._cache = BoundedCache(
+            max_entries=max_entries if max_entries is not None else int(os.getenv('VOCAB_CACHE_MAX_ENTRIES', 128)),
+            sweep_interval=0,
+            name='vocab-cache',
+        )
+
+    def get(self, key: Tuple[str, str, bool, str], index: TranscriptIndex) -> VocabIndex:
+        """
+        读取字幕的词汇索引, 没有时建立并保存
+
+        参数:
+            key: 字幕存储键 (video_id, language_code, is_generated, translated_from)
+        """
+        digest = index.digest()
+        vocab = self._cache.get(digest)
+        if vocab is not None:
+            return vocab
+
+        data = self.store.get_vocab(key)
+        if data is not None:
+            try:
+                vocab = VocabIndex.from_bytes(data)
+            except ValueError:
+                vocab = None
+            # 字幕已更新, 旧索引作废
+            if vocab is not None and vocab.digest != digest:
+                vocab = None
+
+        if vocab is None:
+            vocab = VocabIndex.build(index)
+            self.store.put_vocab(key, vocab.to_bytes())
+
+        self._cache.set(digest, vocab, float('inf'), size=vocab.nbytes())
+        return vocab
+
+    def stats(self) -> Dict:
+        return self._cache.stats()
@@ -8,8 +8,16 @@ import requests
 import hashlib
 import time
 import logging
+from functools import partial
 from typing import Dict, List, Optional
 
+import metrics
+import upstream_http
+from media_cache import MediaURLCache
+from singleflight import AsyncSingleFlight, SingleFlight
+from rate_limiter import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, UpstreamScheduler, create_snapany_scheduler
+from refresher import BackgroundRefresher
+
 logger = logging.getLogger(__name__)
 
 
@@ -20,21 +28,27 @@ class IIILabYouTubeService:
     BASE_URL = "https://api.snapany.com/v1/extract"
     SALT = "6HTugjCXxR"  # 新 API 的密钥
     
-    def __init__(self):
-        self.session = requests.Session()
+    def __init__(self, flight: Optional[SingleFlight] = None, scheduler: Optional[UpstreamScheduler] = None,
+                 cache: Optional[MediaURLCache] = None, refresher: Optional[BackgroundRefresher] = None):
+        self.session = upstream_http.create_session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
             'Content-Type': 'application/json',
             'Accept': 'application/json',
         })
         
-        # 频率控制
-        self.last_request_time = 0
-        self.min_request_interval = 3.0  # 最小请求间隔3秒
+        # 频率控制(令牌桶,所有线程和 worker 共享)
+        self.min_request_interval = 3.0  # 平均请求间隔3秒
+        self.scheduler = scheduler or create_snapany_scheduler(self.min_request_interval)
+        
+        # 解析结果缓存,有效期由播放地址的 expire 参数决定
+        self.cache = cache if cache is not None else MediaURLCache()
         
-        # 简单内存缓存
-        self.cache = {}
-        self.cache_ttl = 600  # 缓存10分钟
+        # 后台刷新(可选): 过期结果先返回旧数据并在后台续期, 热门视频提前刷新
+        self.refresher = refresher
+        
+        # 合并相同视频的并发解析请求
+        self.flight = flight or SingleFlight()
     
     def _generate_signature(self, timestamp: int, url: str, language: str = "en") -> str:
         """
@@ -60,76 +74,133 @@ class IIILabYouTubeService:
         
         return signature
     
-    def _wait_for_rate_limit(self):
-        """等待以满足频率限制"""
-        elapsed = time.time() - self.last_request_time
-        if elapsed < self.min_request_interval:
-            wait_time = self.min_request_interval - elapsed
-            time.sleep(wait_time)
-        self.last_request_time = time.time()
+    def _wait_for_rate_limit(self, priority: int = PRIORITY_INTERACTIVE, max_wait: Optional[float] = None) -> float:
+        """
+        获取上游请求许可
+
+        排队已满或等待时间超过 max_wait(默认使用调度器配置)时抛出 RateLimitExceeded
+        """
+        return self.scheduler.acquire(priority, max_wait)
     
-    def _get_cache_key(self, youtube_url: str) -> str:
-        """生成缓存键"""
-        # 提取 video ID 作为缓存键
+    def _canonical_id(self, youtube_url: str) -> str:
+        """提取规范化的视频 ID,无法识别时使用 URL 的哈希"""
         import re
         match = re.search(r'(?:v=|/)([0-9A-Za-z_-]{11})', youtube_url)
         if match:
-            return f"video_{match.group(1)}"
-        return f"video_{hashlib.md5(youtube_url.encode()).hexdigest()}"
+            return match.group(1)
+        return hashlib.md5(youtube_url.encode()).hexdigest()
+    
+    def _get_cache_key(self, youtube_url: str) -> str:
+        """生成缓存键"""
+        # 提取 video ID 作为缓存键
+        return f"video_{self._canonical_id(youtube_url)}"
     
-    def extract_video_info(self, youtube_url: str) -> Dict:
+    def extract_video_info(self, youtube_url: str, priority: int = PRIORITY_INTERACTIVE,
+                           max_wait: Optional[float] = None) -> Dict:
         """
         提取 YouTube 视频信息（带缓存和频率控制）
         
         Args:
             youtube_url: YouTube 视频 URL
+            priority: 上游请求优先级
+            max_wait: 等待频率限制的最长时间(秒), 默认使用调度器配置
             
         Returns:
             包含视频信息的字典
         """
         # 1. 检查缓存
         cache_key = self._get_cache_key(youtube_url)
-        if cache_key in self.cache:
-            cached_data, timestamp = self.cache[cache_key]
-            if time.time() - timestamp < self.cache_ttl:
-                return cached_data
-            else:
-                # 缓存过期
-                del self.cache[cache_key]
+        cached_data = self._get_cached(youtube_url, cache_key)
+        if cached_data is not None:
+            return cached_data
+        
+        # 2. 相同视频的并发请求只解析一次
+        flight_key = f"snapany_extract:{self._canonical_id(youtube_url)}"
+        return self.flight.do(flight_key, self._extract_uncached, youtube_url, cache_key, priority, max_wait)
+    
+    def refresh(self, youtube_url: str) -> Dict:
+        """忽略缓存重新解析(后台刷新使用,优先级最低)"""
+        cache_key = self._get_cache_key(youtube_url)
+        flight_key = f"snapany_extract:{self._canonical_id(youtube_url)}"
+        return self.flight.do(flight_key, self._extract_uncached, youtube_url, cache_key, PRIORITY_BACKGROUND)
+    
+    def _get_cached(self, youtube_url: str, cache_key: str) -> Optional[Dict]:
+        """
+        读取缓存
+        
+        配置了后台刷新时, 刚过期但地址仍有效的结果会直接返回, 同时在后台续期
+        """
+        if self.refresher is None:
+            return self.cache.get(cache_key)
         
-        # 2. 频率限制等待
-        self._wait_for_rate_limit()
+        entry = self.cache.get_entry(cache_key)
+        if entry is None:
+            return None
         
-        try:
-            # 使用毫秒级时间戳（新 API 要求）
-            timestamp = int(time.time() * 1000)
-            language = "en"  # 语言代码
-            
-            # 准备请求数据（新 API 使用 link 参数）
-            payload = {
-                "link": youtube_url
-            }
-            
-            # 添加签名头
-            signature = self._generate_signature(timestamp, youtube_url, language)
-            headers = {
-                'G-Timestamp': str(timestamp),
-                'G-Footer': signature,
-                'Accept-Language': language,  # 新 API 要求
-            }
+        refresh_key = f"snapany_extract:{self._canonical_id(youtube_url)}"
+        refresh = partial(self.refresh, youtube_url)
+        self.refresher.touch(refresh_key, refresh, entry['expires_at'])
+        if entry['stale']:
+            self.refresher.schedule(refresh_key, refresh)
+        return entry['value']
+    
+    def _build_request(self, youtube_url: str):
+        """
+        构造 SnapAny 请求
+        
+        Returns:
+            (payload, headers) 元组
+        """
+        # 使用毫秒级时间戳（新 API 要求）
+        timestamp = int(time.time() * 1000)
+        language = "en"  # 语言代码
+        
+        # 准备请求数据（新 API 使用 link 参数）
+        payload = {
+            "link": youtube_url
+        }
+        
+        # 添加签名头
+        signature = self._generate_signature(timestamp, youtube_url, language)
+        headers = {
+            'G-Timestamp': str(timestamp),
+            'G-Footer': signature,
+            'Accept-Language': language,  # 新 API 要求
+        }
+        return payload, headers
+    
+    def _handle_data(self, data: Dict, cache_key: str) -> Dict:
+        """解析响应数据并写入缓存"""
+        # API 直接返回数据，没有 code/msg 包装
+        if 'text' in data or 'medias' in data:
+            result = self._parse_response(data)
             
+            # 保存到缓存(播放地址即将过期时不缓存)
+            self.cache.set(cache_key, result)
             
-            # 调试：输出请求详情
+            return result
+        else:
+            # 如果有错误信息
+            error_msg = data.get('msg') or data.get('error') or data.get('message') or 'Unknown error'
+            raise Exception(f"API 返回错误: {error_msg}")
+    
+    def _extract_uncached(self, youtube_url: str, cache_key: str, priority: int,
+                          max_wait: Optional[float] = None) -> Dict:
+        """请求 SnapAny 解析视频并写入缓存"""
+        # 频率限制
+        self._wait_for_rate_limit(priority, max_wait)
+        
+        try:
+            payload, headers = self._build_request(youtube_url)
             
             # 发送请求
-            response = self.session.post(
-                self.BASE_URL,
-                json=payload,
-                headers=headers,
-                timeout=30
-            )
-            
-            # 调试：输出响应详情
+            with metrics.upstream('snapany.extract'):
+                response = self.session.post(
+                    self.BASE_URL,
+                    json=payload,
+                    headers=headers,
+                    timeout=30
+                )
             
             # 如果是 400 错误,记录响应内容
             if response.status_code == 400:
@@ -140,27 +211,10 @@ class IIILabYouTubeService:
                     pass
             
             response.raise_for_status()
-            data = response.json()
-            
-            # 调试：输出完整响应
-            
-            # API 直接返回数据，没有 code/msg 包装
-            if 'text' in data or 'medias' in data:
-                result = self._parse_response(data)
-                
-                # 3. 保存到缓存
-                self.cache[cache_key] = (result, time.time())
-                
-                return result
-            else:
-                # 如果有错误信息
-                error_msg = data.get('msg') or data.get('error') or data.get('message') or 'Unknown error'
-                raise Exception(f"API 返回错误: {error_msg}")
+            return self._handle_data(response.json(), cache_key)
                 
         except requests.exceptions.RequestException as e:
             raise Exception(f"网络请求失败: {str(e)}")
-        except Exception as e:
-            raise
     
     def _parse_response(self, data: Dict) -> Dict:
         """解析 API 响应数据"""
@@ -241,6 +295,64 @@ class IIILabYouTubeService:
         return video_info
 
 
+class AsyncIIILabYouTubeService:
+    """
+    SnapAny 异步客户端
+    
+    与同步服务共享缓存、签名、解析逻辑和频率控制,
+    使用带连接池的 httpx.AsyncClient 发送请求(仅 ASGI 模式使用)
+    """
+    
+    def __init__(self, service: IIILabYouTubeService, max_connections: int = 20):
+        import httpx
+        
+        self.service = service
+        self.flight = AsyncSingleFlight()
+        self.client = httpx.AsyncClient(
+            headers=dict(service.session.headers),
+            timeout=30,
+            transport=upstream_http.create_async_transport(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            ),
+        )
+    
+    async def extract_video_info(self, youtube_url: str, priority: int = PRIORITY_INTERACTIVE) -> Dict:
+        """异步提取 YouTube 视频信息（带缓存和频率控制）"""
+        cache_key = self.service._get_cache_key(youtube_url)
+        cached_data = self.service._get_cached(youtube_url, cache_key)
+        if cached_data is not None:
+            return cached_data
+        
+        flight_key = f"snapany_extract:{self.service._canonical_id(youtube_url)}"
+        return await self.flight.do(flight_key, self._extract_uncached, youtube_url, cache_key, priority)
+    
+    async def _extract_uncached(self, youtube_url: str, cache_key: str, priority: int) -> Dict:
+        import httpx
+        
+        await self.service.scheduler.acquire_async(priority)
+        
+        try:
+            payload, headers = self.service._build_request(youtube_url)
+            with metrics.upstream('snapany.extract'):
+                response = await self.client.post(self.service.BASE_URL, json=payload, headers=headers)
+            
+            if response.status_code == 400:
+                try:
+                    logger.error(f"API 400 错误: {response.json()}")
+                except ValueError:
+                    pass
+            
+            response.raise_for_status()
+            return self.service._handle_data(response.json(), cache_key)
+        
+        except httpx.HTTPError as e:
+            raise Exception(f"网络请求失败: {str(e)}")
+    
+    async def aclose(self):
+        """关闭连接池"""
+        await self.client.aclose()
+
+
 def extract_video_id(url: str) -> Optional[str]:
     """从 YouTube URL 中提取视频 ID"""
     import re